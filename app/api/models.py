@@ -1,5 +1,6 @@
+from datetime import datetime
 from pydantic import BaseModel, Field
-from typing import List, Optional
+from typing import Any, Dict, List, Optional, Literal
 
 class UploadStatus(BaseModel):
     status: str
@@ -13,14 +14,73 @@ class HealthResponse(BaseModel):
     status: str
     providers: List[HealthProvider] = []
 
+class ChunkFilters(BaseModel):
+    """Restrict retrieval to chunks of matching documents (all given conditions apply)."""
+    sources: Optional[List[str]] = None  # document file names, e.g. "brochure.pdf"
+    doc_hashes: Optional[List[str]] = None  # sha256 of the uploaded file
+    page_from: Optional[int] = Field(default=None, ge=1)  # PDF pages overlapping [page_from, page_to]
+    page_to: Optional[int] = Field(default=None, ge=1)
+    uploaded_after: Optional[datetime] = None
+    uploaded_before: Optional[datetime] = None
+
+    def to_kwargs(self) -> Dict[str, Any]:
+        return self.model_dump(exclude_none=True)
+
 class QueryRequest(BaseModel):
     client_id: int = Field(..., ge=1)
     question: str = Field(..., min_length=3, max_length=4000)
     top_k: Optional[int] = Field(default=5, ge=1, le=20)
+    # 'llm' asks the LLM (falling back to extractive on deadline); 'extractive'
+    # skips the LLM and answers from the retrieved sentences directly
+    mode: Literal['llm', 'extractive'] = 'llm'
+    deadline_ms: Optional[int] = Field(default=None, ge=100, le=120000)
+    # 'lexical' (BM25, no embedding model), 'dense' (FAISS) or 'hybrid' (fused)
+    retrieval: Literal['dense', 'lexical', 'hybrid'] = 'dense'
+    filters: Optional[ChunkFilters] = None
 
 class QuerySource(BaseModel):
     key: str
+    source: Optional[str] = None
+    page_start: Optional[int] = None
+    page_end: Optional[int] = None
+    start: Optional[int] = None
+    end: Optional[int] = None
+    doc_hash: Optional[str] = None
+    uploaded_at: Optional[datetime] = None
 
 class QueryResponse(BaseModel):
     answer: str
     sources: List[str]
+    mode: Optional[str] = None
+    prompt_tokens: Optional[int] = None
+    prompt_tokens_saved: Optional[int] = None
+    # one entry per source, in the same order: where each chunk came from
+    provenance: List[QuerySource] = []
+    # only set for requests traced with the X-Debug header (see app/debug.py)
+    debug: Optional[Dict[str, Any]] = None
+
+class SearchRequest(BaseModel):
+    client_id: int = Field(..., ge=1)
+    question: str = Field(..., min_length=3, max_length=4000)
+    # providers to search; omitted searches every provider with a built index
+    providers: Optional[List[str]] = Field(default=None, min_length=1)
+    top_k: Optional[int] = Field(default=10, ge=1, le=50)
+    filters: Optional[ChunkFilters] = None
+
+class SearchHit(BaseModel):
+    provider: str
+    key: str
+    text: str
+    start: Optional[int] = None
+    end: Optional[int] = None
+    score: float
+    provenance: Optional[QuerySource] = None
+
+class SearchResponse(BaseModel):
+    hits: List[SearchHit]
+    providers_searched: int
+    # providers that could not be searched, with the reason
+    errors: Dict[str, str] = {}
+    # 'l2' (distance under `model`, lower is better) or 'rrf' (fused across models, higher is better)
+    score_kind: str = 'l2'
+    model: Optional[str] = None
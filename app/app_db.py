@@ -58,3 +58,26 @@ def get_client_provider_index(client_id: int):
         return _pi.get_index_by_provider(sval)
     except Exception:
         return None
+
+
+def count_clients_by_provider():
+    """Return {provider name: number of clients assigned to it}."""
+    with SqliteDict(str(APP_DB_PATH)) as d:
+        values = list(d.values())
+    index_map = None
+    counts = {}
+    for val in values:
+        sval = str(val)
+        if sval.isdigit():
+            if index_map is None:
+                try:
+                    from . import provider_index as _pi
+
+                    index_map = _pi.load_index_map()
+                except Exception:
+                    index_map = {}
+            sval = index_map.get(sval)
+            if not sval:
+                continue
+        counts[sval] = counts.get(sval, 0) + 1
+    return counts
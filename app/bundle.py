@@ -0,0 +1,316 @@
+"""Portable provider bundles: build on one machine, serve on another.
+
+A bundle holds exactly what serving a provider needs, laid out like a
+provider directory so it can be served in place:
+
+    bundle.json          manifest: format version, provider, build id,
+                         embedding model, chunk count and a sha256 + size
+                         for every other file
+    db/metadata.sqlite   chunk store (text, offsets, provenance, vector_keys),
+                         copied with a VACUUM so it carries no free pages
+    index/...            faiss.bin or shards.json + shards/, vectors.npy,
+                         lexical.npz, chunk_meta.npz
+
+Source documents, `parsed/raw_text.txt` and the per-chunk `chunks/*.json`
+files are build-side artifacts (their content is in the sqlite store) and are
+left out. A bundle is a directory, or a `.tar` / `.tar.gz` of one.
+
+Importing unpacks (or, with `link=True`, references) a bundle under
+`PROVIDERS_DIR/.bundles/<provider>/<build_id>`, verifies it, then points
+`PROVIDERS_DIR/<provider>` at it with a symlink replaced atomically, so
+queries see either the previous build or the new one. The last BUNDLE_KEEP
+builds are kept for rollback. Set INDEX_MMAP=1 on serving nodes to map FAISS
+files from the bundle instead of reading them into memory. An imported
+provider is read-only: uploads, rebuilds and migrations refuse it
+(`check_writable`) rather than write into the release.
+"""
+import hashlib
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import tarfile
+import time
+import uuid
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from .config import BUNDLE_KEEP
+
+logger = logging.getLogger(__name__)
+
+MANIFEST = 'bundle.json'
+BUNDLES_DIR = '.bundles'
+FORMAT = 'rag-provider-bundle'
+FORMAT_VERSION = 1
+# index/ files a build writes; anything else there (tmp files) is not exported
+INDEX_FILES = ('faiss.bin', 'shards.json', 'vectors.npy', 'lexical.npz', 'chunk_meta.npz')
+
+
+class BundleError(Exception):
+    pass
+
+
+def _digest(f) -> Tuple[str, int]:
+    h, size = hashlib.sha256(), 0
+    for block in iter(lambda: f.read(1 << 20), b''):
+        h.update(block)
+        size += len(block)
+    return h.hexdigest(), size
+
+
+def _file_entry(path: Path) -> dict:
+    with open(path, 'rb') as f:
+        digest, size = _digest(f)
+    return {'size': size, 'sha256': digest}
+
+
+def _compact_sqlite(src: Path, dest: Path):
+    """Consistent, vacuumed copy of a sqlite file (safe while the source is open)."""
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    src_conn = sqlite3.connect(f'file:{src}?mode=ro', uri=True)
+    dest_conn = sqlite3.connect(str(dest))
+    try:
+        src_conn.backup(dest_conn)
+        dest_conn.execute('VACUUM')
+    finally:
+        dest_conn.close()
+        src_conn.close()
+
+
+def _read_build_info(db_path: Path) -> dict:
+    from sqlitedict import SqliteDict
+
+    with SqliteDict(str(db_path), flag='r') as db:
+        return {'embedding_model': db.get('embedding_model'), 'n_chunks': len(db.get('vector_keys', []))}
+
+
+def export_bundle(provider_dir: Path, out: Path, provider: Optional[str] = None) -> dict:
+    """Write a bundle of the built provider in `provider_dir` to `out` (a directory, .tar or .tar.gz)."""
+    from .provider_store import index_file
+    from .shards import read_manifest
+
+    provider = provider or provider_dir.name
+    index_dir = provider_dir / 'index'
+    db_path = provider_dir / 'db' / 'metadata.sqlite'
+    if not db_path.exists() or not index_file(index_dir).exists():
+        raise BundleError(f'provider {provider} has no built index in {provider_dir}')
+
+    archive = out.name.endswith(('.tar', '.tar.gz', '.tgz'))
+    staging = out.parent / f'.{out.name}.{uuid.uuid4().hex[:8]}'
+    staging.mkdir(parents=True)
+    try:
+        _compact_sqlite(db_path, staging / 'db' / 'metadata.sqlite')
+        names = [n for n in INDEX_FILES if (index_dir / n).exists()]
+        shard_manifest = read_manifest(index_dir) if index_file(index_dir).name != 'faiss.bin' else None
+        if shard_manifest is not None:
+            names = [n for n in names if n != 'faiss.bin'] + [s['file'] for s in shard_manifest['shards']]
+        else:
+            names = [n for n in names if n != 'shards.json']
+        for name in names:
+            (staging / 'index' / name).parent.mkdir(parents=True, exist_ok=True)
+            shutil.copy2(index_dir / name, staging / 'index' / name)
+
+        files = {rel: _file_entry(staging / rel) for rel in
+                 sorted(p.relative_to(staging).as_posix() for p in staging.rglob('*') if p.is_file())}
+        content_id = hashlib.sha256(json.dumps(files, sort_keys=True).encode('utf-8')).hexdigest()
+        manifest = dict(
+            format=FORMAT,
+            version=FORMAT_VERSION,
+            provider=provider,
+            build_id=f"{time.strftime('%Y%m%dT%H%M%SZ', time.gmtime())}-{content_id[:12]}",
+            created_at=time.time(),
+            index='shards.json' if shard_manifest is not None else 'faiss.bin',
+            **_read_build_info(staging / 'db' / 'metadata.sqlite'),
+            files=files,
+        )
+        (staging / MANIFEST).write_text(json.dumps(manifest, indent=2), encoding='utf-8')
+
+        if archive:
+            tmp = out.with_name(out.name + '.tmp')
+            with tarfile.open(str(tmp), 'w:gz' if out.name.endswith(('.gz', '.tgz')) else 'w') as tar:
+                # manifest first so readers can check it before the payload
+                tar.add(str(staging / MANIFEST), arcname=MANIFEST)
+                for rel in files:
+                    tar.add(str(staging / rel), arcname=rel)
+            tmp.replace(out)
+        else:
+            if out.exists():
+                raise BundleError(f'{out} already exists')
+            staging.rename(out)
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+    logger.info('exported provider %s build %s to %s (%d files)', provider, manifest['build_id'], out,
+                len(manifest['files']))
+    return manifest
+
+
+def _open_members(src: Path) -> Iterator[Tuple[str, object]]:
+    """(relative path, readable file) for every regular file in a bundle directory or archive."""
+    if src.is_dir():
+        for p in sorted(src.rglob('*')):
+            if p.is_file():
+                with open(p, 'rb') as f:
+                    yield p.relative_to(src).as_posix(), f
+        return
+    with tarfile.open(str(src), 'r:*') as tar:
+        for member in tar:
+            if member.isfile():
+                yield member.name, tar.extractfile(member)
+
+
+def read_bundle_manifest(src: Path) -> dict:
+    for rel, f in _open_members(src):
+        if rel == MANIFEST:
+            manifest = json.loads(f.read().decode('utf-8'))
+            break
+    else:
+        raise BundleError(f'{src} has no {MANIFEST}')
+    if manifest.get('format') != FORMAT:
+        raise BundleError(f'{src} is not a provider bundle')
+    if manifest.get('version', 0) > FORMAT_VERSION:
+        raise BundleError(f'bundle format {manifest["version"]} is newer than supported ({FORMAT_VERSION})')
+    return manifest
+
+
+def verify_bundle(src: Path, deep: bool = False) -> List[str]:
+    """Problems found in the bundle at `src` (empty when it is intact).
+
+    Checks every manifest file is present with the recorded size and sha256;
+    `deep` also loads the dense index of a bundle directory (archives are
+    only checksummed) and checks it holds one vector per chunk.
+    """
+    manifest = read_bundle_manifest(src)
+    expected: Dict[str, dict] = manifest['files']
+    problems, seen = [], set()
+    for rel, f in _open_members(src):
+        entry = expected.get(rel)
+        if entry is None:
+            continue
+        seen.add(rel)
+        digest, size = _digest(f)
+        if size != entry['size']:
+            problems.append(f'{rel}: size {size}, expected {entry["size"]}')
+        elif digest != entry['sha256']:
+            problems.append(f'{rel}: checksum mismatch')
+    problems.extend(f'{rel}: missing' for rel in sorted(set(expected) - seen))
+    if deep and not problems and src.is_dir():
+        from .provider_store import get_provider_index
+
+        ntotal = get_provider_index(src / 'index').ntotal
+        if ntotal != manifest.get('n_chunks'):
+            problems.append(f'index holds {ntotal} vectors for {manifest.get("n_chunks")} chunks')
+    return problems
+
+
+def _releases(providers_dir: Path, provider: str) -> Path:
+    return providers_dir / BUNDLES_DIR / provider
+
+
+def current_release(providers_dir: Path, provider: str) -> Optional[Path]:
+    """The bundle directory `PROVIDERS_DIR/<provider>` points at, if it is a bundle link."""
+    link = providers_dir / provider
+    return link.resolve() if link.is_symlink() else None
+
+
+def check_writable(providers_dir: Path, provider: str):
+    """Raise BundleError if `provider` is served from an imported bundle.
+
+    Its directory is then a link to a release kept for rollback (or, imported
+    with `link=True`, a bundle on shared storage), so uploads and rebuilds
+    would modify that build in place. Build elsewhere and import a new bundle.
+    """
+    if current_release(providers_dir, provider) is not None:
+        raise BundleError(f'provider {provider} is served from an imported bundle; '
+                          'rebuild it where it is built and import the new bundle')
+
+
+def _swap_link(providers_dir: Path, provider: str, release: Path):
+    """Point `providers_dir/provider` at `release`; replacing a symlink is atomic."""
+    link = providers_dir / provider
+    tmp = providers_dir / f'.link-{provider}-{uuid.uuid4().hex[:8]}'
+    tmp.symlink_to(os.path.relpath(release, providers_dir))
+    old = None
+    if link.exists() and not link.is_symlink():
+        # first import over a locally built provider: move it out of the way
+        old = providers_dir / f'.old-{provider}-{uuid.uuid4().hex[:8]}'
+        link.rename(old)
+    os.replace(tmp, link)
+    if old is not None:
+        shutil.rmtree(old, ignore_errors=True)
+
+
+def _prune(providers_dir: Path, provider: str, keep: int):
+    current = current_release(providers_dir, provider)
+    releases = sorted((p for p in _releases(providers_dir, provider).iterdir() if not p.name.startswith('.')),
+                      key=lambda p: p.stat().st_mtime, reverse=True)
+    for old in releases[max(1, keep):]:
+        if current is None or old.resolve() != current:
+            if old.is_symlink():
+                old.unlink()
+            else:
+                shutil.rmtree(old, ignore_errors=True)
+
+
+def import_bundle(src: Path, providers_dir: Path, provider: Optional[str] = None, link: bool = False,
+                  keep: int = BUNDLE_KEEP) -> dict:
+    """Install the bundle at `src` as the serving copy of its provider.
+
+    The bundle is unpacked (archives) or copied (directories) next to the
+    previous builds and verified before the switch; `link=True` serves a
+    bundle directory in place (e.g. on shared storage) without copying.
+    """
+    from .cluster import valid_provider_name
+
+    manifest = read_bundle_manifest(src)
+    provider = provider or manifest['provider']
+    if not valid_provider_name(provider):
+        raise BundleError(f'invalid provider name {provider!r}')
+    releases = _releases(providers_dir, provider)
+    releases.mkdir(parents=True, exist_ok=True)
+    release = releases / manifest['build_id']
+    if release.exists() or release.is_symlink():
+        raise BundleError(f'build {manifest["build_id"]} of {provider} is already imported')
+
+    if link:
+        if not src.is_dir():
+            raise BundleError('only a bundle directory can be served in place')
+        problems = verify_bundle(src)
+        if problems:
+            raise BundleError(f'bundle failed verification: {problems}')
+        release.symlink_to(src.resolve())
+    else:
+        staging = releases / f'.incoming-{uuid.uuid4().hex[:8]}'
+        try:
+            if src.is_dir():
+                shutil.copytree(src, staging)
+            else:
+                with tarfile.open(str(src), 'r:*') as tar:
+                    for member in tar.getmembers():
+                        path = Path(member.name)
+                        if not (member.isfile() or member.isdir()) or path.is_absolute() or '..' in path.parts:
+                            raise BundleError(f'unexpected archive member {member.name!r}')
+                    if hasattr(tarfile, 'data_filter'):
+                        tar.extractall(str(staging), filter='data')
+                    else:
+                        tar.extractall(str(staging))
+            problems = verify_bundle(staging)
+            if problems:
+                raise BundleError(f'bundle failed verification: {problems}')
+            # caches key on file mtimes; make them unique to this import
+            for p in staging.rglob('*'):
+                if p.is_file():
+                    os.utime(p)
+            staging.rename(release)
+        finally:
+            shutil.rmtree(staging, ignore_errors=True)
+
+    _swap_link(providers_dir, provider, release)
+    _prune(providers_dir, provider, keep)
+    logger.info('imported provider %s build %s%s', provider, manifest['build_id'], ' (in place)' if link else '')
+    return manifest
+
+
+def remove_releases(providers_dir: Path, provider: str):
+    shutil.rmtree(_releases(providers_dir, provider), ignore_errors=True)
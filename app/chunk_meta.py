@@ -0,0 +1,187 @@
+"""Per-chunk provenance and metadata filters.
+
+The pipeline chunks every document separately, so a document's chunks form a
+contiguous id range (the same ids as the FAISS vectors and the lexical index).
+`index/chunk_meta.npz` stores, as flat arrays, which document each chunk came
+from and its page range, plus per-document source file name, content hash and
+upload time.
+
+Chunks dropped as near-duplicates at ingest (app/dedup.py) are recorded as
+links: the kept chunk stands for the dropped one's document and pages too, so
+filtering on either copy of a brochure finds it.
+
+Filters (source files, content hashes, page range, upload window) become a
+boolean mask over chunk ids that is applied inside the search itself: a FAISS
+IDSelector (a plain id range when the match is one document's sub-range, a
+bitmap otherwise) and a score mask for BM25. A filtered query scans the same
+index as an unfiltered one, with no over-fetching or post-filtering.
+"""
+import os
+import threading
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from . import metrics
+
+FORMAT_VERSION = 1
+NO_PAGE = -1
+
+_cache: Dict[str, Tuple[int, 'ChunkMeta']] = {}
+_lock = threading.Lock()
+
+
+def _timestamp(value) -> float:
+    return value.timestamp() if isinstance(value, datetime) else float(value)
+
+
+class ChunkMeta:
+    def __init__(self, doc_source, doc_hash, doc_uploaded, chunk_doc, chunk_page_start, chunk_page_end,
+                 link_chunk=(), link_doc=(), link_page_start=(), link_page_end=()):
+        self.doc_source = np.asarray(doc_source, dtype=str)
+        self.doc_hash = np.asarray(doc_hash, dtype=str)
+        self.doc_uploaded = np.asarray(doc_uploaded, dtype='float64')
+        self.chunk_doc = np.asarray(chunk_doc, dtype='int32')
+        self.chunk_page_start = np.asarray(chunk_page_start, dtype='int32')
+        self.chunk_page_end = np.asarray(chunk_page_end, dtype='int32')
+        self.link_chunk = np.asarray(link_chunk, dtype='int32')
+        self.link_doc = np.asarray(link_doc, dtype='int32')
+        self.link_page_start = np.asarray(link_page_start, dtype='int32')
+        self.link_page_end = np.asarray(link_page_end, dtype='int32')
+
+    @property
+    def n_chunks(self) -> int:
+        return len(self.chunk_doc)
+
+    @classmethod
+    def build(cls, documents: List[dict], chunks: List[dict], links: Optional[List[dict]] = None) -> 'ChunkMeta':
+        """`documents`: {source, doc_hash, uploaded_at}; `chunks`: {doc, page_start, page_end} in id order;
+        `links`: {chunk, doc, page_start, page_end} of dropped duplicates of chunk `chunk`."""
+        page = lambda v: NO_PAGE if v is None else v
+        links = links or []
+        return cls(
+            [d['source'] for d in documents],
+            [d['doc_hash'] for d in documents],
+            [d['uploaded_at'] for d in documents],
+            [c['doc'] for c in chunks],
+            [page(c.get('page_start')) for c in chunks],
+            [page(c.get('page_end')) for c in chunks],
+            [l['chunk'] for l in links],
+            [l['doc'] for l in links],
+            [page(l.get('page_start')) for l in links],
+            [page(l.get('page_end')) for l in links],
+        )
+
+    def save(self, path: Path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(path.stem + '.tmp.npz')
+        np.savez(
+            tmp,
+            version=np.array([FORMAT_VERSION], dtype='int32'),
+            doc_source=self.doc_source,
+            doc_hash=self.doc_hash,
+            doc_uploaded=self.doc_uploaded,
+            chunk_doc=self.chunk_doc,
+            chunk_page_start=self.chunk_page_start,
+            chunk_page_end=self.chunk_page_end,
+            link_chunk=self.link_chunk,
+            link_doc=self.link_doc,
+            link_page_start=self.link_page_start,
+            link_page_end=self.link_page_end,
+        )
+        tmp.replace(path)
+
+    @classmethod
+    def load(cls, path: Path) -> 'ChunkMeta':
+        with np.load(path) as z:
+            links = [z[k] for k in ('link_chunk', 'link_doc', 'link_page_start', 'link_page_end') if k in z]
+            return cls(z['doc_source'], z['doc_hash'], z['doc_uploaded'],
+                       z['chunk_doc'], z['chunk_page_start'], z['chunk_page_end'], *links)
+
+    def mask(self, sources=None, doc_hashes=None, page_from=None, page_to=None,
+             uploaded_after=None, uploaded_before=None) -> Optional[np.ndarray]:
+        """Boolean mask over chunk ids matching every given filter; None when no filter is set."""
+        doc_ok = None
+        if sources:
+            doc_ok = np.isin(self.doc_source, list(sources))
+        if doc_hashes:
+            m = np.isin(self.doc_hash, list(doc_hashes))
+            doc_ok = m if doc_ok is None else doc_ok & m
+        if uploaded_after is not None:
+            m = self.doc_uploaded >= _timestamp(uploaded_after)
+            doc_ok = m if doc_ok is None else doc_ok & m
+        if uploaded_before is not None:
+            m = self.doc_uploaded < _timestamp(uploaded_before)
+            doc_ok = m if doc_ok is None else doc_ok & m
+        mask = self._match(doc_ok, self.chunk_doc, self.chunk_page_start, self.chunk_page_end, page_from, page_to)
+        if mask is not None and len(self.link_chunk):
+            linked = self._match(doc_ok, self.link_doc, self.link_page_start, self.link_page_end,
+                                 page_from, page_to)
+            mask[self.link_chunk[linked]] = True
+        return mask
+
+    @staticmethod
+    def _match(doc_ok, docs, page_start, page_end, page_from, page_to) -> Optional[np.ndarray]:
+        mask = None if doc_ok is None else doc_ok[docs]
+        if page_from is not None or page_to is not None:
+            # chunks overlapping [page_from, page_to]; chunks without pages never match
+            m = page_start != NO_PAGE
+            if page_from is not None:
+                m &= page_end >= page_from
+            if page_to is not None:
+                m &= page_start <= page_to
+            mask = m if mask is None else mask & m
+        return mask
+
+
+def load_chunk_meta(path: Path) -> Optional[ChunkMeta]:
+    """Return the provider's chunk metadata (cached until the file changes), or None if missing."""
+    key = str(path)
+    try:
+        mtime = os.stat(key).st_mtime_ns
+    except OSError:
+        return None
+    with _lock:
+        hit = _cache.get(key)
+        if hit is not None and hit[0] == mtime:
+            metrics.cache_event('chunk_meta', True)
+            return hit[1]
+    metrics.cache_event('chunk_meta', False)
+    meta = ChunkMeta.load(path)
+    with _lock:
+        _cache[key] = (mtime, meta)
+    return meta
+
+
+class FaissFilter:
+    """SearchParameters restricting a FAISS search to the ids in `mask`."""
+
+    def __init__(self, mask: np.ndarray):
+        import faiss
+
+        ids = np.flatnonzero(mask)
+        self.count = len(ids)
+        if self.count and ids[-1] - ids[0] + 1 == self.count:
+            # one contiguous run, e.g. a single document: range check, no bitmap
+            self.selector = faiss.IDSelectorRange(int(ids[0]), int(ids[-1]) + 1)
+        else:
+            # the selector points into this buffer; keep it alive with the selector
+            self._bits = np.packbits(mask, bitorder='little')
+            # n is the bitmap size in bytes; FAISS rejects ids past it
+            self.selector = faiss.IDSelectorBitmap(len(self._bits), faiss.swig_ptr(self._bits))
+        self.params = faiss.SearchParameters(sel=self.selector)
+
+
+def provenance(chunk: dict) -> dict:
+    """The structured source fields of a chunk record (None for indexes built before they existed)."""
+    return {
+        'source': chunk.get('source'),
+        'page_start': chunk.get('page_start'),
+        'page_end': chunk.get('page_end'),
+        'start': chunk.get('start'),
+        'end': chunk.get('end'),
+        'doc_hash': chunk.get('doc_hash'),
+        'uploaded_at': chunk.get('uploaded_at'),
+    }
@@ -0,0 +1,177 @@
+"""Chunkers: how the pipeline cuts each document into chunks.
+
+A chunker gets one document's span of the combined, whitespace-normalised
+text plus its structure (page starts, and paragraph/heading starts recorded
+by the pipeline before normalising) and returns (start, end) offsets into the
+combined text, so chunk offsets, pages and provenance work the same for every
+chunker.
+
+  - 'chars':  fixed windows of `size` characters overlapping by `overlap`
+              characters (800/200), ignoring structure; the original scheme
+  - 'tokens': packs whole sentences up to `size` tokens (app/tokenizer.py,
+              the LLM's tokenizer when available), starts a new chunk at a
+              heading or page once the current one is a quarter full (at a
+              paragraph once three quarters full), and repeats up to
+              `overlap` tokens of trailing sentences when a chunk is cut for
+              size; sentences longer than `size` are split at words
+
+The chunker for a build comes from, in order: the build's `chunking`
+argument, `<provider>/chunking.json` ({"chunker": "tokens", "size": 256,
+"overlap": 32}, any subset), then CHUNKER / CHUNK_SIZE / CHUNK_OVERLAP.
+Omitted sizes use the chunker's defaults. See bench/chunking.py.
+"""
+import json
+import re
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+from .config import CHUNK_OVERLAP, CHUNK_SIZE, CHUNKER
+from .tokenizer import count_tokens
+
+CONFIG_FILE = 'chunking.json'
+
+_SENTENCE_BREAK = re.compile(r'(?<=[.!?])\s+(?=["\'(\[]?[A-Z0-9])')
+_WORD = re.compile(r'\S+')
+
+
+class Chunker:
+    name = ''
+    default_size = 0
+    default_overlap = 0
+
+    def __init__(self, size: Optional[int] = None, overlap: Optional[int] = None):
+        self.size = self.default_size if size is None else int(size)
+        self.overlap = self.default_overlap if overlap is None else int(overlap)
+        if self.size <= 0 or not 0 <= self.overlap < self.size:
+            raise ValueError(f'{self.name} chunker needs size > 0 and 0 <= overlap < size, '
+                             f'got size={self.size} overlap={self.overlap}')
+
+    @property
+    def spec(self) -> dict:
+        return {'chunker': self.name, 'size': self.size, 'overlap': self.overlap}
+
+    def split(self, text: str, start: int, end: int, page_starts: list, breaks: list) -> List[Tuple[int, int]]:
+        """(start, end) chunk offsets covering text[start:end], one document.
+
+        `page_starts`: (offset, page_no) of the document's pages (empty when
+        unpaged); `breaks`: (offset, 'paragraph' | 'heading') block starts.
+        """
+        raise NotImplementedError
+
+
+class CharChunker(Chunker):
+    name = 'chars'
+    default_size = 800
+    default_overlap = 200
+
+    def split(self, text, start, end, page_starts, breaks):
+        out = []
+        while start < end:
+            stop = min(start + self.size, end)
+            out.append((start, stop))
+            if stop == end:
+                break
+            start = stop - self.overlap
+        return out
+
+
+class TokenChunker(Chunker):
+    name = 'tokens'
+    default_size = 256
+    default_overlap = 32
+
+    def _units(self, text, start, end, page_starts, breaks) -> list:
+        """Sentences as [start, end, tokens, break kind before it or None], in order."""
+        kinds = {off: kind for off, kind in breaks if start < off < end}
+        kinds.update((off, 'page') for off, _ in page_starts if start < off < end)
+        bounds = [start] + sorted(kinds) + [end]
+        units = []
+        for lo, hi in zip(bounds, bounds[1:]):
+            block = text[lo:hi].rstrip()
+            kind = kinds.get(lo)
+            pos = 0
+            for m in list(_SENTENCE_BREAK.finditer(block)) + [None]:
+                stop = m.start() if m is not None else len(block)
+                if stop > pos:
+                    units.extend(self._fit(text, lo + pos, lo + stop, kind))
+                    kind = None
+                if m is not None:
+                    pos = m.end()
+        return units
+
+    def _fit(self, text, start, end, kind) -> list:
+        tokens = count_tokens(text[start:end])
+        if tokens <= self.size:
+            return [[start, end, tokens, kind]]
+        # one over-long "sentence" (a table, a list without punctuation): cut at words
+        out, cur, cur_tokens, prev_end = [], None, 0, start
+        for m in _WORD.finditer(text, start, end):
+            t = count_tokens(m.group()) + 1
+            if cur is not None and cur_tokens + t > self.size:
+                out.append([cur, prev_end, cur_tokens, kind if not out else None])
+                cur, cur_tokens = None, 0
+            if cur is None:
+                cur = m.start()
+            cur_tokens += t
+            prev_end = m.end()
+        if cur is not None:
+            out.append([cur, prev_end, cur_tokens, kind if not out else None])
+        return out
+
+    def split(self, text, start, end, page_starts, breaks):
+        out, cur, cur_tokens = [], [], 0
+        for unit in self._units(text, start, end, page_starts, breaks):
+            tokens, kind = unit[2], unit[3]
+            structural = (kind in ('heading', 'page') and cur_tokens >= self.size // 4
+                          or kind == 'paragraph' and cur_tokens >= self.size * 3 // 4)
+            if cur and (structural or cur_tokens + tokens > self.size):
+                out.append((cur[0][0], cur[-1][1]))
+                carry = []
+                if not structural and self.overlap:
+                    # trailing sentences (never the whole chunk) as context for the next one
+                    kept = 0
+                    for prev in reversed(cur[1:]):
+                        if kept + prev[2] > self.overlap:
+                            break
+                        carry.insert(0, prev)
+                        kept += prev[2]
+                    if kept + tokens > self.size:
+                        carry, kept = [], 0
+                cur, cur_tokens = carry, sum(u[2] for u in carry)
+            cur.append(unit)
+            cur_tokens += tokens
+        if cur:
+            out.append((cur[0][0], cur[-1][1]))
+        return out
+
+
+CHUNKERS = {c.name: c for c in (CharChunker, TokenChunker)}
+
+
+def provider_chunking(provider_dir: Path) -> dict:
+    """The provider's own chunking settings (`chunking.json`), or {}."""
+    path = Path(provider_dir) / CONFIG_FILE
+    if not path.exists():
+        return {}
+    try:
+        conf = json.loads(path.read_text(encoding='utf-8'))
+    except ValueError as e:
+        raise ValueError(f'{path}: invalid JSON ({e})')
+    if not isinstance(conf, dict):
+        raise ValueError(f'{path}: expected an object')
+    return conf
+
+
+def get_chunker(provider_dir: Optional[Path] = None, chunking: Optional[dict] = None) -> Chunker:
+    """Chunker for a build: `chunking` over the provider's chunking.json over the CHUNK* settings."""
+    conf = {'chunker': CHUNKER, 'size': CHUNK_SIZE, 'overlap': CHUNK_OVERLAP}
+    overrides = [provider_chunking(provider_dir) if provider_dir is not None else {}, chunking or {}]
+    for layer in overrides:
+        if layer.get('chunker') and layer['chunker'] != conf['chunker']:
+            # sizes are in the chunker's own units; do not carry them over
+            conf = {'chunker': layer['chunker'], 'size': None, 'overlap': None}
+        conf.update({k: v for k, v in layer.items() if k in ('size', 'overlap') and v is not None})
+    cls = CHUNKERS.get(conf['chunker'])
+    if cls is None:
+        raise ValueError(f'unknown chunker {conf["chunker"]!r}; expected one of {tuple(CHUNKERS)}')
+    return cls(conf['size'], conf['overlap'])
@@ -0,0 +1,195 @@
+"""Cluster mode: providers spread over serving nodes by consistent hashing.
+
+Every node runs the normal API over its own PROVIDERS_DIR holding the
+providers it owns. The gateway (app/gateway.py) keeps the node list, maps
+client -> provider -> owning nodes on a hash ring and forwards /v1/query to
+the first healthy owner.
+
+The ring hashes each node onto CLUSTER_VNODES points; a provider is owned by
+the first CLUSTER_REPLICAS distinct nodes clockwise from its hash, so a node
+joining or leaving only moves the providers on its arcs. `plan_moves`
+computes which providers must be copied where; nodes copy provider
+directories from each other with the /v1/cluster/providers/* endpoints.
+
+Node-to-node and gateway-to-node calls carry `X-Cluster-Token: CLUSTER_TOKEN`;
+with it the gateway also tells the node which provider a query was routed
+for (`X-Cluster-Provider`), so nodes do not need the client mapping.
+"""
+import bisect
+import hashlib
+import hmac
+import json
+import logging
+import os
+import shutil
+import tarfile
+import tempfile
+import uuid
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+from .config import CLUSTER_TOKEN, CLUSTER_VNODES
+
+logger = logging.getLogger(__name__)
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest(), 'big')
+
+
+def parse_nodes(spec: str) -> Dict[str, str]:
+    """'a=http://10.0.0.1:8000,b=http://10.0.0.2:8000' -> {name: base url}."""
+    nodes = {}
+    for item in spec.split(','):
+        item = item.strip()
+        if not item:
+            continue
+        name, sep, url = item.partition('=')
+        if not sep or not name.strip() or not url.strip():
+            raise ValueError(f'bad cluster node {item!r}; expected name=url')
+        nodes[name.strip()] = url.strip().rstrip('/')
+    return nodes
+
+
+class HashRing:
+    def __init__(self, nodes: Iterable[str], vnodes: int = CLUSTER_VNODES):
+        self.nodes = sorted(set(nodes))
+        self.vnodes = max(1, vnodes)
+        points = sorted((_hash(f'{node}#{i}'), node) for node in self.nodes for i in range(self.vnodes))
+        self._keys = [h for h, _ in points]
+        self._nodes = [n for _, n in points]
+
+    def owners(self, key: str, replicas: int = 1) -> List[str]:
+        """The first `replicas` distinct nodes clockwise from the key's hash (primary first)."""
+        if not self._keys:
+            return []
+        want = min(max(1, replicas), len(self.nodes))
+        out = []
+        i = bisect.bisect(self._keys, _hash(key))
+        for step in range(len(self._keys)):
+            node = self._nodes[(i + step) % len(self._keys)]
+            if node not in out:
+                out.append(node)
+                if len(out) == want:
+                    break
+        return out
+
+    def assignments(self, providers: Iterable[str], replicas: int = 1) -> Dict[str, List[str]]:
+        return {p: self.owners(p, replicas) for p in providers}
+
+
+def plan_moves(placement: Dict[str, List[str]], ring: HashRing, replicas: int) -> List[dict]:
+    """Copies and removals that turn `placement` (provider -> nodes holding it) into the ring's assignment.
+
+    Each move is {provider, source, add: [nodes], remove: [nodes]}; `source`
+    is a node that already has the provider (None if no node has it).
+    """
+    moves = []
+    for provider in sorted(placement):
+        have = [n for n in placement[provider]]
+        want = ring.owners(provider, replicas)
+        add = [n for n in want if n not in have]
+        remove = [n for n in have if n not in want]
+        if not add and not remove:
+            continue
+        # prefer copying from a node that keeps the provider
+        source = next((n for n in have if n in want), have[0] if have else None)
+        moves.append({'provider': provider, 'source': source, 'add': add, 'remove': remove})
+    return moves
+
+
+def token_ok(token: Optional[str]) -> bool:
+    return bool(CLUSTER_TOKEN) and token is not None and hmac.compare_digest(token, CLUSTER_TOKEN)
+
+
+def trusted_provider(token: Optional[str], provider: Optional[str]) -> Optional[str]:
+    """The provider the gateway routed this request for, if the request really comes from the cluster."""
+    if provider and valid_provider_name(provider) and token_ok(token):
+        return provider
+    return None
+
+
+def valid_provider_name(name: str) -> bool:
+    return bool(name) and name == Path(name).name and not name.startswith('.')
+
+
+def spool_file(providers_dir: Path, provider: str, kind: str) -> Path:
+    """Empty temp file for a provider archive in transit.
+
+    Lives in `providers_dir` (the disk that has room for the provider) under a
+    dot name, which provider listings skip; the caller deletes it.
+    """
+    providers_dir.mkdir(parents=True, exist_ok=True)
+    fd, path = tempfile.mkstemp(prefix=f'.{kind}-{provider}-', suffix='.tar.gz', dir=str(providers_dir))
+    os.close(fd)
+    return Path(path)
+
+
+def pack_provider(provider_dir: Path, dest: Path):
+    """Write a tar.gz of a provider directory (sources, parsed text, db and index files) to `dest`."""
+    # dereference: an imported bundle is a symlink to its build directory
+    with tarfile.open(str(dest), mode='w:gz', dereference=True) as tar:
+        tar.add(str(provider_dir), arcname=provider_dir.name)
+
+
+def unpack_provider(archive: Path, providers_dir: Path, provider: str):
+    """Replace `providers_dir/provider` with the contents of the tar.gz at `archive`.
+
+    Extracts next to the live directory, then swaps it in with renames so
+    queries see either the old or the new copy, never a half-written one.
+    """
+    providers_dir.mkdir(parents=True, exist_ok=True)
+    staging = Path(tempfile.mkdtemp(prefix=f'.incoming-{provider}-', dir=str(providers_dir)))
+    try:
+        with tarfile.open(str(archive), mode='r:gz') as tar:
+            for member in tar.getmembers():
+                parts = Path(member.name).parts
+                if not parts or parts[0] != provider or '..' in parts or member.issym() or member.islnk():
+                    raise ValueError(f'unexpected archive member {member.name!r}')
+            if hasattr(tarfile, 'data_filter'):
+                tar.extractall(str(staging), filter='data')
+            else:
+                tar.extractall(str(staging))
+        target = providers_dir / provider
+        old = providers_dir / f'.old-{provider}-{uuid.uuid4().hex[:8]}'
+        if target.exists() or target.is_symlink():
+            target.rename(old)
+        (staging / provider).rename(target)
+        _discard(old, providers_dir, provider)
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+
+
+def _discard(path: Path, providers_dir: Path, provider: str):
+    """Delete a renamed-away provider copy; a bundle link takes its imported builds with it."""
+    from .bundle import remove_releases
+
+    if path.is_symlink():
+        path.unlink()
+        remove_releases(providers_dir, provider)
+    elif path.exists():
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def remove_provider(providers_dir: Path, provider: str) -> bool:
+    target = providers_dir / provider
+    if not target.exists() and not target.is_symlink():
+        return False
+    old = providers_dir / f'.old-{provider}-{uuid.uuid4().hex[:8]}'
+    target.rename(old)
+    _discard(old, providers_dir, provider)
+    return True
+
+
+def load_state(path: Path) -> Optional[Dict[str, str]]:
+    try:
+        return json.loads(path.read_text(encoding='utf-8'))['nodes']
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def save_state(path: Path, nodes: Dict[str, str]):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.name + '.tmp')
+    tmp.write_text(json.dumps({'nodes': nodes}, indent=2), encoding='utf-8')
+    tmp.replace(path)
@@ -2,7 +2,8 @@ from pathlib import Path
 import os
 
 BASE_DIR = Path(__file__).resolve().parent.parent
-RAG_DATA = BASE_DIR / "rag-data"
+# RAG_DATA_DIR relocates all provider data, e.g. to a scratch dir for benchmarks
+RAG_DATA = Path(os.environ.get('RAG_DATA_DIR', str(BASE_DIR / "rag-data")))
 PROVIDERS_DIR = RAG_DATA / "providers"
 
 # Create directories if missing
@@ -20,6 +21,9 @@ except Exception:
 
 OPENAI_API_KEY = os.environ.get('OPENAI_API_KEY')
 
+# Store the provider index map in Firestore instead of the local JSON file
+FIRESTORE_ENABLED = os.environ.get('FIRESTORE_ENABLED', '').lower() in ('1', 'true', 'yes')
+
 # API keys for securing public endpoints
 # Support either a single `API_KEY` or a comma-separated `API_KEYS`
 API_KEYS = []
@@ -34,3 +38,172 @@ if _cors_raw:
 	CORS_ORIGINS = [o.strip() for o in _cors_raw.split(',') if o.strip()]
 else:
 	CORS_ORIGINS = ["*"]
+
+# LLM call shaping: identical in-flight prompts are coalesced, and upstream
+# concurrency is capped globally and per provider. Callers beyond the cap queue
+# for up to LLM_QUEUE_TIMEOUT seconds (or the request's deadline, if shorter)
+# before giving up. The API runs LLM calls on worker threads of their own, at
+# most LLM_MAX_CONCURRENCY + LLM_MAX_QUEUED; further calls wait on the event
+# loop, so queued callers never hold the threads embeddings and I/O share.
+LLM_MODEL = os.environ.get('LLM_MODEL', 'gpt-4o-mini')
+LLM_MAX_CONCURRENCY = int(os.environ.get('LLM_MAX_CONCURRENCY', '16'))
+LLM_MAX_CONCURRENCY_PER_PROVIDER = int(os.environ.get('LLM_MAX_CONCURRENCY_PER_PROVIDER', '4'))
+LLM_QUEUE_TIMEOUT = float(os.environ.get('LLM_QUEUE_TIMEOUT', '30'))
+LLM_MAX_QUEUED = int(os.environ.get('LLM_MAX_QUEUED', '16'))
+
+# LLM backend: 'openai' (default) or 'stub', a local stand-in that answers from
+# the prompt context after an injected latency (for offline runs and testing).
+LLM_BACKEND = os.environ.get('LLM_BACKEND', 'openai').lower()
+LLM_STUB_LATENCY_MS = float(os.environ.get('LLM_STUB_LATENCY_MS', '50'))
+LLM_STUB_SLOW_MS = float(os.environ.get('LLM_STUB_SLOW_MS', '0'))
+LLM_STUB_SLOW_RATE = float(os.environ.get('LLM_STUB_SLOW_RATE', '0'))
+
+# Request hedging: if the first attempt has not answered within the recent
+# LLM_HEDGE_PERCENTILE latency, send a duplicate and keep whichever finishes
+# first. LLM_HEDGE_MAX_FRACTION caps the share of requests that get hedged.
+LLM_HEDGE_ENABLED = os.environ.get('LLM_HEDGE_ENABLED', '0').lower() in ('1', 'true', 'yes')
+LLM_HEDGE_PERCENTILE = float(os.environ.get('LLM_HEDGE_PERCENTILE', '95'))
+LLM_HEDGE_MIN_DELAY_MS = float(os.environ.get('LLM_HEDGE_MIN_DELAY_MS', '50'))
+LLM_HEDGE_MIN_SAMPLES = int(os.environ.get('LLM_HEDGE_MIN_SAMPLES', '20'))
+LLM_HEDGE_MAX_FRACTION = float(os.environ.get('LLM_HEDGE_MAX_FRACTION', '0.1'))
+
+# Prompt context packing: max tokens of retrieved text sent to the LLM, and the
+# shingle-containment ratio above which a passage counts as a near duplicate.
+CONTEXT_TOKEN_BUDGET = int(os.environ.get('CONTEXT_TOKEN_BUDGET', '2000'))
+CONTEXT_DEDUP_THRESHOLD = float(os.environ.get('CONTEXT_DEDUP_THRESHOLD', '0.8'))
+
+# Per-request LLM deadline for /v1/query. When the LLM has not answered in time
+# (or no LLM is configured) the answer falls back to extractive sentences from
+# the retrieved context. 0 disables the deadline.
+LLM_DEADLINE_MS = int(os.environ.get('LLM_DEADLINE_MS', '8000'))
+
+# Structured metadata fast path: questions classified as asking for a single
+# provider_metadata field (phone, email, charges, name) with at least this
+# confidence are answered from the cached metadata without retrieval or LLM.
+METADATA_FASTPATH_ENABLED = os.environ.get('METADATA_FASTPATH_ENABLED', '1').lower() in ('1', 'true', 'yes')
+METADATA_FASTPATH_THRESHOLD = float(os.environ.get('METADATA_FASTPATH_THRESHOLD', '0.7'))
+
+# Embeddings: EMBEDDING_MODEL overrides the model key recorded for new builds
+# (e.g. 'onnx:all-MiniLM-L6-v2' for the int8 CPU backend). EMBED_BATCH_SIZE is
+# the encode batch size; EMBED_ONNX_THREADS sets onnxruntime intra-op threads
+# (0 lets onnxruntime decide). Exported ONNX models are cached in ONNX_MODELS_DIR.
+EMBEDDING_MODEL = os.environ.get('EMBEDDING_MODEL')
+EMBED_BATCH_SIZE = int(os.environ.get('EMBED_BATCH_SIZE', '64'))
+EMBED_ONNX_THREADS = int(os.environ.get('EMBED_ONNX_THREADS', '0'))
+ONNX_MODELS_DIR = Path(os.environ.get('ONNX_MODELS_DIR', str(RAG_DATA / 'models' / 'onnx')))
+
+# Loaded FAISS indexes are kept in memory (up to INDEX_CACHE_SIZE providers)
+# and reloaded when the index file changes.
+INDEX_CACHE_SIZE = int(os.environ.get('INDEX_CACHE_SIZE', '32'))
+
+# Startup warmup: load embedding models and the indexes of the busiest
+# providers before /v1/ready reports ready. WARMUP_MODELS is a comma-separated
+# list of model keys (the models recorded by the warmed providers are always
+# loaded); WARMUP_PROVIDERS pins providers, otherwise the WARMUP_TOP_N providers
+# with the most assigned clients are chosen.
+WARMUP_ENABLED = os.environ.get('WARMUP_ENABLED', '1').lower() in ('1', 'true', 'yes')
+WARMUP_MODELS = [m.strip() for m in os.environ.get('WARMUP_MODELS', '').split(',') if m.strip()]
+WARMUP_PROVIDERS = [p.strip() for p in os.environ.get('WARMUP_PROVIDERS', '').split(',') if p.strip()]
+WARMUP_TOP_N = int(os.environ.get('WARMUP_TOP_N', '5'))
+
+# Per-request debugging: a /v1/query request carrying `X-Debug: timing`
+# (optionally `,cpu` and/or `,alloc`) gets a Server-Timing header and a stage
+# breakdown; cpu/alloc also write a sampling profile / tracemalloc snapshot to
+# DEBUG_PROFILE_DIR. The request must send `X-Debug-Token: <DEBUG_TOKEN>`; with
+# no DEBUG_TOKEN set, debugging is only allowed when no API keys are configured.
+DEBUG_TOKEN = os.environ.get('DEBUG_TOKEN')
+DEBUG_PROFILE_DIR = Path(os.environ.get('DEBUG_PROFILE_DIR', str(RAG_DATA / 'debug')))
+DEBUG_PROFILE_INTERVAL_MS = float(os.environ.get('DEBUG_PROFILE_INTERVAL_MS', '5'))
+DEBUG_TRACEMALLOC_FRAMES = int(os.environ.get('DEBUG_TRACEMALLOC_FRAMES', '25'))
+
+# Admission control for /v1/query (limits are per worker process).
+# Token buckets: RATE_LIMIT_KEY_RPS per API key and RATE_LIMIT_CLIENT_RPS per
+# client_id, each allowing bursts of *_BURST requests; 0 disables. Over the
+# limit a request gets 429 with Retry-After.
+RATE_LIMIT_KEY_RPS = float(os.environ.get('RATE_LIMIT_KEY_RPS', '0'))
+RATE_LIMIT_KEY_BURST = int(os.environ.get('RATE_LIMIT_KEY_BURST', '20'))
+RATE_LIMIT_CLIENT_RPS = float(os.environ.get('RATE_LIMIT_CLIENT_RPS', '0'))
+RATE_LIMIT_CLIENT_BURST = int(os.environ.get('RATE_LIMIT_CLIENT_BURST', '10'))
+# At most QUERY_MAX_INFLIGHT queries run at once; up to QUERY_MAX_QUEUE more
+# wait for a slot. A request that cannot start within QUERY_QUEUE_TIMEOUT_MS
+# (or is predicted not to) is shed with 503 and Retry-After. 0 disables the cap.
+QUERY_MAX_INFLIGHT = int(os.environ.get('QUERY_MAX_INFLIGHT', '64'))
+QUERY_MAX_QUEUE = int(os.environ.get('QUERY_MAX_QUEUE', '256'))
+QUERY_QUEUE_TIMEOUT_MS = int(os.environ.get('QUERY_QUEUE_TIMEOUT_MS', '2000'))
+
+# Semantic answer cache (per provider, per worker): a dense/hybrid question
+# whose embedding is within SEMANTIC_CACHE_THRESHOLD cosine similarity of an
+# earlier question with the same options, against the same index build, gets
+# the earlier grounded answer without retrieval or LLM. At most
+# SEMANTIC_CACHE_MAX_ENTRIES answers per provider (LRU) for up to
+# SEMANTIC_CACHE_MAX_PROVIDERS providers. A SEMANTIC_CACHE_VERIFY_RATE fraction
+# of hits is re-checked by retrieval in the background; entries whose sources
+# overlap the fresh ones less than SEMANTIC_CACHE_VERIFY_MIN_OVERLAP (Jaccard)
+# are counted as false hits and dropped.
+SEMANTIC_CACHE_ENABLED = os.environ.get('SEMANTIC_CACHE_ENABLED', '0').lower() in ('1', 'true', 'yes')
+SEMANTIC_CACHE_THRESHOLD = float(os.environ.get('SEMANTIC_CACHE_THRESHOLD', '0.92'))
+SEMANTIC_CACHE_MAX_ENTRIES = int(os.environ.get('SEMANTIC_CACHE_MAX_ENTRIES', '1000'))
+SEMANTIC_CACHE_MAX_PROVIDERS = int(os.environ.get('SEMANTIC_CACHE_MAX_PROVIDERS', '256'))
+SEMANTIC_CACHE_VERIFY_RATE = float(os.environ.get('SEMANTIC_CACHE_VERIFY_RATE', '0.05'))
+SEMANTIC_CACHE_VERIFY_MIN_OVERLAP = float(os.environ.get('SEMANTIC_CACHE_VERIFY_MIN_OVERLAP', '0.5'))
+
+# Cross-provider search (/v1/search): provider indexes are searched in
+# parallel on FANOUT_THREADS threads; a request may name at most
+# FANOUT_MAX_PROVIDERS providers. Keep INDEX_CACHE_SIZE at least as large as
+# the provider sets searched together, or indexes are reloaded per request.
+FANOUT_THREADS = int(os.environ.get('FANOUT_THREADS', str(min(32, (os.cpu_count() or 1) * 2))))
+FANOUT_MAX_PROVIDERS = int(os.environ.get('FANOUT_MAX_PROVIDERS', '200'))
+
+# Sharded provider indexes (app/shards.py): with INDEX_SHARDS > 1 a rebuild
+# splits the provider's vectors over that many FAISS shards, partitioned by
+# 'document' (whole documents per shard) or 'hash' (INDEX_SHARD_BY). Queries
+# search the shards in parallel on SHARD_SEARCH_THREADS threads.
+INDEX_SHARDS = int(os.environ.get('INDEX_SHARDS', '1'))
+INDEX_SHARD_BY = os.environ.get('INDEX_SHARD_BY', 'document')
+SHARD_SEARCH_THREADS = int(os.environ.get('SHARD_SEARCH_THREADS', str(min(16, (os.cpu_count() or 1) * 2))))
+
+# Cluster mode (app/cluster.py, app/gateway.py). CLUSTER_NODES lists the
+# serving nodes as name=url pairs; the gateway places providers on them with
+# a consistent-hash ring of CLUSTER_VNODES points per node, CLUSTER_REPLICAS
+# copies each, and keeps the current membership in CLUSTER_STATE_FILE.
+# CLUSTER_TOKEN authenticates gateway <-> node and node <-> node calls; cluster
+# endpoints are disabled without it. Nodes are probed every
+# CLUSTER_HEALTH_INTERVAL_S seconds; forwarded queries time out after
+# CLUSTER_FORWARD_TIMEOUT_S.
+CLUSTER_NODES = os.environ.get('CLUSTER_NODES', '')
+CLUSTER_REPLICAS = int(os.environ.get('CLUSTER_REPLICAS', '1'))
+CLUSTER_VNODES = int(os.environ.get('CLUSTER_VNODES', '64'))
+CLUSTER_TOKEN = os.environ.get('CLUSTER_TOKEN')
+CLUSTER_STATE_FILE = Path(os.environ.get('CLUSTER_STATE_FILE', str(RAG_DATA / 'cluster.json')))
+CLUSTER_HEALTH_INTERVAL_S = float(os.environ.get('CLUSTER_HEALTH_INTERVAL_S', '5'))
+CLUSTER_FORWARD_TIMEOUT_S = float(os.environ.get('CLUSTER_FORWARD_TIMEOUT_S', '60'))
+
+# Provider bundles (app/bundle.py, scripts/bundle.py): serving nodes import
+# builds exported elsewhere and keep the last BUNDLE_KEEP of them per provider
+# for rollback. INDEX_MMAP=1 maps flat FAISS index files instead of reading
+# them into memory; only safe when index files are replaced, never rewritten
+# in place (bundles, rebuilds), and it trades RAM for page-cache misses.
+BUNDLE_KEEP = int(os.environ.get('BUNDLE_KEEP', '2'))
+INDEX_MMAP = os.environ.get('INDEX_MMAP', '0').lower() in ('1', 'true', 'yes')
+
+# Embedding-model migrations (app/migration.py, scripts/migrate_embeddings.py).
+# While a provider has a complete shadow index, MIGRATION_COMPARE_RATE of its
+# dense/hybrid queries are also run against it in the background and the
+# top-k overlap with the live answer recorded (0 disables; each sample costs
+# one embedding with the new model).
+MIGRATION_COMPARE_RATE = float(os.environ.get('MIGRATION_COMPARE_RATE', '0'))
+
+# Near-duplicate chunks (app/dedup.py): a rebuild drops chunks whose word
+# shingles overlap an earlier chunk's by at least DEDUP_THRESHOLD (estimated
+# Jaccard) before embedding them; the kept chunk links the dropped copies'
+# provenance. 0 disables.
+DEDUP_THRESHOLD = float(os.environ.get('DEDUP_THRESHOLD', '0.9'))
+
+# Chunking (app/chunking.py): CHUNKER is 'chars' (fixed character windows,
+# 800/200 by default) or 'tokens' (sentence-packed, structure-aware, sized in
+# LLM tokens, 256/32 by default). CHUNK_SIZE / CHUNK_OVERLAP are in the
+# chunker's units; unset uses its defaults. A provider's `chunking.json`
+# overrides these for that provider.
+CHUNKER = os.environ.get('CHUNKER', 'chars')
+CHUNK_SIZE = int(os.environ['CHUNK_SIZE']) if os.environ.get('CHUNK_SIZE') else None
+CHUNK_OVERLAP = int(os.environ['CHUNK_OVERLAP']) if os.environ.get('CHUNK_OVERLAP') else None
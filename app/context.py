@@ -0,0 +1,122 @@
+"""Build the LLM prompt context from retrieval hits.
+
+Chunks overlap by design, so joining raw hits repeats text. `build_context`
+stitches hits that are adjacent or overlapping in the provider's text (using
+the chunk `start`/`end` offsets recorded by the pipeline) back into contiguous
+spans, drops near-duplicate passages, and packs the result into a token budget
+in relevance order.
+"""
+import re
+from typing import List, Dict, Any, Tuple
+
+from .config import CONTEXT_TOKEN_BUDGET, CONTEXT_DEDUP_THRESHOLD
+from .tokenizer import count_tokens, truncate_tokens
+
+_WORD_RE = re.compile(r"\w+")
+
+# a truncated tail shorter than this is not worth sending
+_MIN_TAIL_TOKENS = 32
+
+
+def _merge_spans(hits: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Merge hits whose offsets touch or overlap into passages.
+
+    Each passage keeps the best (lowest) rank of the hits it contains. Hits
+    without offsets (indexes built before offsets were recorded) pass through
+    as their own passages.
+    """
+    passages = []
+    located = []
+    for rank, h in enumerate(hits):
+        if h.get('start') is None or h.get('end') is None:
+            passages.append({'text': h['text'], 'rank': rank, 'keys': [h['key']]})
+        else:
+            located.append((h['start'], h['end'], rank, h))
+    located.sort(key=lambda t: (t[0], t[1]))
+
+    cur = None
+    for start, end, rank, h in located:
+        if cur is not None and start <= cur['end']:
+            if end > cur['end']:
+                cur['text'] += h['text'][cur['end'] - start:]
+                cur['end'] = end
+            cur['rank'] = min(cur['rank'], rank)
+            cur['keys'].append(h['key'])
+            continue
+        if cur is not None:
+            passages.append(cur)
+        cur = {'text': h['text'], 'start': start, 'end': end, 'rank': rank, 'keys': [h['key']]}
+    if cur is not None:
+        passages.append(cur)
+    passages.sort(key=lambda p: p['rank'])
+    return passages
+
+
+def _shingles(text: str, n: int = 5) -> set:
+    words = _WORD_RE.findall(text.lower())
+    if len(words) <= n:
+        return {' '.join(words)} if words else set()
+    return {' '.join(words[i:i + n]) for i in range(len(words) - n + 1)}
+
+
+def _drop_near_duplicates(passages: List[Dict[str, Any]], threshold: float) -> List[Dict[str, Any]]:
+    """Keep passages in rank order, skipping ones mostly contained in a kept passage."""
+    kept = []
+    kept_shingles = []
+    for p in passages:
+        sh = _shingles(p['text'])
+        dup = False
+        for other in kept_shingles:
+            if not sh or not other:
+                continue
+            # containment rather than Jaccard so a short passage repeated
+            # inside a longer one is also caught
+            if len(sh & other) / min(len(sh), len(other)) >= threshold:
+                dup = True
+                break
+        if not dup:
+            kept.append(p)
+            kept_shingles.append(sh)
+    return kept
+
+
+def build_context(hits: List[Dict[str, Any]], token_budget: int | None = None,
+                  dedup_threshold: float | None = None) -> Tuple[str, Dict[str, Any]]:
+    """Return (context, stats) for hits given in relevance order.
+
+    stats has `prompt_tokens` (tokens in the returned context), `raw_tokens`
+    (tokens the naive join of all hits would have cost), `tokens_saved` and
+    `passages` (number of passages sent).
+    """
+    budget = CONTEXT_TOKEN_BUDGET if token_budget is None else token_budget
+    threshold = CONTEXT_DEDUP_THRESHOLD if dedup_threshold is None else dedup_threshold
+    sep = '\n\n'
+    raw_tokens = count_tokens(sep.join(h['text'] for h in hits))
+
+    passages = _drop_near_duplicates(_merge_spans(hits), threshold)
+
+    parts = []
+    used = 0
+    sep_tokens = count_tokens(sep)
+    for p in passages:
+        remaining = budget - used - (sep_tokens if parts else 0)
+        if remaining <= 0:
+            break
+        n = count_tokens(p['text'])
+        if n <= remaining:
+            parts.append(p['text'])
+            used += n + (sep_tokens if len(parts) > 1 else 0)
+            continue
+        if remaining >= _MIN_TAIL_TOKENS:
+            parts.append(truncate_tokens(p['text'], remaining))
+        break
+
+    context = sep.join(parts)
+    prompt_tokens = count_tokens(context)
+    stats = {
+        'prompt_tokens': prompt_tokens,
+        'raw_tokens': raw_tokens,
+        'tokens_saved': max(0, raw_tokens - prompt_tokens),
+        'passages': len(parts),
+    }
+    return context, stats
@@ -0,0 +1,174 @@
+"""Admission control: token-bucket rate limits and a bounded query queue.
+
+Rate limits reject a caller that exceeds its own budget (429); the query gate
+protects the server as a whole (503). Both answer immediately with a
+Retry-After hint instead of letting requests pile up behind slow LLM calls,
+so the requests that are admitted keep a stable latency.
+
+State is in-process: with several workers each one enforces the limits on
+its own share of the traffic.
+"""
+import asyncio
+import math
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+
+from fastapi import HTTPException
+
+from ..config import (
+    RATE_LIMIT_KEY_RPS,
+    RATE_LIMIT_KEY_BURST,
+    RATE_LIMIT_CLIENT_RPS,
+    RATE_LIMIT_CLIENT_BURST,
+    QUERY_MAX_INFLIGHT,
+    QUERY_MAX_QUEUE,
+    QUERY_QUEUE_TIMEOUT_MS,
+)
+from .. import metrics
+
+
+def _retry_after(seconds: float) -> dict:
+    return {'Retry-After': str(max(1, math.ceil(seconds)))}
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.capacity = max(1, burst)
+        self.tokens = float(self.capacity)
+        self.updated = 0.0
+
+    def take(self, now: float, cost: float = 1.0) -> float:
+        """Consume `cost` tokens; return 0 if allowed, else the seconds until they are available.
+
+        `cost` must not exceed the capacity, or it never becomes available.
+        """
+        self.tokens = min(self.capacity, self.tokens + max(0.0, now - self.updated) * self.rate)
+        self.updated = max(self.updated, now)
+        if self.tokens >= cost:
+            self.tokens -= cost
+            return 0.0
+        return (cost - self.tokens) / self.rate
+
+
+class RateLimiter:
+    """One token bucket per key (API key, client id), least recently used keys dropped."""
+
+    def __init__(self, rate: float, burst: int, name: str, max_keys: int = 100_000):
+        self.rate = rate
+        self.burst = burst
+        self.name = name
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.rate > 0
+
+    def check(self, key) -> None:
+        """Raise 429 with Retry-After when `key` is over its rate."""
+        if not self.enabled:
+            return
+        with self._lock:
+            now = time.monotonic()
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = TokenBucket(self.rate, self.burst)
+                if len(self._buckets) > self.max_keys:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(key)
+            wait = bucket.take(now)
+        if wait > 0:
+            metrics.error('admission', f'rate_limited_{self.name}')
+            raise HTTPException(status_code=429, detail=f'rate limit exceeded for this {self.name.replace("_", " ")}',
+                                headers=_retry_after(wait))
+
+
+class QueryGate:
+    """At most `max_inflight` concurrent requests, a FIFO queue of `max_queue` behind them.
+
+    A request is shed (503) when the queue is full, when it waited
+    `queue_timeout` seconds without getting a slot, or right away when the
+    expected wait (queue length x recent service time / slots) already
+    exceeds the timeout. Lives on the worker's event loop.
+    """
+
+    def __init__(self, max_inflight: int, max_queue: int, queue_timeout: float):
+        self.max_inflight = max_inflight
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.inflight = 0
+        self._waiters = deque()
+        self._service_time = None  # EWMA of seconds a request holds a slot
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_inflight > 0
+
+    def expected_wait(self) -> float:
+        if self._service_time is None:
+            return 0.0
+        return (len(self._waiters) + 1) * self._service_time / self.max_inflight
+
+    def _shed(self, reason: str, retry_after: float):
+        metrics.error('admission', reason)
+        raise HTTPException(status_code=503, detail='server busy, retry later', headers=_retry_after(retry_after))
+
+    async def acquire(self):
+        if self.inflight < self.max_inflight and not self._waiters:
+            self.inflight += 1
+            return
+        if len(self._waiters) >= self.max_queue:
+            self._shed('queue_full', self.expected_wait() or self.queue_timeout)
+        expected = self.expected_wait()
+        if expected > self.queue_timeout:
+            self._shed('queue_predicted_timeout', expected)
+        fut = asyncio.get_running_loop().create_future()
+        self._waiters.append(fut)
+        try:
+            await asyncio.wait_for(fut, self.queue_timeout)
+        except asyncio.TimeoutError:
+            self._shed('queue_timeout', self.expected_wait() or self.queue_timeout)
+        except BaseException:
+            # cancelled while queued: if the slot was already handed over, pass it on
+            if fut.done() and not fut.cancelled():
+                self.release_slot()
+            raise
+        finally:
+            if fut in self._waiters:
+                self._waiters.remove(fut)
+
+    def release_slot(self):
+        # hand the slot straight to the oldest live waiter; inflight stays the same
+        while self._waiters:
+            fut = self._waiters.popleft()
+            if not fut.done():
+                fut.set_result(None)
+                return
+        self.inflight -= 1
+
+    def release(self, held_for: float):
+        self._service_time = held_for if self._service_time is None else 0.8 * self._service_time + 0.2 * held_for
+        self.release_slot()
+
+    @asynccontextmanager
+    async def admit(self):
+        """Hold a slot for the body of the `async with`; raises 503 if shed."""
+        if not self.enabled:
+            yield
+            return
+        await self.acquire()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.release(time.perf_counter() - start)
+
+
+key_limiter = RateLimiter(RATE_LIMIT_KEY_RPS, RATE_LIMIT_KEY_BURST, 'api_key')
+client_limiter = RateLimiter(RATE_LIMIT_CLIENT_RPS, RATE_LIMIT_CLIENT_BURST, 'client')
+query_gate = QueryGate(QUERY_MAX_INFLIGHT, QUERY_MAX_QUEUE, QUERY_QUEUE_TIMEOUT_MS / 1000.0)
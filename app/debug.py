@@ -0,0 +1,175 @@
+"""Opt-in per-request timing breakdown and profiling.
+
+A request is traced only when it asks for it (`X-Debug` header, see config);
+otherwise nothing here runs beyond one context-variable lookup per stage.
+While a trace is active, every `metrics.StageTimer.mark()` in the request also
+lands in the trace, which yields:
+  - a `Server-Timing` header and a `timings_ms` breakdown in the response
+  - 'cpu': a sampling profile of all Python threads, written as folded stacks
+    (`<id>.cpu.folded`, readable by flamegraph.pl or speedscope)
+  - 'alloc': a tracemalloc snapshot (`<id>.alloc.snapshot`, load it with
+    `tracemalloc.Snapshot.load`) and the top allocation sites in the response
+
+The sampler and tracemalloc are process-wide, so only one request is
+profiled at a time and concurrent requests show up in the CPU samples.
+"""
+import contextvars
+import hmac
+import logging
+import sys
+import threading
+import time
+import tracemalloc
+import uuid
+from collections import Counter
+from contextlib import contextmanager
+from typing import Optional
+
+from .config import API_KEYS, DEBUG_PROFILE_DIR, DEBUG_PROFILE_INTERVAL_MS, DEBUG_TOKEN, DEBUG_TRACEMALLOC_FRAMES
+
+logger = logging.getLogger(__name__)
+
+FLAGS = ('timing', 'cpu', 'alloc')
+
+_current: contextvars.ContextVar[Optional['RequestTrace']] = contextvars.ContextVar('debug_trace', default=None)
+_profile_lock = threading.Lock()
+
+# leaf frames in these files mean the thread is parked, not working
+_IDLE_FILES = ('threading.py', 'queue.py', 'selectors.py', 'thread.py')
+
+
+def current() -> Optional['RequestTrace']:
+    return _current.get()
+
+
+def parse_flags(header: str | None, token: str | None) -> set:
+    """Return the requested debug flags, or an empty set when debugging is off or not allowed."""
+    if not header:
+        return set()
+    if DEBUG_TOKEN:
+        if not token or not hmac.compare_digest(token, DEBUG_TOKEN):
+            return set()
+    elif API_KEYS:
+        return set()
+    flags = {f.strip().lower() for f in header.split(',')} & set(FLAGS)
+    if flags:
+        flags.add('timing')
+    return flags
+
+
+class RequestTrace:
+    def __init__(self, flags: set):
+        self.id = uuid.uuid4().hex[:12]
+        self.flags = flags
+        self.stages = {}
+        self.files = {}
+        self.extra = {}
+        self.start = time.perf_counter()
+        self.total = None
+
+    def add(self, stage: str, seconds: float):
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def server_timing(self) -> str:
+        parts = [f'{name};dur={secs * 1000:.2f}' for name, secs in self.stages.items()]
+        parts.append(f'total;dur={(self.total or 0.0) * 1000:.2f}')
+        return ', '.join(parts)
+
+    def summary(self) -> dict:
+        out = {
+            'trace_id': self.id,
+            'total_ms': round((self.total or 0.0) * 1000, 3),
+            'timings_ms': {k: round(v * 1000, 3) for k, v in self.stages.items()},
+        }
+        if self.files:
+            out['files'] = dict(self.files)
+        out.update(self.extra)
+        return out
+
+
+class _Sampler(threading.Thread):
+    """Sample the Python stacks of all other threads every `interval` seconds."""
+
+    def __init__(self, interval: float):
+        super().__init__(name='debug-sampler', daemon=True)
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop_event = threading.Event()
+
+    def run(self):
+        own = threading.get_ident()
+        while not self._stop_event.wait(self.interval):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for tid, frame in sys._current_frames().items():
+                if tid == own or frame.f_code.co_filename.endswith(_IDLE_FILES):
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f'{code.co_name} ({code.co_filename.rsplit("/", 1)[-1]}:{frame.f_lineno})')
+                    frame = frame.f_back
+                stack.append(names.get(tid, str(tid)))
+                self.stacks[';'.join(reversed(stack))] += 1
+            self.samples += 1
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+@contextmanager
+def trace_request(flags: set):
+    """Trace the enclosed request; profiling flags are dropped if another profile is running."""
+    trace = RequestTrace(flags)
+    profiling = bool(flags & {'cpu', 'alloc'}) and _profile_lock.acquire(blocking=False)
+    if flags & {'cpu', 'alloc'} and not profiling:
+        trace.extra['profile_skipped'] = 'another request is being profiled'
+    sampler = None
+    started_tracemalloc = False
+    token = _current.set(trace)
+    try:
+        if profiling and 'alloc' in flags and not tracemalloc.is_tracing():
+            tracemalloc.start(DEBUG_TRACEMALLOC_FRAMES)
+            started_tracemalloc = True
+        if profiling and 'cpu' in flags:
+            sampler = _Sampler(DEBUG_PROFILE_INTERVAL_MS / 1000.0)
+            sampler.start()
+        yield trace
+    finally:
+        trace.total = time.perf_counter() - trace.start
+        _current.reset(token)
+        if sampler is not None:
+            sampler.stop()
+        if profiling:
+            try:
+                _write_profiles(trace, sampler, 'alloc' in flags)
+            except Exception:
+                logger.exception('failed to write debug profile %s', trace.id)
+            finally:
+                if started_tracemalloc:
+                    tracemalloc.stop()
+                _profile_lock.release()
+
+
+def _write_profiles(trace: RequestTrace, sampler: Optional[_Sampler], alloc: bool):
+    DEBUG_PROFILE_DIR.mkdir(parents=True, exist_ok=True)
+    stem = f'{time.strftime("%Y%m%dT%H%M%S")}-{trace.id}'
+    if sampler is not None:
+        path = DEBUG_PROFILE_DIR / f'{stem}.cpu.folded'
+        path.write_text(''.join(f'{stack} {count}\n' for stack, count in sampler.stacks.most_common()))
+        trace.files['cpu_profile'] = str(path)
+        trace.extra['cpu_samples'] = sampler.samples
+    if alloc and tracemalloc.is_tracing():
+        # leave out the profiler's own allocations
+        snapshot = tracemalloc.take_snapshot().filter_traces([
+            tracemalloc.Filter(False, __file__),
+            tracemalloc.Filter(False, tracemalloc.__file__),
+        ])
+        path = DEBUG_PROFILE_DIR / f'{stem}.alloc.snapshot'
+        snapshot.dump(str(path))
+        trace.files['alloc_snapshot'] = str(path)
+        trace.extra['top_allocations'] = [
+            {'where': str(stat.traceback[0]), 'kib': round(stat.size / 1024, 1), 'blocks': stat.count}
+            for stat in snapshot.statistics('lineno')[:10]
+        ]
@@ -0,0 +1,93 @@
+"""Near-duplicate chunk detection for the ingest pipeline.
+
+Providers upload the same brochure as a PDF and a DOCX, or several versions
+of it; chunking then yields pairs of chunks with (nearly) the same text that
+would be embedded, stored and retrieved twice. `find_duplicates` runs before
+embedding and maps every chunk to an earlier kept chunk it nearly duplicates.
+
+Similarity is the Jaccard similarity of word 5-gram shingles, estimated with
+MinHash signatures (NUM_PERM multiply-shift hashes). Candidates come from LSH
+banding (BANDS bands of NUM_PERM / BANDS rows, so pairs from about 0.7
+Jaccard upwards collide in some band) and are confirmed against the
+threshold with the full signature. The first occurrence of a text is kept,
+in chunk order; everything is deterministic, so rebuilds drop the same
+chunks.
+"""
+import re
+import zlib
+from typing import List, Optional
+
+import numpy as np
+
+SHINGLE_WORDS = 5
+NUM_PERM = 128
+BANDS = 16
+
+_WORD = re.compile(r'\w+')
+
+
+def _params(seed: int = 1):
+    rng = np.random.default_rng(seed)
+    a = rng.integers(1, 2 ** 63, size=NUM_PERM, dtype=np.uint64) | np.uint64(1)
+    b = rng.integers(0, 2 ** 63, size=NUM_PERM, dtype=np.uint64)
+    # odd multipliers combining SHINGLE_WORDS word hashes into one shingle hash
+    mix = rng.integers(1, 2 ** 63, size=SHINGLE_WORDS, dtype=np.uint64) | np.uint64(1)
+    return a, b, mix
+
+
+_A, _B, _MIX = _params()
+
+
+def shingles(text: str) -> np.ndarray:
+    """Hashes of the word SHINGLE_WORDS-grams of `text` (lower-cased), as uint64; empty for no words."""
+    words = _WORD.findall(text.lower())
+    if not words:
+        return np.empty(0, dtype=np.uint64)
+    h = np.fromiter((zlib.crc32(w.encode('utf-8')) for w in words), dtype=np.uint64, count=len(words))
+    k = min(SHINGLE_WORDS, len(h))
+    n = len(h) - k + 1
+    out = np.zeros(n, dtype=np.uint64)
+    for j in range(k):
+        out += h[j:j + n] * _MIX[j]  # wraps mod 2**64
+    return np.unique(out)
+
+
+def signature(shingle_hashes: np.ndarray) -> np.ndarray:
+    """MinHash signature (NUM_PERM uint32 values) of a non-empty shingle set."""
+    hashed = (_A[:, None] * shingle_hashes[None, :] + _B[:, None]) >> np.uint64(32)
+    return hashed.min(axis=1).astype(np.uint32)
+
+
+def find_duplicates(texts: List[str], threshold: float) -> List[Optional[int]]:
+    """For each text, the index of the earlier kept text it nearly duplicates, or None if it is kept.
+
+    Two texts are duplicates when their estimated shingle Jaccard similarity
+    is at least `threshold`. Texts without words are always kept.
+    """
+    rows = NUM_PERM // BANDS
+    buckets = [dict() for _ in range(BANDS)]
+    kept_sigs = {}
+    out: List[Optional[int]] = []
+    for i, text in enumerate(texts):
+        sh = shingles(text)
+        if not len(sh):
+            out.append(None)
+            continue
+        sig = signature(sh)
+        keys = [sig[band * rows:(band + 1) * rows].tobytes() for band in range(BANDS)]
+        candidates = set()
+        for band, key in enumerate(keys):
+            candidates.update(buckets[band].get(key, ()))
+        best, best_sim = None, threshold
+        for c in sorted(candidates):
+            sim = float(np.count_nonzero(kept_sigs[c] == sig)) / NUM_PERM
+            if sim >= best_sim and (best is None or sim > best_sim):
+                best, best_sim = c, sim
+        if best is not None:
+            out.append(best)
+            continue
+        out.append(None)
+        kept_sigs[i] = sig
+        for band, key in enumerate(keys):
+            buckets[band].setdefault(key, []).append(i)
+    return out
@@ -1,6 +1,16 @@
 from typing import List
 import os
+import re
+import json
+import hashlib
 import logging
+import threading
+import time
+
+import numpy as np
+
+from .config import EMBEDDING_MODEL, EMBED_BATCH_SIZE, EMBED_ONNX_THREADS, ONNX_MODELS_DIR
+from . import metrics
 
 logger = logging.getLogger(__name__)
 
@@ -10,9 +20,12 @@ DEFAULT_SBERT = "all-MiniLM-L6-v2"
 def get_default_embedding_model() -> str:
     """Return a string key for the preferred embedding model on this machine.
 
-    Format: '<provider>:<model-name>' e.g. 'openai:text-embedding-3-small' or
-    'sbert:all-MiniLM-L6-v2'. This is used to record what was used at index time.
+    Format: '<provider>:<model-name>' e.g. 'openai:text-embedding-3-small',
+    'sbert:all-MiniLM-L6-v2' or 'onnx:all-MiniLM-L6-v2'. This is used to record
+    what was used at index time. `EMBEDDING_MODEL` overrides the choice.
     """
+    if EMBEDDING_MODEL:
+        return EMBEDDING_MODEL
     if os.environ.get("OPENAI_API_KEY"):
         return "openai:text-embedding-3-small"
     return f"sbert:{DEFAULT_SBERT}"
@@ -30,6 +43,8 @@ class EmbeddingProvider:
 
     def __init__(self):
         self.sbert_models = {}
+        self.onnx_models = {}
+        self._lock = threading.Lock()
 
     def _ensure_sbert(self, model_name: str):
         from sentence_transformers import SentenceTransformer
@@ -39,13 +54,48 @@ class EmbeddingProvider:
             self.sbert_models[model_name] = SentenceTransformer(model_name)
         return self.sbert_models[model_name]
 
-    def embed_texts_with_model(self, model_key: str, texts: List[str]) -> List[List[float]]:
+    def _ensure_onnx(self, model_name: str):
+        """Load (exporting and quantizing on first use) the int8 ONNX version of an SBERT model."""
+        with self._lock:
+            if model_name not in self.onnx_models:
+                self.onnx_models[model_name] = _OnnxEncoder(export_onnx_model(model_name), EMBED_ONNX_THREADS)
+            return self.onnx_models[model_name]
+
+    def after_fork(self):
+        """Reset state that must not cross a fork (called in prefork workers).
+
+        SBERT weights stay shared copy-on-write with the master. onnxruntime
+        sessions own native thread pools that do not survive fork(), so they
+        are dropped and reloaded lazily; the int8 models are small.
+        """
+        self._lock = threading.Lock()
+        self.onnx_models = {}
+
+    def embed_texts_with_model(self, model_key: str, texts: List[str], out: np.ndarray | None = None) -> np.ndarray:
         """Embed texts using the named model key.
 
+        Returns a C-contiguous float32 array of shape (len(texts), dim). When
+        `out` is given (a float32 (len(texts), dim) array, e.g. a row slice of
+        a larger preallocated matrix) the embeddings are written into it and
+        `out` is returned.
+
         model_key examples:
           - 'openai:text-embedding-3-small'
           - 'sbert:all-MiniLM-L6-v2'
+          - 'onnx:all-MiniLM-L6-v2' (dynamically quantized int8, CPU)
+          - 'hash:384' (deterministic, model-free; for benchmarks and offline runs)
         """
+        start = time.perf_counter()
+        try:
+            return self._embed(model_key, texts, out)
+        except Exception as e:
+            metrics.error("embedding", e)
+            raise
+        finally:
+            metrics.EMBED_SECONDS.labels(model=model_key).observe(time.perf_counter() - start)
+            metrics.EMBED_TEXTS.labels(model=model_key).inc(len(texts))
+
+    def _embed(self, model_key: str, texts: List[str], out: np.ndarray | None) -> np.ndarray:
         if model_key.startswith("openai:"):
             model_name = model_key.split(":", 1)[1]
             # require API key otherwise fail-fast
@@ -57,30 +107,185 @@ class EmbeddingProvider:
 
                 client = NewOpenAIClient()
                 resp = client.embeddings.create(model=model_name, input=texts)
-                return [e.embedding for e in resp.data]
+                return _to_matrix([e.embedding for e in resp.data], out)
             except Exception:
                 try:
                     import openai as old_openai
 
                     resp = old_openai.Embedding.create(model=model_name, input=texts)
-                    return [e["embedding"] for e in resp["data"]]
+                    return _to_matrix([e["embedding"] for e in resp["data"]], out)
                 except Exception as e:
                     logger.exception("OpenAI embedding call failed: %s", e)
                     raise
 
+        if model_key.startswith("onnx:"):
+            model_name = model_key.split(":", 1)[1]
+            return self._ensure_onnx(model_name).encode(texts, batch_size=EMBED_BATCH_SIZE, out=out)
+
+        if model_key.startswith("hash:"):
+            return hash_embed(texts, int(model_key.split(":", 1)[1] or 384), out=out)
+
         if model_key.startswith("sbert:"):
             model_name = model_key.split(":", 1)[1]
             model = self._ensure_sbert(model_name)
-            embs = model.encode(texts, show_progress_bar=False)
-            # sentence-transformers may return numpy array
-            if hasattr(embs, 'tolist'):
-                embs = embs.tolist()
-            return [list(map(float, e)) for e in embs]
+            embs = model.encode(texts, batch_size=EMBED_BATCH_SIZE, show_progress_bar=False, convert_to_numpy=True)
+            return _to_matrix(embs, out)
 
         raise ValueError(f"Unknown embedding model key: {model_key}")
 
-    def embed_text_with_model(self, model_key: str, text: str) -> List[float]:
+    def embed_text_with_model(self, model_key: str, text: str) -> np.ndarray:
+        """Embed one text; returns a float32 vector of shape (dim,)."""
         return self.embed_texts_with_model(model_key, [text])[0]
 
 
+def _to_matrix(embs, out: np.ndarray | None = None) -> np.ndarray:
+    """Return embeddings as a C-contiguous float32 matrix, copying only when needed."""
+    arr = np.asarray(embs, dtype=np.float32)
+    if arr.ndim == 1:
+        arr = arr.reshape(1, -1)
+    if out is None:
+        return np.ascontiguousarray(arr)
+    if out.shape != arr.shape or out.dtype != np.float32:
+        raise ValueError(f"out buffer has shape {out.shape} {out.dtype}, expected {arr.shape} float32")
+    np.copyto(out, arr)
+    return out
+
+
+_HASH_TOKEN_RE = re.compile(r"\w+")
+
+
+def hash_embed(texts: List[str], dim: int = 384, out: np.ndarray | None = None) -> np.ndarray:
+    """Feature-hashed bag of words and word bigrams, L2-normalised.
+
+    Deterministic across processes and machines and needs no model, so
+    benchmarks and offline runs exercise the real FAISS/retrieval path. Texts
+    sharing words get similar vectors; it is not a semantic model.
+    """
+    if out is None:
+        out = np.zeros((len(texts), dim), dtype=np.float32)
+    else:
+        if out.shape != (len(texts), dim) or out.dtype != np.float32:
+            raise ValueError(f"out buffer has shape {out.shape} {out.dtype}, expected {(len(texts), dim)} float32")
+        out.fill(0.0)
+    for row, text in enumerate(texts):
+        words = _HASH_TOKEN_RE.findall(text.lower())
+        for feature in words + [a + ' ' + b for a, b in zip(words, words[1:])]:
+            h = int.from_bytes(hashlib.blake2b(feature.encode('utf-8'), digest_size=8).digest(), 'little')
+            out[row, h % dim] += 1.0 if (h >> 63) else -1.0
+        norm = np.linalg.norm(out[row])
+        if norm > 0:
+            out[row] /= norm
+    return out
+
+
+def _onnx_model_dir(model_name: str):
+    return ONNX_MODELS_DIR / model_name.replace('/', '__')
+
+
+def export_onnx_model(model_name: str, force: bool = False):
+    """Export an SBERT model's transformer to ONNX and quantize it to int8.
+
+    Writes `model.onnx` (fp32), `model.int8.onnx`, the tokenizer files and a
+    `pooling.json` describing how token embeddings are pooled into the
+    sentence embedding. Returns the model directory; reuses an existing export
+    unless `force` is set.
+    """
+    out_dir = _onnx_model_dir(model_name)
+    quantized = out_dir / 'model.int8.onnx'
+    if quantized.exists() and not force:
+        return out_dir
+
+    import torch
+    from sentence_transformers import SentenceTransformer
+    from onnxruntime.quantization import quantize_dynamic, QuantType
+
+    logger.info("Exporting %s to ONNX (int8) in %s", model_name, out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    st = SentenceTransformer(model_name, device='cpu')
+    transformer = st[0]
+    hf_model = transformer.auto_model.eval()
+    tokenizer = transformer.tokenizer
+    tokenizer.save_pretrained(str(out_dir))
+
+    pooling = {'max_seq_length': int(st.max_seq_length or 256), 'mode': 'mean', 'normalize': False}
+    for module in st:
+        name = type(module).__name__
+        if name == 'Pooling':
+            if getattr(module, 'pooling_mode_cls_token', False):
+                pooling['mode'] = 'cls'
+            elif getattr(module, 'pooling_mode_max_tokens', False):
+                pooling['mode'] = 'max'
+        elif name == 'Normalize':
+            pooling['normalize'] = True
+    (out_dir / 'pooling.json').write_text(json.dumps(pooling, indent=2))
+
+    sample = tokenizer(['export sample'], return_tensors='pt')
+    input_names = [n for n in ('input_ids', 'attention_mask', 'token_type_ids') if n in sample]
+    dynamic = {n: {0: 'batch', 1: 'seq'} for n in input_names}
+    dynamic['last_hidden_state'] = {0: 'batch', 1: 'seq'}
+    fp32 = out_dir / 'model.onnx'
+    with torch.no_grad():
+        torch.onnx.export(
+            hf_model,
+            tuple(sample[n] for n in input_names),
+            str(fp32),
+            input_names=input_names,
+            output_names=['last_hidden_state'],
+            dynamic_axes=dynamic,
+            opset_version=14,
+        )
+    tmp = out_dir / 'model.int8.onnx.tmp'
+    quantize_dynamic(str(fp32), str(tmp), weight_type=QuantType.QInt8)
+    tmp.replace(quantized)
+    return out_dir
+
+
+class _OnnxEncoder:
+    """Sentence encoder over an exported ONNX transformer (onnxruntime, CPU)."""
+
+    def __init__(self, model_dir, threads: int = 0, quantized: bool = True):
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+
+        opts = ort.SessionOptions()
+        if threads > 0:
+            opts.intra_op_num_threads = threads
+        opts.inter_op_num_threads = 1
+        opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        path = model_dir / ('model.int8.onnx' if quantized else 'model.onnx')
+        self.session = ort.InferenceSession(str(path), sess_options=opts, providers=['CPUExecutionProvider'])
+        self.input_names = {i.name for i in self.session.get_inputs()}
+        self.tokenizer = AutoTokenizer.from_pretrained(str(model_dir))
+        self.pooling = json.loads((model_dir / 'pooling.json').read_text())
+
+    def encode(self, texts: List[str], batch_size: int = 64, out: np.ndarray | None = None) -> np.ndarray:
+        if not texts:
+            return np.empty((0, 0), dtype=np.float32) if out is None else out
+        # batch texts of similar length together to minimise padding; each
+        # pooled batch is written straight into its rows of the result
+        order = np.argsort([len(t) for t in texts], kind='stable')
+        for start in range(0, len(order), max(1, batch_size)):
+            rows = order[start:start + batch_size]
+            enc = self.tokenizer([texts[i] for i in rows], padding=True, truncation=True,
+                                 max_length=self.pooling['max_seq_length'], return_tensors='np')
+            feeds = {k: v.astype(np.int64) for k, v in enc.items() if k in self.input_names}
+            hidden = self.session.run(None, feeds)[0]
+            mask = enc['attention_mask'].astype(np.float32)[:, :, None]
+            if self.pooling['mode'] == 'cls':
+                pooled = hidden[:, 0]
+            elif self.pooling['mode'] == 'max':
+                pooled = np.where(mask > 0, hidden, -1e9).max(axis=1)
+            else:
+                pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+            if self.pooling['normalize']:
+                pooled /= np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+            if out is None:
+                out = np.empty((len(texts), pooled.shape[1]), dtype=np.float32)
+            elif out.shape != (len(texts), pooled.shape[1]) or out.dtype != np.float32:
+                raise ValueError(f"out buffer has shape {out.shape} {out.dtype}, "
+                                 f"expected {(len(texts), pooled.shape[1])} float32")
+            out[rows] = pooled
+        return out
+
+
 default_embedding_provider = EmbeddingProvider()
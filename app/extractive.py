@@ -0,0 +1,101 @@
+"""Extractive answering without an LLM.
+
+Splits the retrieved context into sentences (also at passage and line breaks,
+and between the fields of the JSON metadata passage), embeds them in one batch with the
+provider's embedding model and ranks them by cosine similarity to the query
+embedding, plus a small bonus for sharing the question's content words. The
+best sentences are returned in their original order. Used as an explicit
+low-latency mode and as the fallback when the LLM is unavailable or misses
+the request deadline. After a missed deadline only the word-overlap score is
+used (`qvec=None`): no embedding call, so the fallback stays fast and offline
+even for remote embedding models.
+"""
+import re
+import logging
+from typing import List
+
+import numpy as np
+
+from .embeddings import default_embedding_provider
+
+logger = logging.getLogger(__name__)
+
+# sentence ends, line breaks (also JSON-escaped ones) and the commas between JSON fields
+_SENTENCE_RE = re.compile(r'(?<=[.!?])\s+|\s*(?:\n|\\n)\s*|"?\s*,\s*(?="[^"]+"\s*:)')
+_JSON_KEY_RE = re.compile(r'"\s*:\s*"?')
+_EDGE_CHARS = ' \t{}[]",:\''
+_WORD_RE = re.compile(r"\w+")
+_STOPWORDS = {
+    'a', 'an', 'the', 'is', 'are', 'was', 'were', 'be', 'do', 'does', 'did', 'what', 'which',
+    'who', 'whom', 'how', 'when', 'where', 'why', 'of', 'to', 'in', 'on', 'for', 'and', 'or',
+    'you', 'your', 'i', 'me', 'my', 'we', 'our', 'it', 'its', 'this', 'that', 'with', 'can',
+    'about', 'any', 'there', 'have', 'has', 'tell', 'please',
+}
+
+# weight of the lexical overlap term relative to cosine similarity
+LEXICAL_WEIGHT = 0.3
+MIN_SCORE = 0.2
+
+
+def split_sentences(text: str, min_chars: int = 20, max_chars: int = 400) -> List[str]:
+    out = []
+    seen = set()
+    for s in _SENTENCE_RE.split(text):
+        # unquote JSON fragments: '{"charges": "See pricing"' -> 'charges: See pricing'
+        s = _JSON_KEY_RE.sub(': ', s.strip(_EDGE_CHARS)).strip(_EDGE_CHARS)
+        if len(s) < min_chars or sum(c.isalnum() for c in s) < len(s) / 2:
+            # too short, or mostly punctuation and quotes
+            continue
+        s = s[:max_chars]
+        norm = s.lower()
+        if norm in seen:
+            continue
+        seen.add(norm)
+        out.append(s)
+    return out
+
+
+def _content_words(text: str) -> set:
+    return {w for w in _WORD_RE.findall(text.lower()) if w not in _STOPWORDS}
+
+
+def extractive_answer(question: str, qvec, context: str, model_key: str, max_sentences: int = 3) -> str:
+    """Return the sentences of `context` that best answer `question`.
+
+    `qvec` is the query embedding already computed for retrieval, or None to
+    rank by word overlap only (no model call). Returns
+    'Not available.' when no sentence scores above MIN_SCORE.
+    """
+    sentences = split_sentences(context)
+    if not sentences:
+        return 'Not available.'
+
+    q_words = _content_words(question)
+    lexical = np.array(
+        [len(q_words & _content_words(s)) / len(q_words) if q_words else 0.0 for s in sentences],
+        dtype='float32',
+    )
+    if qvec is None:
+        # lexical retrieval did not embed the question; stay model-free
+        scores = lexical
+    else:
+        scores = _semantic_scores(qvec, sentences, model_key, lexical)
+
+    order = np.argsort(-scores)[:max_sentences]
+    picked = sorted(int(i) for i in order if scores[i] >= MIN_SCORE)
+    if not picked:
+        return 'Not available.'
+    return ' '.join(sentences[i] for i in picked)
+
+
+def _semantic_scores(qvec, sentences: List[str], model_key: str, lexical):
+    try:
+        embs = default_embedding_provider.embed_texts_with_model(model_key, sentences)
+        q = np.asarray(qvec, dtype='float32').reshape(-1)
+        embs /= np.linalg.norm(embs, axis=1, keepdims=True) + 1e-12
+        q = q / (np.linalg.norm(q) + 1e-12)
+        return embs @ q + LEXICAL_WEIGHT * lexical
+    except Exception:
+        # keep answering offline even if sentence embedding fails
+        logger.exception('sentence embedding failed; ranking sentences lexically')
+        return lexical
@@ -0,0 +1,179 @@
+"""Dense search across many providers at once (marketplace clients).
+
+The question is embedded once per embedding model in use, then every
+provider's FAISS index is searched in parallel on a shared thread pool (FAISS
+releases the GIL while searching, so the searches overlap). Per-provider
+top-k lists are merged into one ranking and only the chunks that make the
+final top-k are read, with one bulk query per provider.
+
+Scores: providers built with the same embedding model share a vector space,
+so their L2 distances are merged directly (lower is better). When the
+selected providers use different models the distances are not comparable and
+the per-model rankings are combined with reciprocal rank fusion instead.
+"""
+import logging
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from sqlitedict import SqliteDict
+
+from .config import FANOUT_THREADS, INDEX_CACHE_SIZE
+from .embeddings import default_embedding_provider
+from .provider_store import get_provider_index, has_index, index_file, index_model
+from .chunk_meta import FaissFilter, load_chunk_meta, provenance
+from .retrieval import fetch_chunks, rrf_fuse
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+_pool = ThreadPoolExecutor(max_workers=max(1, FANOUT_THREADS), thread_name_prefix='fanout')
+
+# (embedding model, vector keys) per provider, valid until the index is rebuilt;
+# saves opening the sqlite db of every provider on every request
+_meta_cache: "OrderedDict[str, tuple]" = OrderedDict()
+_meta_lock = threading.Lock()
+
+
+class FanoutError(Exception):
+    """A provider could not be searched; it is reported and left out of the results."""
+
+
+def provider_paths(providers_dir: Path, provider: str) -> Dict[str, Path]:
+    root = providers_dir / provider
+    return {'root': root, 'db': root / 'db', 'index': root / 'index'}
+
+
+def _open(paths: Dict[str, Path]) -> SqliteDict:
+    db_path = paths['db'] / 'metadata.sqlite'
+    if not db_path.exists() or not has_index(paths['index']):
+        raise FanoutError('provider index not built')
+    return SqliteDict(str(db_path), flag='r')
+
+
+def _load(paths: Dict[str, Path]) -> Tuple[str, list]:
+    """(embedding model, vector keys) of a provider; also warms its FAISS index."""
+    key = str(paths['root'])
+    try:
+        version = os.stat(index_file(paths['index'])).st_mtime_ns
+    except OSError:
+        raise FanoutError('provider index not built')
+    with _meta_lock:
+        hit = _meta_cache.get(key)
+        if hit is not None and hit[0] == version:
+            _meta_cache.move_to_end(key)
+            metrics.cache_event('fanout_meta', True)
+            get_provider_index(paths['index'])
+            return hit[1], hit[2]
+    metrics.cache_event('fanout_meta', False)
+    index = get_provider_index(paths['index'])
+    with _open(paths) as pdb:
+        model_key = index_model(index, pdb)
+        vector_keys = pdb.get('vector_keys', [])
+    with _meta_lock:
+        _meta_cache[key] = (version, model_key, vector_keys)
+        _meta_cache.move_to_end(key)
+        while len(_meta_cache) > max(1, INDEX_CACHE_SIZE):
+            _meta_cache.popitem(last=False)
+    return model_key, vector_keys
+
+
+def _search_one(paths: Dict[str, Path], vector_keys: list, qvec, top_k: int,
+                filters: Optional[dict]) -> List[Tuple[str, float]]:
+    index = get_provider_index(paths['index'])
+    if index.ntotal == 0:
+        return []
+    if vector_keys and len(vector_keys) != index.ntotal:
+        raise FanoutError(f'index and DB out of sync (index count={index.ntotal}, db vectors={len(vector_keys)})')
+    if index.d != qvec.shape[1]:
+        raise FanoutError(f'index dimension {index.d} does not match the query embedding ({qvec.shape[1]})')
+    if filters:
+        meta = load_chunk_meta(paths['index'] / 'chunk_meta.npz')
+        if meta is None or meta.n_chunks != index.ntotal:
+            raise FanoutError('no chunk metadata for filtering; rebuild the provider index')
+        mask = meta.mask(**filters)
+        if mask is not None:
+            if not mask.any():
+                return []
+            sel = FaissFilter(mask)
+            D, I = index.search(qvec, max(1, min(top_k, sel.count)), params=sel.params)
+            return [(vector_keys[i], float(d)) for d, i in zip(D[0], I[0]) if 0 <= i < len(vector_keys)]
+    D, I = index.search(qvec, max(1, min(top_k, index.ntotal)))
+    return [(vector_keys[i], float(d)) for d, i in zip(D[0], I[0]) if 0 <= i < len(vector_keys)]
+
+
+def _fetch(paths: Dict[str, Path], keys: List[str]) -> dict:
+    with _open(paths) as pdb:
+        return fetch_chunks(pdb, keys)
+
+
+def _gather(fn, jobs: Dict[str, tuple], errors: Dict[str, str]) -> dict:
+    """Run fn(*args) for every provider on the pool; failures land in `errors`."""
+    futures = {p: _pool.submit(fn, *args) for p, args in jobs.items()}
+    results = {}
+    for provider, fut in futures.items():
+        try:
+            results[provider] = fut.result()
+        except FanoutError as e:
+            errors[provider] = str(e)
+        except Exception as e:
+            metrics.error('fanout', e)
+            logger.warning('fan-out search failed for provider=%s: %s', provider, e)
+            errors[provider] = f'{type(e).__name__}: {e}'
+    return results
+
+
+def search_providers(providers_dir: Path, providers: List[str], question: str, top_k: int,
+                     filters: Optional[dict] = None) -> dict:
+    """Return {'hits': [...], 'errors': {provider: reason}, 'score_kind', 'model'} for the merged top-k.
+
+    Hits carry provider, key, text, start, end, score and provenance. Scores
+    are L2 distances ('l2', lower is better; `model` names the embedding
+    model) or, when providers use different embedding models, RRF scores
+    ('rrf', higher is better; `model` is None).
+    `filters` apply to every provider, as in retrieval.retrieve().
+    """
+    stages = metrics.StageTimer(metrics.QUERY_STAGE_SECONDS, provider='fanout')
+    paths = {p: provider_paths(providers_dir, p) for p in providers}
+    errors: Dict[str, str] = {}
+
+    loaded = _gather(_load, {p: (paths[p],) for p in providers}, errors)
+    models = {p: model_key for p, (model_key, _) in loaded.items()}
+    stages.mark('index_load')
+    qvecs = {}
+    for model_key in sorted(set(models.values())):
+        # one embedding per model, shared by every provider built with it
+        qvecs[model_key] = default_embedding_provider.embed_texts_with_model(model_key, [question])
+    stages.mark('embed')
+
+    found = _gather(_search_one, {p: (paths[p], keys, qvecs[models[p]], top_k, filters)
+                                  for p, (_, keys) in loaded.items()}, errors)
+    stages.mark('search')
+
+    by_model: Dict[str, List[Tuple[tuple, float]]] = {}
+    for provider, ranked in found.items():
+        by_model.setdefault(models[provider], []).extend(((provider, key), d) for key, d in ranked)
+    rankings = [sorted(r, key=lambda t: t[1]) for r in by_model.values()]
+    if len(rankings) > 1:
+        merged = rrf_fuse(rankings, top_k)
+    else:
+        merged = rankings[0][:top_k] if rankings else []
+
+    wanted: Dict[str, List[str]] = {}
+    for (provider, key), _ in merged:
+        wanted.setdefault(provider, []).append(key)
+    chunks = _gather(_fetch, {p: (paths[p], keys) for p, keys in wanted.items()}, errors)
+    hits = []
+    for (provider, key), score in merged:
+        chunk = chunks.get(provider, {}).get(key)
+        if chunk:
+            hits.append({'provider': provider, 'key': key, 'text': chunk['text'],
+                         'start': chunk.get('start'), 'end': chunk.get('end'), 'score': score,
+                         'provenance': dict(provenance(chunk), key=key)})
+    stages.mark('chunk_fetch')
+    fused = len(rankings) > 1
+    return {'hits': hits, 'errors': errors, 'score_kind': 'rrf' if fused else 'l2',
+            'model': None if fused else next(iter(by_model), None)}
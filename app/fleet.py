@@ -0,0 +1,353 @@
+"""Fleet rebuild: rebuild many providers on a process pool with one shared embedder.
+
+Parsing, chunking, BM25 and FAISS run in `workers` build processes, one
+provider at a time each. Embedding does not: every worker sends its chunk
+texts to an `EmbeddingService` in the parent process, whose threads coalesce
+requests from all workers into large batches (small providers share a batch),
+keep a single copy of the model in memory and throttle remote APIs to the
+configured requests/tokens per minute, retrying failed calls with backoff.
+
+Progress is checkpointed after every provider to a JSON file together with a
+fingerprint of the build settings (embedding model, sharding); a rerun with
+the same settings skips the providers already done, so an interrupted run
+resumes where it stopped. Providers that were in flight are rebuilt.
+"""
+import json
+import logging
+import multiprocessing as mp
+import queue
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from .core.admission import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+# texts per request a worker sends to the embedder; larger providers are split
+REQUEST_TEXTS = 256
+EMBED_RETRIES = 5
+
+
+class Throttle:
+    """Requests- and tokens-per-minute budget shared by the embedder threads (0 = unlimited)."""
+
+    def __init__(self, rpm: float = 0, tpm: float = 0):
+        # ten seconds of budget may be spent at once
+        self.requests = TokenBucket(rpm / 60.0, max(1, int(rpm / 6))) if rpm > 0 else None
+        self.tokens = TokenBucket(tpm / 60.0, max(1, int(tpm / 6))) if tpm > 0 else None
+        self.waited = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.requests is not None or self.tokens is not None
+
+    def wait(self, requests: int, tokens: int):
+        for bucket, cost in ((self.requests, requests), (self.tokens, tokens)):
+            if bucket is None:
+                continue
+            # a batch larger than the burst is paid for in burst-sized pieces, all of it charged
+            while cost > 0:
+                piece = min(cost, bucket.capacity)
+                with self._lock:
+                    delay = bucket.take(time.monotonic(), piece)
+                if not delay:
+                    cost -= piece
+                    continue
+                self.waited += delay
+                time.sleep(delay)
+
+
+class EmbeddingService:
+    """Batches embedding requests from the build workers (runs in the parent process)."""
+
+    def __init__(self, requests, responses: List, threads: int = 1, batch_texts: int = 1024,
+                 max_wait_ms: float = 20.0, throttle: Optional[Throttle] = None):
+        self.requests = requests
+        self.responses = responses
+        self.batch_texts = batch_texts
+        self.max_wait = max_wait_ms / 1000.0
+        self.throttle = throttle or Throttle()
+        self.stats = {'texts': 0, 'batches': 0, 'seconds': 0.0, 'retries': 0}
+        self._stats_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._threads = [threading.Thread(target=self._run, name=f'fleet-embed-{i}', daemon=True)
+                         for i in range(max(1, threads))]
+
+    def start(self):
+        for t in self._threads:
+            t.start()
+
+    def stop(self):
+        self._stop.set()
+        for t in self._threads:
+            t.join(timeout=5)
+
+    def _collect(self) -> list:
+        try:
+            batch = [self.requests.get(timeout=0.1)]
+        except queue.Empty:
+            return []
+        n = len(batch[0][3])
+        deadline = time.monotonic() + self.max_wait
+        while n < self.batch_texts:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                req = self.requests.get(timeout=remaining)
+            except queue.Empty:
+                break
+            batch.append(req)
+            n += len(req[3])
+        return batch
+
+    def _embed(self, model_key: str, texts: List[str]) -> np.ndarray:
+        from .pipeline import embed_chunks
+
+        if self.throttle.enabled and model_key.startswith('openai:'):
+            from .config import EMBED_BATCH_SIZE
+            from .tokenizer import count_tokens
+
+            calls = -(-len(texts) // (EMBED_BATCH_SIZE * 16))
+            self.throttle.wait(calls, sum(count_tokens(t) for t in texts) if self.throttle.tokens else 0)
+        for attempt in range(EMBED_RETRIES):
+            try:
+                return embed_chunks(model_key, texts)
+            except ValueError:
+                raise  # unknown model key: retrying will not help
+            except Exception as e:
+                if attempt == EMBED_RETRIES - 1:
+                    raise
+                with self._stats_lock:
+                    self.stats['retries'] += 1
+                logger.warning('embedding batch failed (%s), retrying in %ds', e, 2 ** attempt)
+                time.sleep(2 ** attempt)
+
+    def _run(self):
+        while not self._stop.is_set():
+            batch = self._collect()
+            by_model: Dict[str, list] = {}
+            for req in batch:
+                by_model.setdefault(req[2], []).append(req)
+            for model_key, reqs in by_model.items():
+                texts = [t for r in reqs for t in r[3]]
+                start = time.perf_counter()
+                try:
+                    vectors = self._embed(model_key, texts)
+                except Exception as e:
+                    for worker, req_id, _, _ in reqs:
+                        self.responses[worker].put((req_id, RuntimeError(f'embedding failed: {e}')))
+                    continue
+                with self._stats_lock:
+                    self.stats['texts'] += len(texts)
+                    self.stats['batches'] += 1
+                    self.stats['seconds'] += time.perf_counter() - start
+                offset = 0
+                for worker, req_id, _, req_texts in reqs:
+                    self.responses[worker].put((req_id, vectors[offset:offset + len(req_texts)]))
+                    offset += len(req_texts)
+
+
+class RemoteEmbedder:
+    """`embed(model_key, texts)` for a build worker, served by the parent's EmbeddingService."""
+
+    def __init__(self, worker: int, requests, responses):
+        self.worker = worker
+        self.requests = requests
+        self.responses = responses
+        self._next = 0
+
+    def __call__(self, model_key: str, texts: List[str]) -> np.ndarray:
+        pending = {}
+        for start in range(0, len(texts), REQUEST_TEXTS):
+            self._next += 1
+            pending[self._next] = start
+            self.requests.put((self.worker, self._next, model_key, texts[start:start + REQUEST_TEXTS]))
+        vectors = None
+        while pending:
+            req_id, result = self.responses.get()
+            if req_id not in pending:
+                continue  # left over from a failed earlier call
+            if isinstance(result, Exception):
+                raise result
+            if vectors is None:
+                vectors = np.empty((len(texts), result.shape[1]), dtype=np.float32)
+            start = pending.pop(req_id)
+            vectors[start:start + len(result)] = result
+        return vectors
+
+
+def _worker_main(worker: int, tasks, results, requests, responses, base_dir: str, build_kwargs: dict,
+                 export_dir: Optional[str]):
+    from .pipeline import build_index_for_provider
+
+    logging.basicConfig(level=logging.WARNING)
+    embed = RemoteEmbedder(worker, requests, responses)
+    while True:
+        provider = tasks.get()
+        if provider is None:
+            return
+        results.put(('start', worker, provider, None))
+        start = time.perf_counter()
+        texts = []
+
+        def counting(model_key, chunk_texts):
+            texts.append(len(chunk_texts))
+            return embed(model_key, chunk_texts)
+
+        try:
+            dedup = build_index_for_provider(provider, Path(base_dir), embed=counting, **build_kwargs)['dedup']
+            info = {'seconds': round(time.perf_counter() - start, 3), 'chunks': sum(texts),
+                    'duplicates': dedup['dropped'], 'tokens_saved': dedup['tokens_saved']}
+            if export_dir:
+                from .bundle import export_bundle
+
+                out = Path(export_dir) / f'{provider}.tar'
+                info['build_id'] = export_bundle(Path(base_dir) / provider, out)['build_id']
+            results.put(('done', worker, provider, info))
+        except Exception as e:
+            results.put(('failed', worker, provider, {'seconds': round(time.perf_counter() - start, 3),
+                                                      'error': f'{type(e).__name__}: {e}'}))
+
+
+def build_fingerprint(model_key: str, build_kwargs: dict) -> dict:
+    """Settings that make two builds of a provider equivalent; a checkpoint only resumes a matching run."""
+    from .chunking import get_chunker
+    from .config import DEDUP_THRESHOLD, INDEX_SHARDS, INDEX_SHARD_BY
+
+    # a provider's own chunking.json is not covered; it applies the same on resume
+    return {'embedding_model': model_key,
+            'shards': build_kwargs.get('shards') or INDEX_SHARDS,
+            'shard_by': build_kwargs.get('shard_by') or INDEX_SHARD_BY,
+            'dedup': build_kwargs.get('dedup', DEDUP_THRESHOLD),
+            'chunking': get_chunker(chunking=build_kwargs.get('chunking')).spec}
+
+
+def load_checkpoint(path: Path, fingerprint: dict) -> dict:
+    try:
+        state = json.loads(path.read_text(encoding='utf-8'))
+    except (OSError, ValueError):
+        state = None
+    if state is not None and state.get('fingerprint') != fingerprint:
+        logger.warning('checkpoint %s was written for different build settings; starting over', path)
+        state = None
+    return state or {'fingerprint': fingerprint, 'providers': {}}
+
+
+def save_checkpoint(path: Path, state: dict):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.name + '.tmp')
+    tmp.write_text(json.dumps(state, indent=2), encoding='utf-8')
+    tmp.replace(path)
+
+
+def rebuild_fleet(providers: List[str], base_dir: Path, checkpoint: Path, workers: int = 2,
+                  build_kwargs: Optional[dict] = None, embed_threads: int = 1, batch_texts: int = 1024,
+                  throttle: Optional[Throttle] = None, export_dir: Optional[Path] = None,
+                  progress=None) -> dict:
+    """Rebuild `providers`, skipping those the checkpoint already has as done; returns a report."""
+    from .embeddings import get_default_embedding_model
+
+    build_kwargs = build_kwargs or {}
+    fingerprint = build_fingerprint(get_default_embedding_model(), build_kwargs)
+    state = load_checkpoint(checkpoint, fingerprint)
+    done = {p for p, r in state['providers'].items() if r.get('status') == 'done'}
+    todo = [p for p in providers if p not in done]
+    skipped = len(providers) - len(todo)
+
+    ctx = mp.get_context('spawn')  # the parent runs embedder threads; do not fork them
+    workers = max(1, min(workers, len(todo))) if todo else 0
+    tasks, results, requests = ctx.Queue(), ctx.Queue(), ctx.Queue()
+    responses = [ctx.Queue() for _ in range(workers)]
+    service = EmbeddingService(requests, responses, threads=embed_threads, batch_texts=batch_texts,
+                               throttle=throttle)
+    for p in todo:
+        tasks.put(p)
+    for _ in range(workers):
+        tasks.put(None)
+    procs = [ctx.Process(target=_worker_main, name=f'fleet-build-{i}',
+                         args=(i, tasks, results, requests, responses[i], str(base_dir), build_kwargs,
+                               str(export_dir) if export_dir else None))
+             for i in range(workers)]
+
+    start = time.perf_counter()
+    in_flight: Dict[int, str] = {}
+    counts = {'done': 0, 'failed': 0}
+    chunks = duplicates = tokens_saved = 0
+    interrupted = False
+    service.start()
+    for proc in procs:
+        proc.start()
+    try:
+        remaining = len(todo)
+        while remaining:
+            try:
+                kind, worker, provider, info = results.get(timeout=1.0)
+            except queue.Empty:
+                for i, proc in enumerate(procs):
+                    if not proc.is_alive() and i in in_flight:
+                        provider = in_flight.pop(i)
+                        state['providers'][provider] = {'status': 'failed',
+                                                        'error': f'build process exited ({proc.exitcode})'}
+                        counts['failed'] += 1
+                        remaining -= 1
+                if not any(proc.is_alive() for proc in procs) and remaining:
+                    logger.error('all build processes exited with %d providers left', remaining)
+                    break
+                continue
+            if kind == 'start':
+                in_flight[worker] = provider
+                continue
+            in_flight.pop(worker, None)
+            remaining -= 1
+            counts[kind] += 1
+            chunks += (info or {}).get('chunks', 0)
+            duplicates += (info or {}).get('duplicates', 0)
+            tokens_saved += (info or {}).get('tokens_saved', 0)
+            state['providers'][provider] = dict(info or {}, status=kind, finished_at=time.time())
+            save_checkpoint(checkpoint, state)
+            if progress is not None:
+                progress(kind, provider, info, counts, len(todo))
+    except KeyboardInterrupt:
+        interrupted = True
+        logger.warning('interrupted; %d providers in flight will be rebuilt on resume', len(in_flight))
+    finally:
+        for proc in procs:
+            if interrupted:
+                proc.terminate()
+            proc.join(timeout=None if not interrupted else 10)
+        service.stop()
+        # nobody reads these any more; do not block exit flushing them
+        for q in [tasks] + responses:
+            q.cancel_join_thread()
+        save_checkpoint(checkpoint, state)
+
+    wall = time.perf_counter() - start
+    embed = dict(service.stats, seconds=round(service.stats['seconds'], 3),
+                 throttled_s=round(service.throttle.waited, 3))
+    embed['mean_batch'] = round(embed['texts'] / embed['batches'], 1) if embed['batches'] else 0
+    selected = {p: state['providers'][p] for p in providers if p in state['providers']}
+    failed = {p: r.get('error') for p, r in selected.items() if r.get('status') == 'failed'}
+    slowest = sorted(((r.get('seconds', 0), p) for p, r in selected.items() if r.get('status') == 'done'),
+                     reverse=True)[:5]
+    return {
+        'fingerprint': fingerprint,
+        'interrupted': interrupted,
+        'providers': {'total': len(providers), 'skipped': skipped, 'done': counts['done'],
+                      'failed': counts['failed']},
+        'workers': workers,
+        'wall_s': round(wall, 3),
+        'chunks': chunks,
+        'chunks_per_s': round(chunks / wall, 1) if wall > 0 else 0.0,
+        'dedup': {'dropped': duplicates, 'tokens_saved': tokens_saved},
+        'providers_per_min': round(counts['done'] * 60.0 / wall, 2) if wall > 0 else 0.0,
+        'embedding': embed,
+        'slowest': [{'provider': p, 'seconds': s} for s, p in slowest],
+        'errors': failed,
+        'checkpoint': str(checkpoint),
+    }
@@ -0,0 +1,336 @@
+"""Cluster gateway: routes queries to the nodes that own the client's provider.
+
+Run it instead of (in front of) the nodes:
+
+    CLUSTER_TOKEN=... CLUSTER_NODES=a=http://10.0.0.1:8000,b=http://10.0.0.2:8000 \
+        uvicorn app.gateway:app --port 8080
+
+/v1/query resolves client -> provider with the usual client mapping, looks up
+the provider's owners on the hash ring (app/cluster.py) and forwards the
+request to the first healthy owner, trying the replicas on connection errors
+and 5xx. /v1/search is split by owning node and the hits merged (by
+distance when every node searched with one embedding model, else by RRF).
+
+Membership changes go through /v1/cluster/nodes (join) and
+/v1/cluster/nodes/{name} (leave); both rebalance: providers whose owners
+changed are copied to their new owners (node to node) and, once copied,
+dropped from nodes that no longer own them. Until its copy finishes, a
+moving provider keeps being routed to the nodes that hold it now (a leaving
+node stays reachable for that long).
+"""
+import asyncio
+import logging
+import time
+from typing import Dict, List, Optional
+
+import httpx
+from fastapi import Depends, FastAPI, HTTPException, Request, Response
+from fastapi.responses import JSONResponse
+
+from .app_db import get_client_provider
+from .cluster import HashRing, load_state, parse_nodes, plan_moves, save_state, valid_provider_name
+from .config import (
+    CLUSTER_NODES,
+    CLUSTER_REPLICAS,
+    CLUSTER_TOKEN,
+    CLUSTER_STATE_FILE,
+    CLUSTER_HEALTH_INTERVAL_S,
+    CLUSTER_FORWARD_TIMEOUT_S,
+)
+from .core.security import api_key_auth
+from .retrieval import rrf_fuse
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+app = FastAPI(title="AI Agent - Cluster Gateway")
+
+# request headers passed through to the node
+FORWARD_HEADERS = ('x-api-key', 'x-debug', 'x-debug-token', 'content-type')
+# response headers passed back to the caller
+RETURN_HEADERS = ('retry-after', 'server-timing', 'content-type')
+
+
+class Cluster:
+    def __init__(self, nodes: Dict[str, str], replicas: int):
+        self.nodes = dict(nodes)
+        self.replicas = replicas
+        self.ring = HashRing(self.nodes)
+        self.down: Dict[str, float] = {}  # node -> time it was marked down
+        self.pending: Dict[str, List[str]] = {}  # provider being moved -> nodes holding it now
+        self.retiring: Dict[str, str] = {}  # removed nodes still holding a pending provider
+        self.lock = asyncio.Lock()  # serialises membership changes / rebalances
+
+    def set_nodes(self, nodes: Dict[str, str]):
+        self.nodes = dict(nodes)
+        self.ring = HashRing(self.nodes)
+        self.down = {n: t for n, t in self.down.items() if n in self.nodes or n in self.retiring}
+        save_state(CLUSTER_STATE_FILE, self.nodes)
+
+    def url(self, node: str) -> str:
+        return self.nodes.get(node) or self.retiring[node]
+
+    def route(self, provider: str) -> List[str]:
+        """Owners of `provider` (its current holders while it is being moved), healthy ones first."""
+        owners = self.pending.get(provider) or self.ring.owners(provider, self.replicas)
+        return [n for n in owners if n not in self.down] + [n for n in owners if n in self.down]
+
+    def settle(self, provider: str):
+        """`provider` is on all its new owners: route it by the ring, forget nodes nothing routes to."""
+        self.pending.pop(provider, None)
+        held = {n for holders in self.pending.values() for n in holders}
+        self.retiring = {n: u for n, u in self.retiring.items() if n in held}
+
+
+def _initial_nodes() -> Dict[str, str]:
+    saved = load_state(CLUSTER_STATE_FILE)
+    return saved if saved is not None else parse_nodes(CLUSTER_NODES)
+
+
+state = Cluster(_initial_nodes(), CLUSTER_REPLICAS)
+_client: Optional[httpx.AsyncClient] = None
+
+
+def _http() -> httpx.AsyncClient:
+    global _client
+    if _client is None:
+        _client = httpx.AsyncClient(timeout=CLUSTER_FORWARD_TIMEOUT_S,
+                                    limits=httpx.Limits(max_connections=512, max_keepalive_connections=128))
+    return _client
+
+
+def _cluster_headers(extra: Optional[dict] = None) -> dict:
+    headers = {'X-Cluster-Token': CLUSTER_TOKEN or ''}
+    headers.update(extra or {})
+    return headers
+
+
+@app.on_event('startup')
+async def _start():
+    if not CLUSTER_TOKEN:
+        logger.warning('CLUSTER_TOKEN is not set; nodes will reject routed queries and provider transfers')
+    asyncio.get_running_loop().create_task(_health_loop())
+
+
+@app.on_event('shutdown')
+async def _stop():
+    if _client is not None:
+        await _client.aclose()
+
+
+async def _probe(name: str, url: str):
+    try:
+        r = await _http().get(f'{url}/v1/ready', timeout=2.0)
+        ok = r.status_code == 200
+    except httpx.HTTPError:
+        ok = False
+    if ok:
+        if state.down.pop(name, None) is not None:
+            logger.info('cluster node %s is back', name)
+    elif name not in state.down:
+        logger.warning('cluster node %s is down', name)
+        state.down[name] = time.time()
+
+
+async def _health_loop():
+    while True:
+        nodes = dict(state.retiring, **state.nodes)
+        await asyncio.gather(*(_probe(n, u) for n, u in nodes.items()))
+        await asyncio.sleep(CLUSTER_HEALTH_INTERVAL_S)
+
+
+async def _forward(node: str, path: str, body: bytes, headers: dict) -> httpx.Response:
+    return await _http().post(f'{state.url(node)}{path}', content=body, headers=headers)
+
+
+@app.post('/v1/query')
+async def query(request: Request):
+    body = await request.body()
+    try:
+        client_id = int((await request.json())['client_id'])
+    except Exception:
+        raise HTTPException(status_code=422, detail='client_id required')
+    provider = await asyncio.to_thread(get_client_provider, client_id)
+    if not provider:
+        raise HTTPException(status_code=404, detail='assigned provider not found for client')
+    owners = state.route(provider)
+    if not owners:
+        raise HTTPException(status_code=503, detail='no cluster nodes configured')
+    headers = {k: v for k, v in request.headers.items() if k.lower() in FORWARD_HEADERS}
+    headers = _cluster_headers(dict(headers, **{'X-Cluster-Provider': provider}))
+    last_error = None
+    for node in owners:
+        try:
+            r = await _forward(node, '/v1/query', body, headers)
+        except httpx.HTTPError as e:
+            metrics.error('gateway', 'node_unreachable')
+            state.down.setdefault(node, time.time())
+            last_error = f'{node}: {type(e).__name__}'
+            continue
+        # another replica may still answer: node overloaded, failing, or missing the provider
+        if (r.status_code >= 500 or r.status_code == 404) and node != owners[-1]:
+            last_error = f'{node}: {r.status_code}'
+            continue
+        out = {k: v for k, v in r.headers.items() if k.lower() in RETURN_HEADERS}
+        out['X-Served-By'] = node
+        return Response(content=r.content, status_code=r.status_code, headers=out)
+    raise HTTPException(status_code=502, detail=f'no owner of provider answered ({last_error})')
+
+
+@app.post('/v1/search')
+async def search(request: Request):
+    """Split the providers by owning node, search each node once and merge the hits.
+
+    L2 distances are only comparable under one embedding model: when nodes
+    searched with different models (or already fused across models) the
+    per-node rankings are merged with reciprocal rank fusion instead.
+    """
+    payload = await request.json()
+    providers = payload.get('providers')
+    if not providers:
+        raise HTTPException(status_code=400, detail='providers list required in cluster mode')
+    by_node: Dict[str, List[str]] = {}
+    for p in dict.fromkeys(providers):
+        if not valid_provider_name(p):
+            raise HTTPException(status_code=400, detail=f'invalid provider name: {p!r}')
+        owners = state.route(p)
+        if owners:
+            by_node.setdefault(owners[0], []).append(p)
+    headers = {k: v for k, v in request.headers.items() if k.lower() in FORWARD_HEADERS}
+
+    async def one(node, subset):
+        r = await _http().post(f'{state.url(node)}/v1/search', json=dict(payload, providers=subset),
+                               headers=headers)
+        r.raise_for_status()
+        return r.json()
+
+    results = await asyncio.gather(*(one(n, s) for n, s in by_node.items()), return_exceptions=True)
+    top_k = int(payload.get('top_k') or 10)
+    answered, errors, searched = [], {}, 0
+    for (node, subset), res in zip(by_node.items(), results):
+        if isinstance(res, Exception):
+            errors.update({p: f'node {node}: {type(res).__name__}' for p in subset})
+            continue
+        errors.update(res.get('errors', {}))
+        searched += res.get('providers_searched', 0)
+        if res['hits']:
+            answered.append(res)
+    kinds = {(res.get('score_kind', 'l2'), res.get('model')) for res in answered}
+    if len(answered) == 1:
+        hits = answered[0]['hits'][:top_k]
+        score_kind, model = kinds.pop()
+    elif len(kinds) <= 1 and ('rrf', None) not in kinds:
+        hits = sorted((h for res in answered for h in res['hits']), key=lambda h: h['score'])[:top_k]
+        score_kind, model = next(iter(kinds), ('l2', None))
+    else:
+        by_id = {}
+        rankings = []
+        for res in answered:
+            rankings.append([((h['provider'], h['key']), h['score']) for h in res['hits']])
+            by_id.update({(h['provider'], h['key']): h for h in res['hits']})
+        hits = [dict(by_id[hit_id], score=score) for hit_id, score in rrf_fuse(rankings, top_k)]
+        score_kind, model = 'rrf', None
+    return {'hits': hits, 'providers_searched': searched, 'errors': errors,
+            'score_kind': score_kind, 'model': model}
+
+
+async def _placement(nodes: Dict[str, str]) -> Dict[str, List[str]]:
+    """provider -> nodes currently holding it (from each reachable node's /v1/providers)."""
+    async def listing(node, url):
+        try:
+            r = await _http().get(f'{url}/v1/providers', timeout=10.0)
+            r.raise_for_status()
+            return node, r.json().get('providers', [])
+        except httpx.HTTPError as e:
+            logger.warning('cannot list providers on %s: %s', node, e)
+            return node, None
+
+    placement: Dict[str, List[str]] = {}
+    for node, providers in await asyncio.gather(*(listing(n, u) for n, u in nodes.items())):
+        for p in providers or []:
+            placement.setdefault(p, []).append(node)
+    return placement
+
+
+async def _rebalance(nodes: Dict[str, str], drop: bool = True) -> dict:
+    """Switch membership to `nodes`, copy providers to their new owners, then drop them where no longer owned.
+
+    Providers that need a copy stay routed to their current holders until
+    every new owner has it; after a failed copy they stay there until a later
+    rebalance completes it.
+    """
+    # leaving nodes (and ones left over from an unfinished rebalance) can still serve as copy sources
+    urls = {**state.retiring, **state.nodes, **nodes}
+    placement = await _placement(urls)
+    moves = plan_moves(placement, HashRing(nodes), state.replicas)
+    state.pending = {m['provider']: list(placement[m['provider']]) for m in moves if m['add'] and m['source']}
+    held = {n for holders in state.pending.values() for n in holders}
+    state.retiring = {n: u for n, u in urls.items() if n not in nodes and n in held}
+    state.set_nodes(nodes)
+    done, failed = [], []
+    for move in moves:
+        copied = []
+        for target in move['add']:
+            if move['source'] is None:
+                break
+            try:
+                r = await _http().post(f'{urls[target]}/v1/cluster/providers/{move["provider"]}/pull',
+                                       json={'source': urls[move['source']]}, headers=_cluster_headers(),
+                                       timeout=600.0)
+                r.raise_for_status()
+                copied.append(target)
+            except httpx.HTTPError as e:
+                failed.append({'provider': move['provider'], 'target': target, 'error': str(e)})
+        complete = len(copied) == len(move['add'])
+        if complete:
+            state.settle(move['provider'])
+        removed = []
+        if drop and complete:
+            # only once every new owner has its copy
+            for node in move['remove']:
+                try:
+                    r = await _http().delete(f'{urls[node]}/v1/cluster/providers/{move["provider"]}',
+                                             headers=_cluster_headers())
+                    r.raise_for_status()
+                    removed.append(node)
+                except httpx.HTTPError as e:
+                    failed.append({'provider': move['provider'], 'target': node, 'error': str(e)})
+        done.append(dict(move, copied=copied, removed=removed))
+    logger.info('rebalance: %d moves, %d failures', len(done), len(failed))
+    return {'moves': done, 'failed': failed}
+
+
+@app.get('/v1/cluster')
+async def cluster_status(_auth=Depends(api_key_auth)):
+    return {'nodes': state.nodes, 'down': sorted(state.down), 'replicas': state.replicas,
+            'pending': state.pending, 'retiring': state.retiring,
+            'assignments': state.ring.assignments(sorted(await _placement(state.nodes)), state.replicas)}
+
+
+@app.post('/v1/cluster/nodes')
+async def join_node(payload: dict, drop: bool = True, _auth=Depends(api_key_auth)):
+    """Add a node (`{"name": ..., "url": ...}`) and move the providers it now owns onto it."""
+    name, url = str(payload.get('name') or ''), str(payload.get('url') or '').rstrip('/')
+    if not name or not url:
+        raise HTTPException(status_code=400, detail='name and url required')
+    async with state.lock:
+        result = await _rebalance(dict(state.nodes, **{name: url}), drop=drop)
+    return JSONResponse(dict(result, nodes=state.nodes))
+
+
+@app.delete('/v1/cluster/nodes/{name}')
+async def leave_node(name: str, drop: bool = True, _auth=Depends(api_key_auth)):
+    """Remove a node; its providers are copied to their new owners first (from it or a replica)."""
+    async with state.lock:
+        if name not in state.nodes:
+            raise HTTPException(status_code=404, detail='unknown node')
+        result = await _rebalance({n: u for n, u in state.nodes.items() if n != name}, drop=drop)
+    return JSONResponse(dict(result, nodes=state.nodes))
+
+
+@app.post('/v1/cluster/rebalance')
+async def rebalance(drop: bool = True, _auth=Depends(api_key_auth)):
+    """Re-place providers for the current membership (e.g. after restoring a node)."""
+    async with state.lock:
+        result = await _rebalance(dict(state.nodes), drop=drop)
+    return JSONResponse(result)
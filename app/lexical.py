@@ -0,0 +1,116 @@
+"""Compact BM25 inverted index over a provider's chunks.
+
+Postings are stored as flat arrays (CSR layout): for term id t, the chunk ids
+and term frequencies live in `docs[offsets[t]:offsets[t + 1]]` and
+`tfs[offsets[t]:offsets[t + 1]]`. Scoring a query touches only the postings of
+its terms, so lexical retrieval needs no embedding model and runs in well
+under a millisecond for typical provider sizes.
+
+Chunk ids are positions in the provider's `vector_keys` list, the same ids the
+FAISS index uses, so dense and lexical rankings can be fused directly.
+"""
+import re
+from collections import Counter
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+# emails are kept whole so they match exactly; everything else splits on \w+
+_TOKEN_RE = re.compile(r"[\w.+-]+@[\w-]+(?:\.[\w-]+)+|\w+")
+
+FORMAT_VERSION = 1
+
+
+def tokenize(text: str) -> List[str]:
+    return _TOKEN_RE.findall(text.lower())
+
+
+class LexicalIndex:
+    def __init__(self, terms: List[str], offsets, docs, tfs, doc_len, k1: float = 1.2, b: float = 0.75):
+        self.terms = terms
+        self.vocab = {t: i for i, t in enumerate(terms)}
+        self.offsets = offsets
+        self.docs = docs
+        self.tfs = tfs
+        self.doc_len = doc_len
+        self.k1 = k1
+        self.b = b
+        self.n_docs = int(len(doc_len))
+        avgdl = float(doc_len.mean()) if self.n_docs else 0.0
+        # per-posting length normalisation, precomputed once at load time
+        if self.n_docs and avgdl > 0:
+            dl = doc_len[docs].astype('float32')
+            self._norm = (k1 * (1.0 - b + b * dl / avgdl)).astype('float32')
+        else:
+            self._norm = np.zeros(len(docs), dtype='float32')
+        df = np.diff(offsets).astype('float32')
+        self._idf = np.log(1.0 + (self.n_docs - df + 0.5) / (df + 0.5)).astype('float32')
+
+    @classmethod
+    def build(cls, texts: List[str], **kwargs) -> 'LexicalIndex':
+        postings = {}
+        doc_len = np.zeros(len(texts), dtype='int32')
+        for doc_id, text in enumerate(texts):
+            counts = Counter(tokenize(text))
+            doc_len[doc_id] = sum(counts.values())
+            for term, tf in counts.items():
+                postings.setdefault(term, []).append((doc_id, tf))
+        terms = sorted(postings)
+        offsets = np.zeros(len(terms) + 1, dtype='int64')
+        for i, t in enumerate(terms):
+            offsets[i + 1] = offsets[i] + len(postings[t])
+        docs = np.empty(int(offsets[-1]), dtype='int32')
+        tfs = np.empty(int(offsets[-1]), dtype='int32')
+        for i, t in enumerate(terms):
+            p = postings[t]
+            docs[offsets[i]:offsets[i + 1]] = [d for d, _ in p]
+            tfs[offsets[i]:offsets[i + 1]] = [f for _, f in p]
+        return cls(terms, offsets, docs, tfs, doc_len, **kwargs)
+
+    def save(self, path: Path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        terms_blob = np.frombuffer('\n'.join(self.terms).encode('utf-8'), dtype='uint8')
+        tmp = path.with_suffix('.tmp.npz')
+        np.savez(
+            tmp,
+            version=np.array([FORMAT_VERSION], dtype='int32'),
+            params=np.array([self.k1, self.b], dtype='float32'),
+            terms=terms_blob,
+            offsets=self.offsets,
+            docs=self.docs,
+            tfs=self.tfs,
+            doc_len=self.doc_len,
+        )
+        tmp.replace(path)
+
+    @classmethod
+    def load(cls, path: Path) -> 'LexicalIndex':
+        with np.load(path) as z:
+            blob = z['terms'].tobytes().decode('utf-8')
+            terms = blob.split('\n') if blob else []
+            k1, b = (float(x) for x in z['params'])
+            return cls(terms, z['offsets'], z['docs'], z['tfs'], z['doc_len'], k1=k1, b=b)
+
+    def search(self, query: str, k: int, mask: Optional[np.ndarray] = None) -> List[Tuple[int, float]]:
+        """Return up to k (chunk id, BM25 score) pairs, best first; `mask` limits the chunk ids considered."""
+        if self.n_docs == 0:
+            return []
+        scores = np.zeros(self.n_docs, dtype='float32')
+        for term in set(tokenize(query)):
+            tid = self.vocab.get(term)
+            if tid is None:
+                continue
+            lo, hi = self.offsets[tid], self.offsets[tid + 1]
+            tf = self.tfs[lo:hi].astype('float32')
+            # doc ids are unique within one term's postings, so fancy-index add is safe
+            scores[self.docs[lo:hi]] += self._idf[tid] * tf * (self.k1 + 1.0) / (tf + self._norm[lo:hi])
+        if mask is not None:
+            scores *= mask
+        nz = np.flatnonzero(scores)
+        if len(nz) == 0:
+            return []
+        k = min(k, len(nz))
+        top = nz[np.argpartition(-scores[nz], k - 1)[:k]]
+        top = top[np.argsort(-scores[top], kind='stable')]
+        return [(int(i), float(scores[i])) for i in top]
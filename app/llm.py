@@ -1,31 +1,455 @@
 import os
+import time
+import random
 import logging
+import hashlib
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from contextlib import contextmanager
+from functools import partial
 from typing import List
 
+from .config import (
+    LLM_MODEL,
+    LLM_MAX_CONCURRENCY,
+    LLM_MAX_CONCURRENCY_PER_PROVIDER,
+    LLM_QUEUE_TIMEOUT,
+    LLM_MAX_QUEUED,
+    LLM_BACKEND,
+    LLM_STUB_LATENCY_MS,
+    LLM_STUB_SLOW_MS,
+    LLM_STUB_SLOW_RATE,
+    LLM_HEDGE_ENABLED,
+    LLM_HEDGE_PERCENTILE,
+    LLM_HEDGE_MIN_DELAY_MS,
+    LLM_HEDGE_MIN_SAMPLES,
+    LLM_HEDGE_MAX_FRACTION,
+)
+from . import metrics
+
 logger = logging.getLogger(__name__)
 
 
-def call_llm_strict(question: str, context: str) -> str:
-    """Call OpenAI chat LLM with strict grounding instruction. If no OPENAI_KEY, return 'Not available.'
+class LLMBusyError(RuntimeError):
+    """Raised when a call waited longer than the queue timeout for a slot."""
 
-    Supports both the new `openai.OpenAI()` client API and older `openai.ChatCompletion.create`.
+
+class _InflightCall:
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class _SingleFlight:
+    """Share one upstream call between identical concurrent requests.
+
+    The first caller for a key runs the function; callers arriving while it is
+    in flight block (for at most `timeout` seconds, else LLMBusyError) and
+    receive the same result (or exception).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key: str, fn, timeout: float | None = None):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _InflightCall()
+                self._calls[key] = call
+        metrics.cache_event('llm_singleflight', not leader)
+        if not leader:
+            if not call.event.wait(timeout):
+                raise LLMBusyError('timed out waiting for an identical in-flight call')
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.event.set()
+        return call.result
+
+
+class _ConcurrencyLimiter:
+    """Global plus per-provider cap on concurrent upstream calls.
+
+    Callers beyond the cap block (queue) until a slot frees up or `timeout`
+    seconds pass, in which case `LLMBusyError` is raised.
+    """
+
+    def __init__(self, global_limit: int, per_provider_limit: int, timeout: float):
+        self.timeout = timeout
+        self.per_provider_limit = per_provider_limit
+        self._global = threading.BoundedSemaphore(max(1, global_limit))
+        self._providers = {}
+        self._lock = threading.Lock()
+
+    def _provider_sem(self, provider: str):
+        with self._lock:
+            sem = self._providers.get(provider)
+            if sem is None:
+                sem = threading.BoundedSemaphore(max(1, self.per_provider_limit))
+                self._providers[provider] = sem
+            return sem
+
+    def acquire(self, provider: str | None = None, timeout: float | None = None):
+        """Take a slot and return the function that gives it back (callable from any thread)."""
+        timeout = self.timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        psem = self._provider_sem(provider) if provider else None
+        if psem is not None and not psem.acquire(timeout=timeout):
+            raise LLMBusyError(f'timed out waiting for an LLM slot for provider {provider}')
+        if not self._global.acquire(timeout=max(0.0, deadline - time.monotonic())):
+            if psem is not None:
+                psem.release()
+            raise LLMBusyError('timed out waiting for a global LLM slot')
+
+        def release():
+            self._global.release()
+            if psem is not None:
+                psem.release()
+        return release
+
+    @contextmanager
+    def slot(self, provider: str | None = None, timeout: float | None = None):
+        release = self.acquire(provider, timeout)
+        try:
+            yield
+        finally:
+            release()
+
+
+class _Hedger:
+    """Send a duplicate request when the first one is slower than usual.
+
+    The hedge delay is the `percentile` of recently observed upstream
+    latencies (never below `min_delay` seconds, and only once `min_samples`
+    are known). At most `max_fraction` of requests are hedged. Whichever
+    attempt finishes first wins; the other is cancelled if it has not started
+    yet, otherwise its result is discarded when it returns.
+
+    Attempts hold a concurrency slot before they reach the pool: the primary
+    queues for one in the caller's thread, a hedge only runs if a slot is free
+    right away. Queueing time is therefore not counted as latency, and pool
+    threads only ever run calls that are already upstream.
     """
+
+    def __init__(self, enabled: bool, percentile: float, min_delay: float, min_samples: int,
+                 max_fraction: float, workers: int, window: int = 512):
+        self.enabled = enabled
+        self.percentile = percentile
+        self.min_delay = min_delay
+        self.min_samples = min_samples
+        self.max_fraction = max_fraction
+        self._latencies = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self._pool = None
+        self._workers = max(2, workers)
+        self.requests = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.latency_saved = 0.0
+
+    def _executor(self):
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=self._workers, thread_name_prefix='llm-hedge')
+            return self._pool
+
+    def observe(self, seconds: float):
+        with self._lock:
+            self._latencies.append(seconds)
+
+    def delay(self) -> float | None:
+        with self._lock:
+            if len(self._latencies) < self.min_samples:
+                return None
+            ordered = sorted(self._latencies)
+        pos = min(len(ordered) - 1, int(round(self.percentile / 100.0 * (len(ordered) - 1))))
+        return max(self.min_delay, ordered[pos])
+
+    def _take_budget(self) -> bool:
+        with self._lock:
+            if self.hedged + 1 > self.max_fraction * self.requests:
+                return False
+            self.hedged += 1
+            return True
+
+    def _timed(self, run, release, cancelled: threading.Event):
+        """Run the upstream call holding the slot `release` gives back; record its latency."""
+        try:
+            if cancelled.is_set():
+                raise LLMBusyError('attempt cancelled before it started')
+            start = time.monotonic()
+            result = run()
+            self.observe(time.monotonic() - start)
+            return result
+        finally:
+            release()
+
+    def call(self, acquire, run, provider: str | None = None):
+        """Run `run()` with hedging; return the first successful result.
+
+        `acquire(is_hedge)` takes a concurrency slot (raising LLMBusyError when
+        none is available) and returns the function releasing it. `provider`
+        labels the hedge metrics.
+        """
+        label = provider or ''
+        with self._lock:
+            self.requests += 1
+        metrics.LLM_HEDGE_REQUESTS.labels(provider=label).inc()
+        release = acquire(False)
+        delay = self.delay() if self.enabled else None
+        if delay is None:
+            return self._timed(run, release, threading.Event())
+
+        pool = self._executor()
+        start = time.monotonic()
+        primary_cancel = threading.Event()
+        primary = pool.submit(self._timed, run, release, primary_cancel)
+        done, _ = wait([primary], timeout=delay)
+        if done or not self._take_budget():
+            return primary.result()
+        try:
+            hedge_release = acquire(True)
+        except LLMBusyError:
+            with self._lock:
+                self.hedged -= 1
+            return primary.result()
+        metrics.LLM_HEDGES.labels(provider=label).inc()
+
+        hedge_cancel = threading.Event()
+        hedge = pool.submit(self._timed, run, hedge_release, hedge_cancel)
+        cancels = {primary: primary_cancel, hedge: hedge_cancel}
+        pending = {primary, hedge}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for fut in done:
+                if fut.exception() is not None:
+                    error = fut.exception()
+                    continue
+                result = fut.result()
+                won_at = time.monotonic() - start
+                for loser in pending:
+                    # not Future.cancel(): a cancelled future never runs _timed,
+                    # which is what gives the loser's slot back
+                    cancels[loser].set()
+                if fut is hedge:
+                    with self._lock:
+                        self.hedge_wins += 1
+                    metrics.LLM_HEDGE_WINS.labels(provider=label).inc()
+                    # The primary cannot be interrupted mid-request; when it
+                    # eventually returns, credit the time the hedge saved.
+                    primary.add_done_callback(lambda f, won_at=won_at: self._credit(f, start, won_at, label))
+                return result
+        raise error
+
+    def _credit(self, fut, start: float, won_at: float, label: str):
+        if fut.cancelled() or fut.exception() is not None:
+            return
+        saved = max(0.0, (time.monotonic() - start) - won_at)
+        with self._lock:
+            self.latency_saved += saved
+        metrics.LLM_HEDGE_SAVED_SECONDS.labels(provider=label).observe(saved)
+
+    def stats(self) -> dict:
+        delay = self.delay()
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'requests': self.requests,
+                'hedged': self.hedged,
+                'hedge_rate': (self.hedged / self.requests) if self.requests else 0.0,
+                'hedge_wins': self.hedge_wins,
+                'latency_saved_s': round(self.latency_saved, 6),
+                'delay_s': delay,
+            }
+
+
+_singleflight = _SingleFlight()
+_limiter = _ConcurrencyLimiter(LLM_MAX_CONCURRENCY, LLM_MAX_CONCURRENCY_PER_PROVIDER, LLM_QUEUE_TIMEOUT)
+_hedger = _Hedger(
+    LLM_HEDGE_ENABLED,
+    LLM_HEDGE_PERCENTILE,
+    LLM_HEDGE_MIN_DELAY_MS / 1000.0,
+    LLM_HEDGE_MIN_SAMPLES,
+    LLM_HEDGE_MAX_FRACTION,
+    # every pooled attempt holds a global slot, so this many threads never queue
+    workers=LLM_MAX_CONCURRENCY,
+)
+
+
+_threads = None
+
+
+async def run_llm(fn, *args, **kwargs):
+    """Run a blocking LLM call (`call_llm_strict`, ...) from async code.
+
+    The calls get worker threads of their own, at most LLM_MAX_CONCURRENCY +
+    LLM_MAX_QUEUED at once, instead of the shared threadpool: a burst queued
+    on the concurrency caps cannot starve embeddings and other blocking work,
+    and calls beyond that wait on the event loop.
+    """
+    import anyio
+
+    global _threads
+    if _threads is None:
+        _threads = anyio.CapacityLimiter(LLM_MAX_CONCURRENCY + max(0, LLM_MAX_QUEUED))
+    return await anyio.to_thread.run_sync(partial(fn, *args, **kwargs), limiter=_threads)
+
+
+def hedge_stats() -> dict:
+    """Return hedging counters: hedge rate, hedge wins and latency saved.
+
+    The service exports the same as rag_llm_hedge_* metrics, by provider.
+    """
+    return _hedger.stats()
+
+
+def _llm_api_key() -> str | None:
+    """Return the OpenAI key, or a placeholder when the local stub backend is active."""
+    if LLM_BACKEND == 'stub':
+        return 'stub'
     # Read env at call time to pick up keys loaded after import (e.g., via dotenv)
-    OPENAI_KEY = os.environ.get('OPENAI_API_KEY')
-    if not OPENAI_KEY:
-        return 'Not available.'
+    return os.environ.get('OPENAI_API_KEY')
+
+
+def _request_key(model: str, messages: List[dict]) -> str:
+    h = hashlib.sha256(model.encode('utf-8'))
+    for m in messages:
+        h.update(b'\x00' + m['role'].encode('utf-8') + b'\x00' + m['content'].encode('utf-8'))
+    return h.hexdigest()
+
+
+def llm_available() -> bool:
+    """True when an LLM backend is configured (an OpenAI key or the stub)."""
+    return bool(_llm_api_key())
+
+
+def _stub_completion(messages: List[dict]) -> str:
+    """Local stand-in for the chat API: sleep, then echo the first context sentence.
+
+    Latency is LLM_STUB_LATENCY_MS, plus LLM_STUB_SLOW_MS on a random
+    LLM_STUB_SLOW_RATE fraction of calls to simulate a slow tail.
+    """
+    latency = LLM_STUB_LATENCY_MS
+    if LLM_STUB_SLOW_RATE > 0 and random.random() < LLM_STUB_SLOW_RATE:
+        latency += LLM_STUB_SLOW_MS
+    time.sleep(latency / 1000.0)
+    content = messages[-1]['content']
+    if content.startswith('Context'):
+        context = content.split('\n', 1)[-1].rsplit('\n\nQuestion:', 1)[0].rsplit('\n\nUser:', 1)[0]
+        first = context.strip().split('. ')[0].strip()
+        return (first.rstrip('.') + '.') if first else 'Not available.'
+    return content.strip()[:200]
+
+
+def _record_usage(provider: str | None, model: str, prompt_tokens, completion_tokens):
+    labels = {'provider': provider or '', 'model': model}
+    if prompt_tokens:
+        metrics.LLM_TOKENS.labels(kind='prompt', **labels).inc(prompt_tokens)
+    if completion_tokens:
+        metrics.LLM_TOKENS.labels(kind='completion', **labels).inc(completion_tokens)
+
+
+def _chat_completion(api_key: str, messages: List[dict], model: str, provider: str | None = None) -> str:
+    """Run one chat completion upstream.
+
+    Supports both the new `openai.OpenAI()` client API and older `openai.ChatCompletion.create`.
+    Token usage is counted per provider and model.
+    """
+    if LLM_BACKEND == 'stub':
+        from .tokenizer import count_tokens
+
+        content = _stub_completion(messages)
+        _record_usage(provider, model, sum(count_tokens(m['content']) for m in messages), count_tokens(content))
+        return content
+    import openai
+    # Try new OpenAI client first
+    client = None
     try:
-        import openai
-        # Try new OpenAI client first
-        client = None
+        client = openai.OpenAI(api_key=api_key)
+    except Exception:
         try:
-            client = openai.OpenAI(api_key=OPENAI_KEY)
+            openai.api_key = api_key
         except Exception:
-            try:
-                openai.api_key = OPENAI_KEY
-            except Exception:
-                pass
+            pass
 
+    if client is not None:
+        # new client API
+        resp = client.chat.completions.create(model=model, messages=messages, max_tokens=512)
+        usage = getattr(resp, 'usage', None)
+        if usage is not None:
+            _record_usage(provider, model, getattr(usage, 'prompt_tokens', 0), getattr(usage, 'completion_tokens', 0))
+        # resp.choices[0].message.content or dict style
+        choice = resp.choices[0]
+        msg = getattr(choice, 'message', None)
+        if msg is not None:
+            content = getattr(msg, 'content', None)
+        else:
+            content = choice.get('message', {}).get('content') if isinstance(choice, dict) else str(choice)
+        return (content or '').strip()
+
+    # fallback to older openai library interface
+    resp = openai.ChatCompletion.create(model=model, messages=messages, max_tokens=512)
+    usage = resp.get('usage') or {}
+    _record_usage(provider, model, usage.get('prompt_tokens', 0), usage.get('completion_tokens', 0))
+    return resp['choices'][0]['message']['content'].strip()
+
+
+def _complete(api_key: str, messages: List[dict], provider: str | None = None, model: str = LLM_MODEL,
+              timeout: float | None = None) -> str:
+    """Coalesce identical in-flight requests, respect the concurrency caps and hedge slow calls.
+
+    `timeout` bounds the wait for a slot or an identical in-flight call
+    (default LLM_QUEUE_TIMEOUT, never longer).
+    """
+    timeout = LLM_QUEUE_TIMEOUT if timeout is None else min(timeout, LLM_QUEUE_TIMEOUT)
+
+    def acquire(hedge: bool):
+        # a hedge is opportunistic: it never queues for a slot
+        return _limiter.acquire(provider, timeout=0 if hedge else timeout)
+
+    def run():
+        return _chat_completion(api_key, messages, model, provider=provider)
+
+    start = time.perf_counter()
+    try:
+        return _singleflight.do(_request_key(model, messages), lambda: _hedger.call(acquire, run, provider), timeout)
+    except LLMBusyError:
+        metrics.error('llm', 'busy')
+        raise
+    except Exception as e:
+        metrics.error('llm', e)
+        raise
+    finally:
+        metrics.LLM_SECONDS.labels(provider=provider or '', model=model).observe(time.perf_counter() - start)
+
+
+def call_llm_strict(question: str, context: str, provider: str | None = None,
+                    timeout: float | None = None) -> str:
+    """Call OpenAI chat LLM with strict grounding instruction. If no OPENAI_KEY, return 'Not available.'
+
+    `provider` scopes the per-provider concurrency limit; identical concurrent
+    (prompt, model) requests share a single upstream call. `timeout` caps the
+    time spent queued (pass the caller's deadline, so a call it abandoned
+    stops waiting with it).
+    """
+    OPENAI_KEY = _llm_api_key()
+    if not OPENAI_KEY:
+        return 'Not available.'
+    try:
         system = (
             "You are a helpful assistant. Use only the provided context to answer. "
             "If information is missing, respond: 'Not available.'"
@@ -34,48 +458,26 @@ def call_llm_strict(question: str, context: str) -> str:
             {"role": "system", "content": system},
             {"role": "user", "content": f"Context:\n{context}\n\nQuestion: {question}"},
         ]
-
-        if client is not None:
-            # new client API
-            resp = client.chat.completions.create(model='gpt-4o-mini', messages=messages, max_tokens=512)
-            # resp.choices[0].message.content or dict style
-            choice = resp.choices[0]
-            msg = getattr(choice, 'message', None)
-            if msg is not None:
-                content = getattr(msg, 'content', None)
-            else:
-                content = choice.get('message', {}).get('content') if isinstance(choice, dict) else str(choice)
-            return (content or '').strip()
-
-        # fallback to older openai library interface
-        resp = openai.ChatCompletion.create(model='gpt-4o-mini', messages=messages, max_tokens=512)
-        return resp['choices'][0]['message']['content'].strip()
+        return _complete(OPENAI_KEY, messages, provider=provider, timeout=timeout)
+    except LLMBusyError as e:
+        logger.warning('LLM call dropped: %s', e)
+        return 'Not available.'
     except Exception:
         logger.exception('LLM call failed')
         return 'Not available.'
 
 
-def call_llm_chat(message: str, context: str | None = None) -> str:
+def call_llm_chat(message: str, context: str | None = None, provider: str | None = None) -> str:
     """General-purpose chat that can converse naturally.
 
     If context is provided, it may be referenced, but the assistant is not restricted
     to only the context. If no OPENAI key, return a simple canned response.
     """
-    OPENAI_KEY = os.environ.get('OPENAI_API_KEY')
+    OPENAI_KEY = _llm_api_key()
     if not OPENAI_KEY:
         # Simple canned response when no key is available
         return "Hi! I'm here to help. Ask me anything about the provider or services."
     try:
-        import openai
-        client = None
-        try:
-            client = openai.OpenAI(api_key=OPENAI_KEY)
-        except Exception:
-            try:
-                openai.api_key = OPENAI_KEY
-            except Exception:
-                pass
-
         system = (
             "You are a friendly AI assistant. Be conversational, clear, and helpful. "
             "If the user asks about provider-specific info and you have context, use it; "
@@ -86,19 +488,10 @@ def call_llm_chat(message: str, context: str | None = None) -> str:
             {"role": "system", "content": system},
             {"role": "user", "content": user_content},
         ]
-
-        if client is not None:
-            resp = client.chat.completions.create(model='gpt-4o-mini', messages=messages, max_tokens=512)
-            choice = resp.choices[0]
-            msg = getattr(choice, 'message', None)
-            if msg is not None:
-                content = getattr(msg, 'content', None)
-            else:
-                content = choice.get('message', {}).get('content') if isinstance(choice, dict) else str(choice)
-            return (content or '').strip()
-
-        resp = openai.ChatCompletion.create(model='gpt-4o-mini', messages=messages, max_tokens=512)
-        return resp['choices'][0]['message']['content'].strip()
+        return _complete(OPENAI_KEY, messages, provider=provider)
+    except LLMBusyError as e:
+        logger.warning('LLM chat call dropped: %s', e)
+        return "Sorry, I'm having trouble responding right now."
     except Exception:
         logger.exception('LLM chat call failed')
         return "Sorry, I'm having trouble responding right now."
@@ -1,21 +1,39 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException, Depends
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, UploadFile, File, HTTPException, Depends, Header, Response, BackgroundTasks
+from fastapi.responses import FileResponse, JSONResponse
+from starlette.background import BackgroundTask
+from fastapi.concurrency import run_in_threadpool
 from pathlib import Path
-from .config import PROVIDERS_DIR, CORS_ORIGINS
-from .utils import ensure_provider_dirs, write_file
-from .pipeline import build_index_for_provider, build_index_for_provider_index
+from .config import PROVIDERS_DIR, CORS_ORIGINS, LLM_DEADLINE_MS, METADATA_FASTPATH_ENABLED, WARMUP_ENABLED, FANOUT_MAX_PROVIDERS
+from .utils import ensure_provider_dirs, provider_dirs, write_file
+from .bundle import BundleError, check_writable
 from .app_db import get_client_provider
-from .embeddings import default_embedding_provider, get_default_embedding_model
-from .llm import call_llm_strict
+from .retrieval import retrieve, RetrievalError
+from .provider_store import has_index, provider_model
+from .embeddings import default_embedding_provider
+from .llm import call_llm_strict, llm_available, run_llm
+from .extractive import extractive_answer
+from .metadata_answer import answer_from_metadata, get_provider_metadata
+from .context import build_context
 from .core.security import api_key_auth
-from .api.models import QueryRequest, QueryResponse, UploadStatus, HealthResponse, HealthProvider
+from .core import admission
+from . import warmup as _warmup
+from . import semantic_cache
+from . import fanout
+from . import cluster
+from . import migration
+from . import metrics
+from . import debug as _debug
+from .api.models import QueryRequest, QueryResponse, SearchRequest, SearchResponse, UploadStatus, HealthResponse, HealthProvider
 from sqlitedict import SqliteDict
-import faiss
-import numpy as np
 import os
-import pandas as pd
+import asyncio
+import tarfile
+import time
 from fastapi.middleware.cors import CORSMiddleware
 from typing import Optional
+import logging
+
+logger = logging.getLogger(__name__)
 
 app = FastAPI(title="AI Agent - Provider Query Service")
 
@@ -29,6 +47,35 @@ app.add_middleware(
 )
 
 
+@app.on_event('startup')
+async def start_warmup():
+    """Load models and hot provider indexes in the background; see /v1/ready."""
+    if _warmup.status()['ready']:
+        # already warmed before the worker was forked (scripts/serve_prefork.py)
+        return
+    if WARMUP_ENABLED:
+        _warmup.start_background_warmup()
+    else:
+        _warmup.mark_ready()
+
+
+@app.get('/v1/ready')
+async def ready():
+    """Readiness probe: 503 until startup warmup has finished."""
+    state = _warmup.status()
+    return JSONResponse(state, status_code=200 if state['ready'] else 503)
+
+
+@app.get('/metrics')
+async def prometheus_metrics():
+    """Prometheus scrape endpoint (aggregated over workers when PROMETHEUS_MULTIPROC_DIR is set)."""
+    try:
+        body, content_type = metrics.render()
+    except RuntimeError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    return Response(content=body, media_type=content_type)
+
+
 @app.get('/v1/health', response_model=HealthResponse)
 async def health():
     """Basic health check plus simple index stats."""
@@ -37,21 +84,29 @@ async def health():
         base = PROVIDERS_DIR
         if base.exists():
             for p in sorted(base.iterdir()):
-                if not p.is_dir():
+                if not p.is_dir() or p.name.startswith('.'):
                     continue
-                idx = (p / 'index' / 'faiss.bin')
                 providers.append({
                     'name': p.name,
-                    'has_index': idx.exists(),
+                    'has_index': has_index(p / 'index'),
                 })
     except Exception:
         providers = []
     return HealthResponse(status='ok', providers=[HealthProvider(**p) for p in providers])
 
 
+def _writable_provider_dirs(provider: str):
+    """Provider directories for an upload; 409 for an imported (read-only) bundle."""
+    try:
+        check_writable(PROVIDERS_DIR, provider)
+    except BundleError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return ensure_provider_dirs(PROVIDERS_DIR, provider)
+
+
 @app.post('/v1/upload/provider/{provider}/metadata', response_model=UploadStatus)
 async def upload_metadata(provider: str, file: UploadFile = File(...), _auth=Depends(api_key_auth)):
-    dirs = ensure_provider_dirs(PROVIDERS_DIR, provider)
+    dirs = _writable_provider_dirs(provider)
     dest = dirs['excel'] / 'metadata.xlsx'
     content = await file.read()
     write_file(dest, content)
@@ -60,7 +115,7 @@ async def upload_metadata(provider: str, file: UploadFile = File(...), _auth=Dep
 
 @app.post('/v1/upload/provider/{provider}/document', response_model=UploadStatus)
 async def upload_document(provider: str, file: UploadFile = File(...), _auth=Depends(api_key_auth)):
-    dirs = ensure_provider_dirs(PROVIDERS_DIR, provider)
+    dirs = _writable_provider_dirs(provider)
     if not file.filename:
         raise HTTPException(status_code=400, detail='uploaded file must have a filename')
     safe_name = Path(file.filename).name
@@ -71,7 +126,17 @@ async def upload_document(provider: str, file: UploadFile = File(...), _auth=Dep
 
 
 @app.post('/v1/admin/rebuild-index/{provider}')
-async def rebuild_index(provider: str, _auth=Depends(api_key_auth)):
+async def rebuild_index(provider: str, shards: Optional[int] = None, shard_by: Optional[str] = None,
+                        shard: Optional[int] = None, chunker: Optional[str] = None,
+                        chunk_size: Optional[int] = None, chunk_overlap: Optional[int] = None,
+                        _auth=Depends(api_key_auth)):
+    """Rebuild a provider's index.
+
+    `shards`/`shard_by` override INDEX_SHARDS/INDEX_SHARD_BY for this build;
+    `shard` re-embeds only that shard of an already sharded provider.
+    `chunker`/`chunk_size`/`chunk_overlap` override the provider's chunking
+    settings (app/chunking.py) for this build.
+    """
     # allow numeric provider index or provider name
     if str(provider).isdigit():
         # resolve numeric -> provider name for response
@@ -81,20 +146,47 @@ async def rebuild_index(provider: str, _auth=Depends(api_key_auth)):
             resolved = _pi.get_provider_by_index(int(provider))
         except Exception:
             resolved = None
-        build_index_for_provider_index(int(provider), PROVIDERS_DIR)
         provider_name = resolved or str(provider)
     else:
-        dirs = ensure_provider_dirs(PROVIDERS_DIR, provider)
-        # Run pipeline synchronously for simplicity
-        build_index_for_provider(provider, PROVIDERS_DIR)
         provider_name = provider
-    return JSONResponse({'status': 'rebuild_finished', 'provider': provider_name})
+    if shard is not None:
+        from .pipeline import rebuild_provider_shard
+
+        try:
+            info = rebuild_provider_shard(provider_name, PROVIDERS_DIR, shard)
+        except BundleError as e:
+            raise HTTPException(status_code=409, detail=str(e))
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        return JSONResponse({'status': 'rebuild_finished', 'provider': provider_name, 'shard': info})
+    chunking = {k: v for k, v in (('chunker', chunker), ('size', chunk_size), ('overlap', chunk_overlap))
+                if v is not None}
+    try:
+        if str(provider).isdigit():
+            from .pipeline import build_index_for_provider_index
+
+            report = build_index_for_provider_index(int(provider), PROVIDERS_DIR, shards=shards, shard_by=shard_by,
+                                                    chunking=chunking)
+        else:
+            from .pipeline import build_index_for_provider
+
+            # Run pipeline synchronously for simplicity
+            report = build_index_for_provider(provider, PROVIDERS_DIR, shards=shards, shard_by=shard_by,
+                                              chunking=chunking)
+    except BundleError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return JSONResponse({'status': 'rebuild_finished', 'provider': provider_name, 'chunking': report['chunking'],
+                         'chunks': report['chunks'], 'dedup': report['dedup']})
 
 
 @app.post('/testing/fake-metadata/{provider}')
 async def testing_create_fake_metadata(provider: str):
     """Create a simple `metadata.xlsx` file in the provider's `excel/` folder for testing."""
-    dirs = ensure_provider_dirs(PROVIDERS_DIR, provider)
+    import pandas as pd
+
+    dirs = _writable_provider_dirs(provider)
     df = pd.DataFrame([
         {
             'name': f'{provider} Test Provider',
@@ -112,7 +204,7 @@ async def testing_create_fake_metadata(provider: str):
 @app.post('/testing/fake-doc/{provider}')
 async def testing_create_fake_doc(provider: str):
     """Create a simple test .txt document in provider/docs for pipeline testing."""
-    dirs = ensure_provider_dirs(PROVIDERS_DIR, provider)
+    dirs = _writable_provider_dirs(provider)
     dest = dirs['docs'] / f'{provider}_sample.txt'
     sample_text = (
         "This is a sample document for provider: " + provider + ".\n"
@@ -124,59 +216,165 @@ async def testing_create_fake_doc(provider: str):
 
 
 @app.post('/v1/query', response_model=QueryResponse)
-async def query(payload: QueryRequest, _auth=Depends(api_key_auth)):
+async def query(
+    payload: QueryRequest,
+    response: Response,
+    background_tasks: BackgroundTasks,
+    _auth=Depends(api_key_auth),
+    x_debug: Optional[str] = Header(default=None),
+    x_debug_token: Optional[str] = Header(default=None),
+    x_cluster_token: Optional[str] = Header(default=None),
+    x_cluster_provider: Optional[str] = Header(default=None),
+):
+    # per-client budget (429), then a bounded wait for a query slot (503);
+    # both fail fast with Retry-After rather than queueing behind slow calls
+    admission.client_limiter.check(payload.client_id)
+    flags = _debug.parse_flags(x_debug, x_debug_token)
+    # behind the cluster gateway the provider comes with the request (app/cluster.py)
+    routed = cluster.trusted_provider(x_cluster_token, x_cluster_provider)
+    if routed and not (PROVIDERS_DIR / routed).is_dir():
+        raise HTTPException(status_code=404, detail='provider not on this node')
+    if not flags:
+        async with admission.query_gate.admit():
+            return await _answer_query(payload, background_tasks, routed)
+    # opt-in trace: stage breakdown, optionally a CPU profile / allocation snapshot
+    with _debug.trace_request(flags) as trace:
+        queued = time.perf_counter()
+        async with admission.query_gate.admit():
+            trace.add('queue', time.perf_counter() - queued)
+            result = await _answer_query(payload, background_tasks, routed)
+    result.debug = trace.summary()
+    response.headers['Server-Timing'] = trace.server_timing()
+    logger.info('debug trace %s client=%s: %s', trace.id, payload.client_id, result.debug)
+    return result
+
+
+def _provenance(hits) -> list:
+    return [dict(h.get('provenance') or {}, key=h['key']) for h in hits]
+
+
+async def _answer_query(payload: QueryRequest, background_tasks: BackgroundTasks,
+                        provider: Optional[str] = None) -> QueryResponse:
     client_id = payload.client_id
     question = payload.question
-    provider = get_client_provider(client_id)
+    lookup_start = time.perf_counter()
+    provider = provider or get_client_provider(client_id)
     if not provider:
         raise HTTPException(status_code=404, detail='assigned provider not found for client')
+    stages = metrics.StageTimer(metrics.QUERY_STAGE_SECONDS, start=lookup_start, provider=provider)
+    stages.mark('client_lookup')
 
-    dirs = ensure_provider_dirs(PROVIDERS_DIR, provider)
-    idx_path = dirs['index'] / 'faiss.bin'
+    # no mkdir here: an imported bundle is served read-only
+    dirs = provider_dirs(PROVIDERS_DIR, provider)
     db_path = dirs['db'] / 'metadata.sqlite'
-    if not idx_path.exists() or not db_path.exists():
-        missing = []
-        if not idx_path.exists():
-            missing.append(f"index file missing: {idx_path}")
-        if not db_path.exists():
-            missing.append(f"db file missing: {db_path}")
-        raise HTTPException(status_code=400, detail=f"Provider data incomplete; {', '.join(missing)}. Please rebuild the provider index.")
+    if not db_path.exists():
+        raise HTTPException(status_code=400, detail=f"Provider data incomplete; db file missing: {db_path}. Please rebuild the provider index.")
+
+    # Contact/pricing questions are answered from the cached provider metadata
+    # when the intent is clear, skipping embedding, FAISS and the LLM.
+    filters = payload.filters.to_kwargs() if payload.filters else None
+    if METADATA_FASTPATH_ENABLED and not filters:
+        fast = answer_from_metadata(question, get_provider_metadata(db_path))
+        stages.mark('metadata_fastpath')
+        if fast is not None:
+            metrics.QUERIES.labels(provider=provider, mode='metadata').inc()
+            return QueryResponse(answer=fast[0], sources=['provider_metadata'], mode='metadata')
 
     # load provider-local sqlite
     with SqliteDict(str(db_path)) as pdb:
-        vector_keys = pdb.get('vector_keys', [])
-        # load faiss index
-        index = faiss.read_index(str(idx_path))
-        # Validate index integrity
-        if index.ntotal == 0:
-            raise HTTPException(status_code=400, detail='Provider index is empty. Please rebuild the provider index.')
-        if vector_keys and len(vector_keys) != index.ntotal:
-            raise HTTPException(status_code=400, detail=f'Provider index and DB are out of sync (index count={index.ntotal}, db vectors={len(vector_keys)}). Please rebuild the provider index.')
-        # determine embedding model recorded at index time (or use default)
-        model_key = pdb.get('embedding_model') or get_default_embedding_model()
+        # Semantic cache: a near-duplicate of an already answered question gets
+        # the cached grounded answer; on a miss the embedding is reused below.
+        qvec = None
+        use_cache = semantic_cache.enabled_for(payload.retrieval)
+        if use_cache:
+            model_key = provider_model(pdb, dirs['index'])
+            cache_version = semantic_cache.build_version(dirs)
+            cache_options = (payload.retrieval, payload.mode, payload.top_k or 5,
+                             payload.filters.model_dump_json(exclude_none=True) if filters else None)
+            try:
+                qvec = await run_in_threadpool(default_embedding_provider.embed_texts_with_model, model_key, [question])
+            except Exception:
+                qvec = None  # retrieve() reports the embedding error
+            stages.mark('embed')
+            cached = None
+            if qvec is not None:
+                cached = semantic_cache.cache.lookup(provider, cache_version, model_key, qvec, cache_options)
+            stages.mark('semantic_cache')
+            if cached is not None:
+                if semantic_cache.should_verify():
+                    background_tasks.add_task(semantic_cache.verify_hit, provider, dirs, cache_version, cached,
+                                              question, payload.top_k or 5, payload.retrieval, filters)
+                metrics.QUERIES.labels(provider=provider, mode='cache').inc()
+                return QueryResponse(answer=cached['answer'], sources=cached['sources'], mode='cache',
+                                     provenance=cached['provenance'])
         try:
-            qemb = default_embedding_provider.embed_text_with_model(model_key, question)
-        except Exception as e:
-            # If preferred provider is not available, surface error rather than silently using a different model
-            raise HTTPException(status_code=500, detail=f'Embedding provider error for model {model_key}: {e}')
-        qvec = np.array(qemb, dtype='float32').reshape(1, -1)
-        top_k = max(1, min(payload.top_k or 5, index.ntotal))
-        D, I = index.search(qvec, top_k)
-        hits = []
-        for dist, idx in zip(D[0], I[0]):
-            if idx < 0:
-                continue
-            key = vector_keys[idx]
-            chunk = pdb.get(key)
-            if chunk:
-                hits.append({'key': key, 'text': chunk['text'], 'score': float(dist)})
-
+            # embedding and (sharded) FAISS search block: keep them off the event loop
+            hits, qvec, model_key = await run_in_threadpool(
+                retrieve, pdb, dirs, question, payload.top_k or 5, payload.retrieval,
+                provider=provider, qvec=qvec, filters=filters,
+                qvec_model=model_key if qvec is not None else None)
+        except RetrievalError as e:
+            metrics.error('retrieval', 'client' if e.status_code < 500 else 'server')
+            raise HTTPException(status_code=e.status_code, detail=e.detail)
+
+        stages.skip()  # retrieve() records its own stages
         if not hits:
+            metrics.QUERIES.labels(provider=provider, mode='no_hits').inc()
             return QueryResponse(answer='Not available.', sources=[])
-
-        # Build context from hits (provider-local only)
-        context = '\n\n'.join([h['text'] for h in hits])
-        answer = call_llm_strict(question, context)
+        # an embedding migration with a complete shadow index: sample the new model's top-k
+        if payload.retrieval == 'dense' and not filters and migration.should_compare(dirs['index']):
+            background_tasks.add_task(migration.compare_query, provider, dirs, question, [h['key'] for h in hits])
+
+        # Build context from hits (provider-local only): overlapping chunks are
+        # stitched back together, near duplicates dropped, and the result packed
+        # into the token budget.
+        context, ctx_stats = build_context(hits)
+        stages.mark('context')
+        logger.info('query provider=%s prompt_tokens=%d tokens_saved=%d',
+                    provider, ctx_stats['prompt_tokens'], ctx_stats['tokens_saved'])
+        answer = None
+        mode = 'extractive'
+        deadline_missed = False
+        if payload.mode == 'llm' and llm_available():
+            deadline_ms = payload.deadline_ms or LLM_DEADLINE_MS
+            deadline_s = deadline_ms / 1000.0 if deadline_ms else None
+            # Run the blocking LLM call off the event loop (on the LLM's own threads)
+            # so concurrent identical questions can be coalesced and queued by the
+            # limiter in app.llm; the queue wait ends with the deadline.
+            llm_call = run_llm(call_llm_strict, question, context, provider=provider, timeout=deadline_s)
+            try:
+                answer = await asyncio.wait_for(llm_call, timeout=deadline_s)
+                mode = 'llm'
+            except asyncio.TimeoutError:
+                metrics.error('llm', 'deadline')
+                logger.warning('LLM missed %dms deadline for provider=%s; answering extractively', deadline_ms, provider)
+                deadline_missed = True
+            stages.mark('llm')
+
+        if answer is None:
+            # No LLM configured, extractive mode requested, or deadline missed:
+            # answer from the retrieved sentences, which are grounded by construction.
+            if deadline_missed:
+                # the budget is spent: rank by word overlap, no embedding call (possibly
+                # remote) and no second threadpool slot next to the abandoned LLM call
+                answer = extractive_answer(question, None, context, model_key)
+            else:
+                answer = await run_in_threadpool(extractive_answer, question, qvec, context, model_key)
+            stages.mark('extractive')
+            metrics.QUERIES.labels(provider=provider, mode='extractive').inc()
+            sources = [h['key'] for h in hits]
+            provenance = _provenance(hits)
+            if use_cache and mode == payload.mode and answer != 'Not available.':
+                semantic_cache.cache.store(provider, cache_version, model_key, qvec, cache_options,
+                                           question, answer, sources, mode, provenance)
+            return QueryResponse(
+                answer=answer,
+                sources=sources,
+                provenance=provenance,
+                mode=mode,
+                prompt_tokens=ctx_stats['prompt_tokens'],
+                prompt_tokens_saved=ctx_stats['tokens_saved'],
+            )
 
         # Hallucination filtering: split sentences and check token overlap
         import re
@@ -198,9 +396,129 @@ async def query(payload: QueryRequest, _auth=Depends(api_key_auth)):
             final = 'Not available.'
         else:
             final = ' '.join(kept)
+        stages.mark('hallucination_filter')
+        metrics.QUERIES.labels(provider=provider, mode='llm').inc()
 
         sources = [h['key'] for h in hits]
-        return QueryResponse(answer=final, sources=sources)
+        provenance = _provenance(hits)
+        if use_cache and final != 'Not available.':
+            semantic_cache.cache.store(provider, cache_version, model_key, qvec, cache_options,
+                                       question, final, sources, mode, provenance)
+        return QueryResponse(
+            answer=final,
+            sources=sources,
+            provenance=provenance,
+            mode=mode,
+            prompt_tokens=ctx_stats['prompt_tokens'],
+            prompt_tokens_saved=ctx_stats['tokens_saved'],
+        )
+
+
+@app.post('/v1/search', response_model=SearchResponse)
+async def search(payload: SearchRequest, _auth=Depends(api_key_auth)):
+    """Search several providers' documents at once and return the merged top-k chunks.
+
+    Each hit names the provider it came from. Providers that cannot be searched
+    (not built, out of sync) are listed in `errors` instead of failing the request.
+    """
+    admission.client_limiter.check(payload.client_id)
+    if payload.providers is None:
+        providers = [p.name for p in sorted(PROVIDERS_DIR.iterdir())
+                     if not p.name.startswith('.') and has_index(p / 'index')] if PROVIDERS_DIR.exists() else []
+    else:
+        providers = list(dict.fromkeys(payload.providers))
+        bad = [p for p in providers if not cluster.valid_provider_name(p)]
+        if bad:
+            raise HTTPException(status_code=400, detail=f'invalid provider names: {bad}')
+    if len(providers) > FANOUT_MAX_PROVIDERS:
+        raise HTTPException(status_code=400,
+                            detail=f'too many providers ({len(providers)}); at most {FANOUT_MAX_PROVIDERS} per request')
+    async with admission.query_gate.admit():
+        try:
+            result = await run_in_threadpool(fanout.search_providers, PROVIDERS_DIR, providers,
+                                             payload.question, payload.top_k or 10,
+                                             payload.filters.to_kwargs() if payload.filters else None)
+        except Exception as e:
+            metrics.error('fanout', e)
+            raise HTTPException(status_code=500, detail=f'Embedding provider error: {e}')
+    metrics.QUERIES.labels(provider='fanout', mode='search').inc()
+    return SearchResponse(hits=result['hits'], providers_searched=len(providers) - len(result['errors']),
+                          errors=result['errors'], score_kind=result['score_kind'], model=result['model'])
+
+
+def _require_cluster_token(token: Optional[str]):
+    if not cluster.token_ok(token):
+        raise HTTPException(status_code=403, detail='cluster token required')
+
+
+def _cluster_provider_name(provider: str) -> str:
+    if not cluster.valid_provider_name(provider):
+        raise HTTPException(status_code=400, detail='invalid provider name')
+    return provider
+
+
+@app.get('/v1/cluster/providers/{provider}/archive')
+async def cluster_export_provider(provider: str, x_cluster_token: Optional[str] = Header(default=None)):
+    """Provider directory as tar.gz, for a node taking over the provider.
+
+    Packed to a temp file and streamed from there; the file is removed once sent.
+    """
+    _require_cluster_token(x_cluster_token)
+    root = PROVIDERS_DIR / _cluster_provider_name(provider)
+    if not root.is_dir():
+        raise HTTPException(status_code=404, detail='provider not on this node')
+    archive = cluster.spool_file(PROVIDERS_DIR, provider, 'outgoing')
+    try:
+        await run_in_threadpool(cluster.pack_provider, root, archive)
+    except BaseException:
+        archive.unlink(missing_ok=True)
+        raise
+    return FileResponse(str(archive), media_type='application/gzip',
+                        background=BackgroundTask(archive.unlink, missing_ok=True))
+
+
+@app.post('/v1/cluster/providers/{provider}/pull')
+async def cluster_pull_provider(provider: str, payload: dict, x_cluster_token: Optional[str] = Header(default=None)):
+    """Copy a provider from another node (`{"source": "http://node:8000"}`) and swap it in.
+
+    The archive is streamed into a temp file rather than held in memory.
+    """
+    _require_cluster_token(x_cluster_token)
+    provider = _cluster_provider_name(provider)
+    source = str(payload.get('source') or '').rstrip('/')
+    if not source:
+        raise HTTPException(status_code=400, detail='source node url required')
+    import httpx
+
+    archive = cluster.spool_file(PROVIDERS_DIR, provider, 'download')
+    try:
+        async with httpx.AsyncClient(timeout=600) as client:
+            async with client.stream('GET', f'{source}/v1/cluster/providers/{provider}/archive',
+                                     headers={'X-Cluster-Token': x_cluster_token}) as r:
+                if r.status_code != 200:
+                    detail = (await r.aread())[:200].decode('utf-8', 'replace')
+                    raise HTTPException(status_code=502, detail=f'source returned {r.status_code}: {detail}')
+                with open(archive, 'wb') as f:
+                    async for chunk in r.aiter_bytes(1 << 20):
+                        await run_in_threadpool(f.write, chunk)
+        size = archive.stat().st_size
+        try:
+            await run_in_threadpool(cluster.unpack_provider, archive, PROVIDERS_DIR, provider)
+        except (ValueError, tarfile.TarError, EOFError) as e:
+            metrics.error('cluster', 'bad_archive')
+            raise HTTPException(status_code=502, detail=f'bad provider archive: {e}')
+    finally:
+        archive.unlink(missing_ok=True)
+    logger.info('pulled provider %s from %s (%d bytes)', provider, source, size)
+    return JSONResponse({'status': 'pulled', 'provider': provider, 'bytes': size})
+
+
+@app.delete('/v1/cluster/providers/{provider}')
+async def cluster_drop_provider(provider: str, x_cluster_token: Optional[str] = Header(default=None)):
+    """Remove a provider this node no longer owns."""
+    _require_cluster_token(x_cluster_token)
+    removed = await run_in_threadpool(cluster.remove_provider, PROVIDERS_DIR, _cluster_provider_name(provider))
+    return JSONResponse({'status': 'removed' if removed else 'absent', 'provider': provider})
 
 
 @app.get('/v1/providers')
@@ -209,7 +527,8 @@ async def list_providers():
     items = []
     if base.exists():
         for p in sorted(base.iterdir()):
-            if p.is_dir():
+            # dot-directories are transfers in progress (app/cluster.py)
+            if p.is_dir() and not p.name.startswith('.'):
                 items.append(p.name)
     return JSONResponse({'providers': items})
 
@@ -0,0 +1,141 @@
+"""Answer contact and pricing questions straight from `provider_metadata`.
+
+`build_index_for_provider` stores the first row of `metadata.xlsx` as
+`provider_metadata` (name, email, phone, services_summary, charges). Questions
+that only ask for one of these fields do not need embedding, FAISS or an LLM:
+a keyword intent classifier picks the field(s) and a confidence, and
+`answer_from_metadata` returns the stored value when the confidence clears the
+threshold. Uncertain questions return None so the caller runs full RAG.
+"""
+import math
+import os
+import re
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from sqlitedict import SqliteDict
+
+from .config import METADATA_FASTPATH_THRESHOLD
+from . import metrics
+
+_WORD_RE = re.compile(r"[a-z0-9]+")
+
+# field -> (strong keywords, weak keywords); phrases are matched on the
+# lowercased question, single words on its tokens
+_FIELD_KEYWORDS = {
+    'phone': ({'phone', 'telephone', 'mobile', 'whatsapp', 'call', 'cell', 'phone number'}, {'number', 'ring'}),
+    'email': ({'email', 'e-mail', 'mail', 'email address'}, {'address', 'write'}),
+    'charges': ({'charges', 'charge', 'price', 'prices', 'pricing', 'cost', 'costs', 'fee', 'fees', 'rate', 'rates',
+                 'how much'}, {'pay', 'expensive', 'cheap', 'budget'}),
+    'name': ({'your name', 'provider name', 'business name', 'company name'}, {'name', 'called'}),
+    'services_summary': ({'services', 'service'}, {'offer', 'provide', 'do'}),
+}
+# services are detected (so they count against other intents) but answered by
+# full RAG: the summary is rarely a complete answer
+_ANSWERABLE = {'name', 'email', 'phone', 'charges'}
+# "contact" questions are answered with both email and phone
+_CONTACT_WORDS = {'contact', 'reach', 'get in touch'}
+
+_LABELS = {
+    'name': 'Name',
+    'email': 'Email',
+    'phone': 'Phone',
+    'services_summary': 'Services',
+    'charges': 'Charges',
+}
+
+# words that frame a question without changing what is asked
+_FRAME_WORDS = {
+    'what', 's', 'whats', 'which', 'who', 'how', 'is', 'are', 'the', 'a', 'an', 'your', 'you', 'do', 'does',
+    'can', 'i', 'me', 'my', 'we', 'to', 'of', 'for', 'please', 'tell', 'give', 'get', 'there', 'it', 'its', 'their',
+    'they', 'provider', 'much', 'in', 'on', 'at', 'with', 'and', 'or', 'by', 'via', 'share', 'know', 'want',
+    'would', 'like', 'need', 'have', 'has', 'any', 'current', 'latest', 'details', 'info', 'information',
+}
+_RESIDUAL_PENALTY = 0.35
+
+_cache: Dict[str, Tuple[int, dict]] = {}
+_cache_lock = threading.Lock()
+
+
+def get_provider_metadata(db_path: Path) -> dict:
+    """Return the cached `provider_metadata` of a provider DB, reloading when the DB changes."""
+    key = str(db_path)
+    try:
+        mtime = os.stat(key).st_mtime_ns
+    except OSError:
+        return {}
+    with _cache_lock:
+        hit = _cache.get(key)
+        if hit is not None and hit[0] == mtime:
+            metrics.cache_event('provider_metadata', True)
+            return hit[1]
+    metrics.cache_event('provider_metadata', False)
+    with SqliteDict(key, flag='r') as pdb:
+        meta = pdb.get('provider_metadata') or {}
+    with _cache_lock:
+        _cache[key] = (mtime, meta)
+    return meta
+
+
+def _clean(value) -> str:
+    if value is None:
+        return ''
+    if isinstance(value, float) and math.isnan(value):
+        return ''
+    return str(value).strip()
+
+
+def classify_intent(question: str, provider_words: set | None = None) -> Tuple[List[str], float]:
+    """Return (fields, confidence) for a question about provider metadata."""
+    q = question.lower()
+    tokens = _WORD_RE.findall(q)
+    token_set = set(tokens)
+
+    def matches(words):
+        return {w for w in words if (w in q if ' ' in w or '-' in w else w in token_set)}
+
+    scores = {}
+    used = set()
+    for field, (strong, weak) in _FIELD_KEYWORDS.items():
+        s, w = matches(strong), matches(weak)
+        score = min(1.0, len(s) * 1.0 + len(w) * 0.4)
+        if score > 0:
+            scores[field] = score
+            for m in s | w:
+                used.update(m.split())
+    contact = matches(_CONTACT_WORDS)
+    if contact:
+        for m in contact:
+            used.update(m.split())
+        scores['email'] = max(scores.get('email', 0.0), 0.8)
+        scores['phone'] = max(scores.get('phone', 0.0), 0.8)
+    if not scores:
+        return [], 0.0
+
+    best = max(scores.values())
+    fields = [f for f, s in scores.items() if s >= best - 1e-9 or (contact and f in ('email', 'phone'))]
+    # other fields mentioned with lower scores make the intent ambiguous
+    ambiguity = sum(s for f, s in scores.items() if f not in fields)
+    # content words outside the question frame suggest a more specific
+    # question than a stored field can answer ("phone number of the Lahore branch")
+    residual = [t for t in tokens if t not in _FRAME_WORDS and t not in used and t not in (provider_words or set())]
+    confidence = best - 0.5 * ambiguity - _RESIDUAL_PENALTY * len(residual)
+    return fields, max(0.0, min(1.0, confidence))
+
+
+def answer_from_metadata(question: str, meta: dict, threshold: float | None = None) -> Optional[Tuple[str, List[str], float]]:
+    """Return (answer, fields, confidence) or None when full RAG should run."""
+    if not meta:
+        return None
+    threshold = METADATA_FASTPATH_THRESHOLD if threshold is None else threshold
+    provider_words = set(_WORD_RE.findall(_clean(meta.get('name')).lower()))
+    fields, confidence = classify_intent(question, provider_words)
+    if not fields or confidence < threshold or not set(fields) <= _ANSWERABLE:
+        return None
+    values = [(f, _clean(meta.get(f))) for f in fields]
+    if any(not v for _, v in values):
+        # a missing field may still be covered by the documents
+        return None
+    answer = ' '.join(f"{_LABELS[f]}: {v.rstrip('.')}." for f, v in values)
+    return answer, fields, confidence
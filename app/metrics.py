@@ -0,0 +1,154 @@
+"""Prometheus metrics for the query path, the rebuild pipeline, embeddings and the LLM.
+
+`prometheus_client` is optional: without it every metric is a no-op and
+`/metrics` answers 503. With several worker processes (uvicorn --workers or
+scripts/serve_prefork.py) set PROMETHEUS_MULTIPROC_DIR to an empty, writable
+directory before the server starts; each process then writes its samples
+there and `/metrics` aggregates all of them, whichever worker serves the scrape.
+
+Stage latencies are recorded with `StageTimer`, which observes the time since
+the previous mark, so a linear pipeline needs one call per step:
+
+    stages = StageTimer(QUERY_STAGE_SECONDS, provider=provider)
+    ...lookup...
+    stages.mark('client_lookup')
+"""
+import logging
+import os
+import time
+from contextlib import contextmanager
+
+from . import debug
+
+logger = logging.getLogger(__name__)
+
+try:
+    import prometheus_client as _prom
+except ImportError:  # metrics are optional
+    _prom = None
+
+# seconds; stage timings span sub-millisecond lookups to multi-second LLM calls
+STAGE_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+BUILD_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0)
+
+
+class _NoopMetric:
+    def labels(self, *args, **kwargs):
+        return self
+
+    def observe(self, value):
+        pass
+
+    def inc(self, amount=1):
+        pass
+
+
+def _histogram(name, doc, labels, buckets=STAGE_BUCKETS):
+    if _prom is None:
+        return _NoopMetric()
+    return _prom.Histogram(name, doc, labels, buckets=buckets)
+
+
+def _counter(name, doc, labels):
+    if _prom is None:
+        return _NoopMetric()
+    return _prom.Counter(name, doc, labels)
+
+
+QUERY_STAGE_SECONDS = _histogram(
+    'rag_query_stage_seconds', 'Time spent in each stage of /v1/query', ['stage', 'provider'])
+QUERIES = _counter('rag_queries', 'Answered queries by answer mode', ['provider', 'mode'])
+BUILD_STAGE_SECONDS = _histogram(
+    'rag_build_stage_seconds', 'Time spent in each step of a provider rebuild', ['stage', 'provider'],
+    buckets=BUILD_BUCKETS)
+EMBED_SECONDS = _histogram('rag_embed_seconds', 'Embedding call latency', ['model'])
+EMBED_TEXTS = _counter('rag_embed_texts', 'Texts embedded', ['model'])
+LLM_SECONDS = _histogram('rag_llm_seconds', 'LLM completion latency seen by the caller', ['provider', 'model'])
+LLM_TOKENS = _counter('rag_llm_tokens', 'LLM tokens used', ['provider', 'model', 'kind'])
+LLM_HEDGE_REQUESTS = _counter('rag_llm_hedge_requests', 'Upstream LLM calls made through the hedger', ['provider'])
+LLM_HEDGES = _counter('rag_llm_hedges', 'Duplicate requests sent for slow LLM calls', ['provider'])
+LLM_HEDGE_WINS = _counter('rag_llm_hedge_wins', 'Hedges that answered before their primary', ['provider'])
+LLM_HEDGE_SAVED_SECONDS = _histogram(
+    'rag_llm_hedge_saved_seconds', 'Time a winning hedge saved over its primary', ['provider'])
+CACHE_EVENTS = _counter('rag_cache_events', 'In-process cache lookups', ['cache', 'result'])
+ERRORS = _counter('rag_errors', 'Errors by component', ['component', 'kind'])
+SEMANTIC_CACHE_CHECKS = _counter(
+    'rag_semantic_cache_checks', 'Sampled semantic cache hits re-checked against retrieval', ['result'])
+DEDUP_CHUNKS = _counter('rag_dedup_chunks', 'Chunks kept or dropped as near-duplicates at ingest', ['result'])
+MIGRATION_OVERLAP = _histogram(
+    'rag_migration_overlap', 'Top-k overlap of sampled queries between the live and the shadow index',
+    ['provider'], buckets=(0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1.0))
+
+
+class StageTimer:
+    """Observe consecutive stage durations into a histogram with a 'stage' label.
+
+    `durations` keeps what was recorded (seconds per stage, summed when a
+    stage is marked twice) for callers that also want to log or return them.
+    Marks made while a debug trace is active (app/debug.py) are added to it.
+    """
+
+    def __init__(self, histogram, start: float | None = None, **labels):
+        self.histogram = histogram
+        self.labels = labels
+        self.durations = {}
+        self._trace = debug.current()
+        self._last = time.perf_counter() if start is None else start
+
+    def mark(self, stage: str) -> float:
+        now = time.perf_counter()
+        elapsed = now - self._last
+        self._last = now
+        self.histogram.labels(stage=stage, **self.labels).observe(elapsed)
+        self.durations[stage] = self.durations.get(stage, 0.0) + elapsed
+        if self._trace is not None:
+            self._trace.add(stage, elapsed)
+        return elapsed
+
+    def skip(self):
+        """Restart the clock without recording (e.g. after waiting on something unrelated)."""
+        self._last = time.perf_counter()
+
+
+@contextmanager
+def timed(histogram, **labels):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        histogram.labels(**labels).observe(time.perf_counter() - start)
+
+
+def cache_event(cache: str, hit: bool):
+    CACHE_EVENTS.labels(cache=cache, result='hit' if hit else 'miss').inc()
+
+
+def error(component: str, exc: BaseException | str):
+    kind = exc if isinstance(exc, str) else type(exc).__name__
+    ERRORS.labels(component=component, kind=kind).inc()
+
+
+def available() -> bool:
+    return _prom is not None
+
+
+def render():
+    """Return (body, content_type) for a scrape, merging all worker processes if multiprocess."""
+    if _prom is None:
+        raise RuntimeError('prometheus_client is not installed')
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        from prometheus_client import multiprocess
+
+        registry = _prom.CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = _prom.REGISTRY
+    return _prom.generate_latest(registry), _prom.CONTENT_TYPE_LATEST
+
+
+def mark_process_dead(pid: int):
+    """Drop a dead worker's live-gauge files (multiprocess mode); counters/histograms are kept."""
+    if _prom is not None and os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        from prometheus_client import multiprocess
+
+        multiprocess.mark_process_dead(pid)
@@ -0,0 +1,354 @@
+"""Online embedding-model migration: re-embed into a shadow index, then switch.
+
+A migration moves one provider from the model recorded at build time to
+`target_model` without a rebuild and without downtime:
+
+  1. `start` creates `index/migration/` with a state file; `run` (a CLI
+     process, scripts/migrate_embeddings.py) re-embeds the provider's chunks
+     batch by batch at a throttled rate into `migration/vectors.npy`,
+     checkpointing after every batch so it can be stopped and resumed.
+     Queries keep using the live index and model meanwhile.
+  2. Once every chunk is embedded the shadow FAISS index is written and the
+     migration is `ready`. API processes then run MIGRATION_COMPARE_RATE of
+     the provider's dense queries against it too (`compare_query`) and log
+     the top-k overlap with the live answer; `compare` does the same offline.
+  3. `switch` writes the new vectors as a new generation of shard files plus
+     a shard manifest recording `target_model` (app/shards.py). Replacing the
+     manifest is the switch: readers take the model from the index they load
+     (`provider_store.index_model`), so model and vectors change together.
+     The provider db and vectors.npy are updated after.
+
+A rebuild of the provider during a migration changes its chunks; the
+migration notices (the index file changed) and starts over. Set
+EMBEDDING_MODEL to the new model too, so later rebuilds keep it.
+"""
+import hashlib
+import json
+import logging
+import random
+import shutil
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from .config import MIGRATION_COMPARE_RATE
+from .provider_store import get_faiss_index, get_provider_index, index_file, index_model
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+MIGRATION_DIR = 'migration'
+STATE = 'state.json'
+COMPARE_LOG = 'compare.jsonl'
+
+
+class MigrationError(Exception):
+    pass
+
+
+def _dir(index_dir: Path) -> Path:
+    return index_dir / MIGRATION_DIR
+
+
+def _source_version(index_dir: Path) -> int:
+    return index_file(index_dir).stat().st_mtime_ns
+
+
+def _open_db(provider_dir: Path, flag: str = 'r'):
+    from sqlitedict import SqliteDict
+
+    return SqliteDict(str(provider_dir / 'db' / 'metadata.sqlite'), flag=flag, autocommit=True)
+
+
+def status(index_dir: Path) -> Optional[dict]:
+    try:
+        return json.loads((_dir(index_dir) / STATE).read_text(encoding='utf-8'))
+    except (OSError, ValueError):
+        return None
+
+
+def _save(index_dir: Path, state: dict):
+    state['updated_at'] = time.time()
+    path = _dir(index_dir) / STATE
+    tmp = path.with_name(path.name + '.tmp')
+    tmp.write_text(json.dumps(state, indent=2), encoding='utf-8')
+    tmp.replace(path)
+
+
+def start(provider_dir: Path, target_model: str, restart: bool = False) -> dict:
+    """Begin (or, with the same target, keep) a migration of the provider to `target_model`."""
+    index_dir = provider_dir / 'index'
+    if provider_dir.is_symlink():
+        # an imported bundle (app/bundle.py): migrate where it is built, then import the new bundle
+        raise MigrationError('provider is served from an imported bundle')
+    if not index_file(index_dir).exists():
+        raise MigrationError('provider has no built index')
+    state = status(index_dir)
+    if state is not None and not restart:
+        if state['target_model'] != target_model:
+            raise MigrationError(f'a migration to {state["target_model"]} is in progress; abort it first')
+        return state
+    with _open_db(provider_dir) as pdb:
+        source_model = index_model(get_provider_index(index_dir), pdb)
+        n = len(pdb.get('vector_keys', []))
+    if source_model == target_model:
+        raise MigrationError(f'provider already uses {target_model}')
+    shutil.rmtree(_dir(index_dir), ignore_errors=True)
+    _dir(index_dir).mkdir(parents=True)
+    state = {'provider': provider_dir.name, 'source_model': source_model, 'target_model': target_model,
+             'source_version': _source_version(index_dir), 'n_chunks': n, 'done': 0, 'dim': None,
+             'status': 'running', 'started_at': time.time()}
+    _save(index_dir, state)
+    logger.info('migration of %s: %s -> %s, %d chunks', provider_dir.name, source_model, target_model, n)
+    return state
+
+
+def abort(provider_dir: Path) -> bool:
+    index_dir = provider_dir / 'index'
+    if status(index_dir) is None:
+        return False
+    shutil.rmtree(_dir(index_dir), ignore_errors=True)
+    return True
+
+
+def _check_source(provider_dir: Path, state: dict) -> dict:
+    """Start over when the provider was rebuilt since the migration began."""
+    index_dir = provider_dir / 'index'
+    if _source_version(index_dir) != state['source_version']:
+        logger.warning('provider %s was rebuilt during its migration; starting over', provider_dir.name)
+        return start(provider_dir, state['target_model'], restart=True)
+    return state
+
+
+def run(provider_dir: Path, batch: int = 256, chunks_per_s: float = 0, throttle=None,
+        progress=None, max_seconds: Optional[float] = None) -> dict:
+    """Re-embed the remaining chunks into the shadow store; returns the state (status 'ready' when complete).
+
+    `chunks_per_s` caps the embedding rate, `throttle` (app.fleet.Throttle)
+    caps requests/tokens per minute for remote models. Stops early after
+    `max_seconds`; the next call resumes.
+    """
+    from numpy.lib.format import open_memmap
+
+    from .core.admission import TokenBucket
+    from .embeddings import default_embedding_provider
+    from .retrieval import fetch_chunks
+
+    index_dir = provider_dir / 'index'
+    state = status(index_dir)
+    if state is None:
+        raise MigrationError('no migration in progress; start one first')
+    state = _check_source(provider_dir, state)
+    if state['status'] != 'running':
+        return state
+    model_key = state['target_model']
+    rate = TokenBucket(chunks_per_s, batch) if chunks_per_s > 0 else None
+    vectors_path = _dir(index_dir) / 'vectors.npy'
+    vectors = open_memmap(vectors_path, mode='r+') if state['done'] else None
+    began = time.monotonic()
+    with _open_db(provider_dir) as pdb:
+        vector_keys = pdb.get('vector_keys', [])
+        while state['done'] < state['n_chunks']:
+            if max_seconds is not None and time.monotonic() - began > max_seconds:
+                break
+            lo = state['done']
+            keys = vector_keys[lo:lo + batch]
+            chunks = fetch_chunks(pdb, keys)
+            texts = [chunks[k]['text'] if k in chunks else '' for k in keys]
+            if rate is not None:
+                while True:
+                    delay = rate.take(time.monotonic(), len(texts))
+                    if not delay:
+                        break
+                    time.sleep(delay)
+            if throttle is not None and throttle.enabled and model_key.startswith('openai:'):
+                from .tokenizer import count_tokens
+
+                throttle.wait(1, sum(count_tokens(t) for t in texts) if throttle.tokens else 0)
+            emb = default_embedding_provider.embed_texts_with_model(model_key, texts)
+            if vectors is None:
+                vectors = open_memmap(vectors_path, mode='w+', dtype='float32',
+                                      shape=(state['n_chunks'], emb.shape[1]))
+                state['dim'] = int(emb.shape[1])
+            vectors[lo:lo + len(keys)] = emb
+            vectors.flush()
+            # progress only after the rows are on disk
+            state['done'] = lo + len(keys)
+            _save(index_dir, state)
+            if progress is not None:
+                progress(state)
+    if state['done'] >= state['n_chunks']:
+        _build_shadow(index_dir, state, vectors)
+    return state
+
+
+def _build_shadow(index_dir: Path, state: dict, vectors):
+    import faiss
+
+    dim = state['dim'] or 1
+    index = faiss.IndexFlatL2(dim)
+    if vectors is not None and len(vectors):
+        index.add(np.ascontiguousarray(vectors, dtype='float32'))
+    path = _dir(index_dir) / 'faiss.bin'
+    tmp = path.with_name(path.name + '.tmp')
+    faiss.write_index(index, str(tmp))
+    tmp.replace(path)
+    state['status'] = 'ready'
+    state['ready_at'] = time.time()
+    _save(index_dir, state)
+    logger.info('migration of %s ready: shadow index of %d vectors', state['provider'], index.ntotal)
+
+
+def _shadow(index_dir: Path):
+    path = _dir(index_dir) / 'faiss.bin'
+    return get_faiss_index(path) if path.exists() else None
+
+
+def should_compare(index_dir: Path) -> bool:
+    return (MIGRATION_COMPARE_RATE > 0 and random.random() < MIGRATION_COMPARE_RATE
+            and (_dir(index_dir) / 'faiss.bin').exists())
+
+
+def _shadow_search(index_dir: Path, model_key: str, question: str, top_k: int) -> List[int]:
+    from .embeddings import default_embedding_provider
+
+    index = _shadow(index_dir)
+    if index is None or index.ntotal == 0:
+        return []
+    qvec = default_embedding_provider.embed_texts_with_model(model_key, [question])
+    _, I = index.search(qvec, max(1, min(top_k, index.ntotal)))
+    return [int(i) for i in I[0] if i >= 0]
+
+
+def compare_query(provider: str, dirs: Dict[str, Path], question: str, live_keys: List[str]) -> None:
+    """Run a served question against the shadow index and record the top-k overlap.
+
+    Runs after the response has been sent; failures are logged, never raised.
+    """
+    index_dir = dirs['index']
+    state = status(index_dir)
+    if state is None or state['status'] != 'ready' or not live_keys:
+        return
+    try:
+        with _open_db(dirs['root']) as pdb:
+            vector_keys = pdb.get('vector_keys', [])
+        ids = _shadow_search(index_dir, state['target_model'], question, len(live_keys))
+    except Exception as e:
+        logger.warning('migration compare failed for provider=%s: %s', provider, e)
+        return
+    shadow_keys = {vector_keys[i] for i in ids if i < len(vector_keys)}
+    overlap = len(shadow_keys & set(live_keys)) / len(live_keys)
+    metrics.MIGRATION_OVERLAP.labels(provider=provider).observe(overlap)
+    line = json.dumps({'ts': time.time(), 'k': len(live_keys), 'overlap': round(overlap, 4),
+                       'question': hashlib.sha256(question.encode('utf-8')).hexdigest()[:16]})
+    try:
+        with open(_dir(index_dir) / COMPARE_LOG, 'a', encoding='utf-8') as f:
+            f.write(line + '\n')
+    except OSError:
+        pass  # migration switched or aborted meanwhile
+
+
+def online_overlap(index_dir: Path) -> dict:
+    """Mean top-k overlap of the live queries sampled so far."""
+    values = []
+    try:
+        with open(_dir(index_dir) / COMPARE_LOG, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    values.append(json.loads(line)['overlap'])
+                except (ValueError, KeyError):
+                    continue
+    except OSError:
+        pass
+    return {'samples': len(values), 'mean_overlap': round(sum(values) / len(values), 4) if values else None}
+
+
+def compare(provider_dir: Path, questions: Optional[List[str]] = None, sample: int = 100, top_k: int = 5,
+            seed: int = 0) -> dict:
+    """Offline comparison of the live and shadow indexes.
+
+    With `questions`, reports their mean top-k overlap. Without, samples
+    chunks and uses the start of each as a query: besides the overlap, the
+    share of queries that retrieve their own chunk (self-recall@k) is
+    reported for both models.
+    """
+    from .embeddings import default_embedding_provider
+    from .retrieval import fetch_chunks
+
+    index_dir = provider_dir / 'index'
+    state = status(index_dir)
+    if state is None or state['status'] != 'ready':
+        raise MigrationError('the shadow index is not complete yet')
+    live = get_provider_index(index_dir)
+    with _open_db(provider_dir) as pdb:
+        live_model = index_model(live, pdb)
+        vector_keys = pdb.get('vector_keys', [])
+        if questions:
+            queries = [(q, None) for q in questions]
+        else:
+            rng = random.Random(seed)
+            picked = rng.sample(range(len(vector_keys)), min(sample, len(vector_keys)))
+            chunks = fetch_chunks(pdb, [vector_keys[i] for i in picked])
+            queries = [(chunks[vector_keys[i]]['text'][:200], i) for i in picked if vector_keys[i] in chunks]
+    overlaps, live_hits, shadow_hits = [], 0, 0
+    for question, own in queries:
+        qvec = default_embedding_provider.embed_texts_with_model(live_model, [question])
+        _, I = live.search(qvec, max(1, min(top_k, live.ntotal)))
+        live_ids = {int(i) for i in I[0] if i >= 0}
+        shadow_ids = set(_shadow_search(index_dir, state['target_model'], question, top_k))
+        overlaps.append(len(live_ids & shadow_ids) / max(1, len(live_ids)))
+        if own is not None:
+            live_hits += own in live_ids
+            shadow_hits += own in shadow_ids
+    out = {'queries': len(queries), 'top_k': top_k, 'source_model': live_model,
+           'target_model': state['target_model'],
+           'mean_overlap': round(sum(overlaps) / len(overlaps), 4) if overlaps else None}
+    if not questions and queries:
+        out['self_recall'] = {'source': round(live_hits / len(queries), 4),
+                              'target': round(shadow_hits / len(queries), 4)}
+    return out
+
+
+def switch(provider_dir: Path, min_overlap: Optional[float] = None) -> dict:
+    """Serve the provider from the shadow index and the target model from now on."""
+    from .shards import partition, read_manifest, write_shards
+
+    index_dir = provider_dir / 'index'
+    state = status(index_dir)
+    if state is None:
+        raise MigrationError('no migration in progress')
+    if state['status'] != 'ready':
+        raise MigrationError(f'the shadow index is not complete ({state["done"]}/{state["n_chunks"]} chunks)')
+    if _source_version(index_dir) != state['source_version']:
+        raise MigrationError('the provider was rebuilt since the shadow index was made; run the migration again')
+    if min_overlap is not None:
+        observed = online_overlap(index_dir)
+        if observed['mean_overlap'] is None or observed['mean_overlap'] < min_overlap:
+            raise MigrationError(f'observed overlap {observed} is below {min_overlap}')
+
+    vectors = np.load(_dir(index_dir) / 'vectors.npy', mmap_mode='r')
+    current = read_manifest(index_dir) if index_file(index_dir).name != 'faiss.bin' else None
+    with _open_db(provider_dir, flag='c') as pdb:
+        if current is not None:
+            by = current['by']
+            parts = partition(len(vectors), len(current['shards']), by, documents=pdb.get('documents'),
+                              vector_keys=pdb.get('vector_keys'))
+        else:
+            by, parts = 'document', [np.arange(len(vectors), dtype='int64')]
+        generation = (current or {}).get('generation', 0) + 1
+        # the manifest replace below is the switch; everything after is bookkeeping
+        manifest = write_shards(index_dir, vectors, parts, by, embedding_model=state['target_model'],
+                                generation=generation)
+        pdb['embedding_model'] = state['target_model']
+        pdb['embedding_model_previous'] = state['source_model']
+    del vectors
+    (index_dir / 'faiss.bin').unlink(missing_ok=True)
+    (_dir(index_dir) / 'vectors.npy').replace(index_dir / 'vectors.npy')
+    summary = dict(provider=provider_dir.name, source_model=state['source_model'],
+                   target_model=state['target_model'], n_chunks=state['n_chunks'],
+                   shards=len(manifest['shards']), generation=generation, online=online_overlap(index_dir))
+    shutil.rmtree(_dir(index_dir), ignore_errors=True)
+    logger.info('migration of %s switched to %s', provider_dir.name, state['target_model'])
+    return summary
@@ -1,53 +1,194 @@
 from pathlib import Path
+import bisect
+import hashlib
 import re
 import json
+import time
+from typing import Optional
+import logging
 from .utils import ensure_provider_dirs, write_json
 from .embeddings import default_embedding_provider, get_default_embedding_model
+from .lexical import LexicalIndex
+from .chunk_meta import ChunkMeta
+from .config import DEDUP_THRESHOLD, EMBED_BATCH_SIZE, INDEX_SHARDS, INDEX_SHARD_BY
+from .bundle import check_writable
+from .chunking import get_chunker
+from .dedup import find_duplicates
+from .shards import PARTITIONS, partition, remove_shards, write_shards
+from .tokenizer import count_tokens
+from . import metrics
 from sqlitedict import SqliteDict
-import faiss
 import numpy as np
-import pandas as pd
-import PyPDF2
-import docx
 
+# faiss, pandas, PyPDF2 and docx are imported inside the steps that use them so
+# that importing this module (e.g. from the API process) stays cheap.
 
-def _read_docs_text(docs_dir: Path) -> str:
-    texts = []
+logger = logging.getLogger(__name__)
+
+
+def _file_info(path: Path) -> dict:
+    data = path.read_bytes()
+    return {'source': path.name, 'doc_hash': hashlib.sha256(data).hexdigest(),
+            'uploaded_at': path.stat().st_mtime}
+
+
+def _read_documents(docs_dir: Path) -> list:
+    """Parse every supported file in `docs_dir`.
+
+    Returns one dict per document: source (file name), doc_hash (sha256 of the
+    file), uploaded_at (file mtime) and pages (list of texts); `paged` is True
+    when the pages are real PDF pages rather than the whole document.
+    """
+    import PyPDF2
+    import docx
+
+    documents = []
     for p in sorted(docs_dir.iterdir()):
         if not p.is_file():
             continue
-        if p.suffix.lower() == '.pdf':
+        suffix = p.suffix.lower()
+        if suffix == '.pdf':
             try:
                 with open(p, 'rb') as fh:
                     reader = PyPDF2.PdfReader(fh)
                     pages = [pg.extract_text() or '' for pg in reader.pages]
-                    texts.append('\n'.join(pages))
             except Exception:
                 continue
-        elif p.suffix.lower() in ('.docx', '.doc'):
+            documents.append(dict(_file_info(p), pages=pages, paged=True))
+        elif suffix in ('.docx', '.doc'):
             try:
                 doc = docx.Document(p)
-                texts.append('\n'.join([para.text for para in doc.paragraphs]))
+                text = '\n\n'.join([para.text for para in doc.paragraphs])
             except Exception:
                 continue
-        elif p.suffix.lower() in ('.txt',):
-            texts.append(p.read_text(encoding='utf-8', errors='ignore'))
-    return '\n'.join(texts)
+            documents.append(dict(_file_info(p), pages=[text], paged=False))
+        elif suffix in ('.txt',):
+            documents.append(dict(_file_info(p), pages=[p.read_text(encoding='utf-8', errors='ignore')], paged=False))
+    return documents
 
 
 def _normalize_whitespace(s: str) -> str:
     return re.sub(r'\s+', ' ', s).strip()
 
 
-def build_index_for_provider(provider: str, base_dir: Path):
+_HEADING = re.compile(r'^(#{1,6}\s+\S.*|[A-Z0-9][^.!?,;]{0,78})$')
+
+
+def _blocks(page: str) -> list:
+    """Split a page into normalised (text, kind) blocks: 'heading' for a short
+    unpunctuated line of at most 8 words (or a markdown heading), 'paragraph'
+    for text after a blank line or a heading. ' '.join of the texts equals
+    _normalize_whitespace(page)."""
+    blocks, lines = [], []
+
+    def flush():
+        text = _normalize_whitespace(' '.join(lines))
+        if text:
+            blocks.append((text, 'paragraph'))
+        lines.clear()
+
+    for line in page.splitlines():
+        stripped = line.strip()
+        if not stripped:
+            flush()
+        elif _HEADING.match(stripped) and len(stripped.split()) <= 8:
+            flush()
+            blocks.append((_normalize_whitespace(stripped), 'heading'))
+        else:
+            lines.append(stripped)
+    flush()
+    return blocks
+
+
+def _layout(segments: list) -> tuple:
+    """Join normalised document pages into one text, recording where each document and page lands.
+
+    Returns (combined_text, spans) with one span per non-empty document:
+    (start, end, page_starts, breaks) where page_starts lists (offset, page_no)
+    for paged documents and is empty otherwise, and breaks lists
+    (offset, 'paragraph' | 'heading') for the blocks found by `_blocks`, which
+    the normalised text no longer shows (app/chunking.py uses them).
+    """
+    parts, spans, pos = [], [], 0
+    for seg in segments:
+        doc_start, page_starts, breaks = None, [], []
+        for page_no, page in enumerate(seg['pages'], start=1):
+            blocks = _blocks(page)
+            if not blocks:
+                continue
+            if parts:
+                pos += 1  # the joining space
+            if doc_start is None:
+                doc_start = pos
+            if seg.get('paged'):
+                page_starts.append((pos, page_no))
+            for n, (text, kind) in enumerate(blocks):
+                if n:
+                    pos += 1
+                breaks.append((pos, kind))
+                pos += len(text)
+            parts.append(' '.join(text for text, _ in blocks))
+        spans.append(None if doc_start is None else (doc_start, pos, page_starts, breaks))
+    return ' '.join(parts), spans
+
+
+def _page_at(page_starts: list, offset: int):
+    if not page_starts:
+        return None
+    i = bisect.bisect_right([o for o, _ in page_starts], offset) - 1
+    return page_starts[max(i, 0)][1]
+
+
+def embed_chunks(model_key: str, chunks: list, batch_size: int = EMBED_BATCH_SIZE * 16) -> np.ndarray:
+    """Embed chunk texts batch by batch into one preallocated (n, dim) float32 matrix."""
+    vectors = None
+    for start in range(0, len(chunks), batch_size):
+        batch = chunks[start:start + batch_size]
+        if vectors is None:
+            first = default_embedding_provider.embed_texts_with_model(model_key, batch)
+            vectors = np.empty((len(chunks), first.shape[1]), dtype=np.float32)
+            vectors[:len(batch)] = first
+        else:
+            default_embedding_provider.embed_texts_with_model(model_key, batch, out=vectors[start:start + len(batch)])
+    return vectors
+
+
+def build_index_for_provider(provider: str, base_dir: Path, shards: Optional[int] = None,
+                             shard_by: Optional[str] = None, embed=None, dedup: Optional[float] = None,
+                             chunking: Optional[dict] = None) -> dict:
+    """Parse, chunk and index a provider's documents.
+
+    `shards` > 1 splits the vectors over that many FAISS shards partitioned
+    by `shard_by` ('document' or 'hash'); defaults come from INDEX_SHARDS /
+    INDEX_SHARD_BY. `embed(model_key, texts) -> (n, dim) float32` replaces
+    the in-process `embed_chunks`, e.g. with the shared fleet embedder
+    (app/fleet.py). `chunking` ({chunker, size, overlap}) overrides the
+    provider's chunking settings (app/chunking.py). Chunks that nearly
+    duplicate an earlier chunk (estimated Jaccard >= `dedup`, default
+    DEDUP_THRESHOLD, 0 disables) are not indexed.
+
+    Returns a report: the chunking used, the number of chunks, and the dedup
+    counts with what dropping duplicates saved in embedded texts/tokens and
+    index bytes.
+    """
+    shards = INDEX_SHARDS if shards is None else shards
+    dedup = DEDUP_THRESHOLD if dedup is None else dedup
+    shard_by = shard_by or INDEX_SHARD_BY
+    if shard_by not in PARTITIONS:
+        raise ValueError(f'unknown shard partitioning {shard_by!r}; expected one of {PARTITIONS}')
+    check_writable(base_dir, provider)
     dirs = ensure_provider_dirs(base_dir, provider)
+    chunker = get_chunker(dirs['root'], chunking)
     db_path = dirs['db'] / 'metadata.sqlite'
+    stages = metrics.StageTimer(metrics.BUILD_STAGE_SECONDS, provider=provider)
     with SqliteDict(str(db_path), autocommit=True) as db:
         # Step 1: Excel parsing
         meta_path = dirs['excel'] / 'metadata.xlsx'
         provider_meta = {}
         if meta_path.exists():
             try:
+                import pandas as pd
+
                 df = pd.read_excel(meta_path)
                 # try to extract columns by common names
                 cols = {c.lower(): c for c in df.columns}
@@ -63,62 +204,146 @@ def build_index_for_provider(provider: str, base_dir: Path):
             except Exception:
                 provider_meta = {}
         db['provider_metadata'] = provider_meta
+        stages.mark('excel')
 
-        # Step 2: Document parsing
-        docs_text = _read_docs_text(dirs['docs'])
-        combined = json.dumps(provider_meta, ensure_ascii=False) + '\n' + docs_text
-        combined = _normalize_whitespace(combined)
+        # Step 2: Document parsing. The metadata row is indexed as a document
+        # of its own; every document keeps its pages for provenance.
+        meta_json = json.dumps(provider_meta, ensure_ascii=False)
+        segments = [{
+            'source': 'provider_metadata',
+            'doc_hash': hashlib.sha256(meta_json.encode('utf-8')).hexdigest(),
+            'uploaded_at': meta_path.stat().st_mtime if meta_path.exists() else time.time(),
+            'pages': [meta_json],
+            'paged': False,
+        }] + _read_documents(dirs['docs'])
+        combined, spans = _layout(segments)
         parsed_path = dirs['parsed'] / 'raw_text.txt'
         parsed_path.parent.mkdir(parents=True, exist_ok=True)
         parsed_path.write_text(combined, encoding='utf-8')
         db['raw_text'] = combined
+        stages.mark('parse')
+
+        # Step 3: Chunking (app/chunking.py), per document so no chunk mixes two
+        # sources and each document's chunks form a contiguous id range (see
+        # app/chunk_meta.py). Offsets stay relative to the combined text.
+        pieces = []  # (doc_no, start, end, page_start, page_end)
+        documents = []
+        for seg, span in zip(segments, spans):
+            if span is None:
+                continue
+            doc_start, doc_end, page_starts, breaks = span
+            documents.append({'source': seg['source'], 'doc_hash': seg['doc_hash'],
+                              'uploaded_at': seg['uploaded_at']})
+            for start, end in chunker.split(combined, doc_start, doc_end, page_starts, breaks):
+                pieces.append((len(documents) - 1, start, end,
+                               _page_at(page_starts, start), _page_at(page_starts, end - 1)))
+        db['chunking'] = chunker.spec
+        stages.mark('chunk')
 
-        # Step 3: Chunking
-        chunk_size = 800
-        overlap = 200
-        chunks = []
-        i = 0
-        start = 0
-        text_len = len(combined)
-        while start < text_len:
-            end = min(start + chunk_size, text_len)
-            chunk_text = combined[start:end]
-            chunk_obj = {'id': i, 'text': chunk_text}
-            chunk_path = dirs['chunks'] / f'chunk_{i}.json'
-            write_json(chunk_path, chunk_obj)
+        # Step 3a: Near-duplicates (app/dedup.py) get no chunk id of their own:
+        # the earlier copy records their provenance and stands for them in
+        # metadata filters, so they are neither embedded nor retrieved twice.
+        dup_of = [None] * len(pieces)
+        if dedup > 0:
+            dup_of = find_duplicates([combined[start:end] for _, start, end, _, _ in pieces], dedup)
+        chunks, chunk_objs, chunk_docs, links, dropped = [], [], [], [], []
+        chunk_id = {}
+        for n, ((doc_no, start, end, page_start, page_end), dup) in enumerate(zip(pieces, dup_of)):
+            doc = documents[doc_no]
+            doc.setdefault('first_chunk', len(chunks))
+            if dup is not None:
+                kept = chunk_id[dup]
+                links.append({'chunk': kept, 'doc': doc_no, 'page_start': page_start, 'page_end': page_end})
+                chunk_objs[kept].setdefault('duplicates', []).append({
+                    'source': doc['source'], 'doc_hash': doc['doc_hash'], 'uploaded_at': doc['uploaded_at'],
+                    'page_start': page_start, 'page_end': page_end, 'start': start, 'end': end,
+                })
+                dropped.append(combined[start:end])
+            else:
+                chunk_id[n] = len(chunks)
+                chunk_objs.append({
+                    'id': len(chunks), 'text': combined[start:end], 'start': start, 'end': end,
+                    'source': doc['source'], 'doc_hash': doc['doc_hash'], 'uploaded_at': doc['uploaded_at'],
+                    'page_start': page_start, 'page_end': page_end,
+                })
+                chunks.append(combined[start:end])
+                chunk_docs.append({'doc': doc_no, 'page_start': page_start, 'page_end': page_end})
+            doc['end_chunk'] = len(chunks)
+        for chunk_obj in chunk_objs:
+            i = chunk_obj['id']
+            write_json(dirs['chunks'] / f'chunk_{i}.json', chunk_obj)
             db[f'chunk_{i}'] = chunk_obj
-            chunks.append(chunk_text)
-            i += 1
-            if end == text_len:
-                break
-            start = end - overlap
-
-        # Step 4: Embedding
-        vectors = []
+        db['documents'] = documents
+        ChunkMeta.build(documents, chunk_docs, links).save(dirs['index'] / 'chunk_meta.npz')
+        if dedup > 0:
+            metrics.DEDUP_CHUNKS.labels(result='kept').inc(len(chunks))
+            metrics.DEDUP_CHUNKS.labels(result='dropped').inc(len(dropped))
+        stages.mark('dedup')
+
+        # Step 3b: Lexical (BM25) index; doc ids follow chunk order, like the vectors
+        LexicalIndex.build(chunks).save(dirs['index'] / 'lexical.npz')
+        stages.mark('lexical')
+
+        # Step 4: Embedding, in batches written straight into one float32 matrix
+        vectors = None
         if chunks:
             # decide which embedding model to use and record it so queries reuse
             model_key = get_default_embedding_model()
             db['embedding_model'] = model_key
-            vectors = default_embedding_provider.embed_texts_with_model(model_key, chunks)
-            for idx, vec in enumerate(vectors):
-                db[f'vector_{idx}'] = vec
-
-        # Step 5: FAISS index
-        if vectors:
-            arr = np.array(vectors).astype('float32')
-            dim = arr.shape[1]
-            index = faiss.IndexFlatL2(dim)
-            index.add(arr)
-            idx_path = dirs['index'] / 'faiss.bin'
-            faiss.write_index(index, str(idx_path))
+            vectors = (embed or embed_chunks)(model_key, chunks)
+            # one contiguous array on disk instead of a pickled list per vector
+            np.save(dirs['index'] / 'vectors.npy', vectors)
+        stages.mark('embed')
+
+        # each dropped chunk would have cost one embedded text and one vector in
+        # faiss.bin / the shards and again in vectors.npy
+        dim = vectors.shape[1] if vectors is not None else 0
+        report = {
+            'threshold': dedup,
+            'chunks': len(pieces),
+            'kept': len(chunks),
+            'dropped': len(dropped),
+            'texts_saved': len(dropped),
+            'tokens_saved': sum(count_tokens(t) for t in dropped),
+            'index_bytes_saved': len(dropped) * dim * 4 * 2,
+        }
+        db['dedup'] = report
+        report = {'chunking': chunker.spec, 'chunks': len(chunks), 'dedup': report}
+
+        # Step 5: FAISS index, one file or `shards` shard files (app/shards.py)
+        if vectors is not None and len(vectors):
+            import faiss
+
             # store mapping vector idx -> chunk key
             mapping = [f'chunk_{i}' for i in range(len(vectors))]
+            if shards > 1:
+                parts = partition(len(vectors), shards, shard_by, documents=documents, vector_keys=mapping)
+                write_shards(dirs['index'], vectors, parts, shard_by)
+                (dirs['index'] / 'faiss.bin').unlink(missing_ok=True)
+            else:
+                dim = vectors.shape[1]
+                index = faiss.IndexFlatL2(dim)
+                # float32 C-contiguous: FAISS adds it without a conversion copy
+                index.add(vectors)
+                idx_path = dirs['index'] / 'faiss.bin'
+                # replace rather than overwrite: readers may have the old file mapped (INDEX_MMAP)
+                tmp_path = idx_path.with_name(idx_path.name + '.tmp')
+                faiss.write_index(index, str(tmp_path))
+                tmp_path.replace(idx_path)
+                remove_shards(dirs['index'])
             db['vector_keys'] = mapping
+        stages.mark('faiss')
 
-    return True
+    logger.info('built provider %s in %.2fs: %s', provider, sum(stages.durations.values()),
+                {k: round(v, 3) for k, v in stages.durations.items()})
+    if dedup > 0:
+        logger.info('provider %s: %d of %d chunks dropped as near-duplicates, saving %d embedded tokens '
+                    'and %d index bytes', provider, report['dedup']['dropped'], report['dedup']['chunks'],
+                    report['dedup']['tokens_saved'], report['dedup']['index_bytes_saved'])
+    return report
 
 
-def build_index_for_provider_index(provider_index: int, base_dir: Path):
+def build_index_for_provider_index(provider_index: int, base_dir: Path, **kwargs):
     """Resolve numeric provider index to provider name and build its index."""
     try:
         from . import provider_index as _pi
@@ -127,4 +352,17 @@ def build_index_for_provider_index(provider_index: int, base_dir: Path):
     provider = _pi.get_provider_by_index(int(provider_index))
     if not provider:
         raise RuntimeError(f'No provider found for index {provider_index}')
-    return build_index_for_provider(provider, base_dir)
+    return build_index_for_provider(provider, base_dir, **kwargs)
+
+
+def rebuild_provider_shard(provider: str, base_dir: Path, shard: int) -> dict:
+    """Re-embed and rewrite one shard of a sharded provider; the other shards are left alone."""
+    from .shards import rebuild_shard
+
+    check_writable(base_dir, provider)
+    dirs = ensure_provider_dirs(base_dir, provider)
+    stages = metrics.StageTimer(metrics.BUILD_STAGE_SECONDS, provider=provider)
+    with SqliteDict(str(dirs['db'] / 'metadata.sqlite'), flag='r') as db:
+        info = rebuild_shard(dirs['index'], db, shard, embed_chunks)
+    stages.mark('shard')
+    return dict(info, shard=shard, seconds=round(stages.durations['shard'], 3))
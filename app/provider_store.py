@@ -0,0 +1,113 @@
+"""In-memory cache of loaded provider FAISS indexes.
+
+Reading `faiss.bin` on every query costs disk I/O and deserialisation; the
+cache keeps up to INDEX_CACHE_SIZE indexes (least recently used evicted) and
+reloads an index when its file changes on disk, e.g. after a rebuild.
+
+A sharded provider (see app/shards.py) is identified by `index/shards.json`
+instead of `faiss.bin`; use `index_file` / `get_provider_index` rather than
+hard-coding the file name, and `index_model` for the embedding model of the
+index actually loaded (a migrated index records its own).
+"""
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+from .config import INDEX_CACHE_SIZE, INDEX_MMAP
+from . import metrics
+
+_cache: "OrderedDict[str, tuple]" = OrderedDict()
+_lock = threading.Lock()
+
+
+def read_index(path: Path):
+    """faiss.read_index, mapping the file instead of reading it when INDEX_MMAP is set."""
+    import faiss
+
+    if INDEX_MMAP:
+        return faiss.read_index(str(path), getattr(faiss, 'IO_FLAG_MMAP_IFC', faiss.IO_FLAG_MMAP))
+    return faiss.read_index(str(path))
+
+
+def get_faiss_index(idx_path: Path):
+    """Return the FAISS index stored at `idx_path`, loading it on first use or after a change."""
+    key = str(idx_path)
+    mtime = os.stat(key).st_mtime_ns
+    with _lock:
+        hit = _cache.get(key)
+        if hit is not None and hit[0] == mtime:
+            _cache.move_to_end(key)
+            metrics.cache_event('faiss_index', True)
+            return hit[1]
+    metrics.cache_event('faiss_index', False)
+    index = read_index(idx_path)
+    with _lock:
+        _cache[key] = (mtime, index)
+        _cache.move_to_end(key)
+        while len(_cache) > max(1, INDEX_CACHE_SIZE):
+            _cache.popitem(last=False)
+    return index
+
+
+def cached_indexes() -> list:
+    with _lock:
+        return list(_cache.keys())
+
+
+def index_file(index_dir: Path) -> Path:
+    """The file identifying a provider's dense index: the shard manifest when sharded, else faiss.bin."""
+    from .shards import MANIFEST
+
+    manifest = index_dir / MANIFEST
+    return manifest if manifest.exists() else index_dir / 'faiss.bin'
+
+
+def has_index(index_dir: Path) -> bool:
+    return index_file(index_dir).exists()
+
+
+def index_model(index, pdb) -> str:
+    """Embedding model that produced `index`'s vectors: its manifest's after a migration, else the db's."""
+    from .embeddings import get_default_embedding_model
+
+    return getattr(index, 'embedding_model', None) or pdb.get('embedding_model') or get_default_embedding_model()
+
+
+def provider_model(pdb, index_dir: Path) -> str:
+    """`index_model` of the provider's current index (the db's model when it has none yet)."""
+    try:
+        index = get_provider_index(index_dir)
+    except (OSError, RuntimeError):
+        index = None
+    return index_model(index, pdb)
+
+
+def get_provider_index(index_dir: Path):
+    """Return the provider's dense index (a FAISS index, or a ShardedIndex searching its shards)."""
+    path = index_file(index_dir)
+    if path.name == 'faiss.bin':
+        return get_faiss_index(path)
+
+    from .shards import ShardedIndex, read_manifest
+
+    key = str(path)
+    mtime = os.stat(key).st_mtime_ns
+    with _lock:
+        hit = _cache.get(key)
+        if hit is not None and hit[0] == mtime:
+            _cache.move_to_end(key)
+            metrics.cache_event('faiss_index', True)
+            return hit[1]
+    metrics.cache_event('faiss_index', False)
+    manifest = read_manifest(index_dir)
+    if manifest is None:
+        raise FileNotFoundError(f'unreadable shard manifest {path}')
+    # shard files that did not change since the cached build are reused
+    index = ShardedIndex(index_dir, manifest, previous=hit[1] if hit is not None else None)
+    with _lock:
+        _cache[key] = (mtime, index)
+        _cache.move_to_end(key)
+        while len(_cache) > max(1, INDEX_CACHE_SIZE):
+            _cache.popitem(last=False)
+    return index
@@ -0,0 +1,164 @@
+"""Provider-local retrieval shared by the API and the terminal chat.
+
+Three modes:
+  - 'dense':   embed the question and search the FAISS index (default)
+  - 'lexical': BM25 over the compact inverted index; no embedding model needed
+  - 'hybrid':  both, fused with reciprocal rank fusion
+"""
+import os
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from .embeddings import default_embedding_provider, get_default_embedding_model
+from .lexical import LexicalIndex
+from .chunk_meta import FaissFilter, load_chunk_meta, provenance
+from . import metrics
+from .provider_store import get_provider_index, index_file, index_model
+
+RETRIEVAL_MODES = ('dense', 'lexical', 'hybrid')
+RRF_K = 60
+
+_lexical_cache: Dict[str, Tuple[int, LexicalIndex]] = {}
+_lexical_lock = threading.Lock()
+
+
+class RetrievalError(Exception):
+    """Retrieval could not run; `status_code` says whose fault it is (400 data, 500 server)."""
+
+    def __init__(self, detail: str, status_code: int = 400):
+        super().__init__(detail)
+        self.detail = detail
+        self.status_code = status_code
+
+
+def load_lexical_index(path: Path) -> Optional[LexicalIndex]:
+    """Return the provider's lexical index (cached until the file changes), or None if missing."""
+    key = str(path)
+    try:
+        mtime = os.stat(key).st_mtime_ns
+    except OSError:
+        return None
+    with _lexical_lock:
+        hit = _lexical_cache.get(key)
+        if hit is not None and hit[0] == mtime:
+            metrics.cache_event('lexical_index', True)
+            return hit[1]
+    metrics.cache_event('lexical_index', False)
+    lex = LexicalIndex.load(path)
+    with _lexical_lock:
+        _lexical_cache[key] = (mtime, lex)
+    return lex
+
+
+def fetch_chunks(pdb, keys: List[str]) -> Dict[str, dict]:
+    """Read several chunk records with one SQL query instead of one lookup per key."""
+    if not keys:
+        return {}
+    encode = getattr(pdb, 'encode_key', lambda k: k)
+    placeholders = ','.join('?' * len(keys))
+    rows = pdb.conn.select(f'SELECT key, value FROM "{pdb.tablename}" WHERE key IN ({placeholders})',
+                           tuple(encode(k) for k in keys))
+    decode_key = getattr(pdb, 'decode_key', lambda k: k)
+    return {decode_key(k): pdb.decode(v) for k, v in rows}
+
+
+def rrf_fuse(rankings: List[List[Tuple[int, float]]], k: int, c: int = RRF_K) -> List[Tuple[int, float]]:
+    """Reciprocal rank fusion: score(id) = sum over rankings of 1 / (c + rank)."""
+    fused = {}
+    for ranking in rankings:
+        for rank, (doc_id, _) in enumerate(ranking):
+            fused[doc_id] = fused.get(doc_id, 0.0) + 1.0 / (c + rank + 1)
+    return sorted(fused.items(), key=lambda t: -t[1])[:k]
+
+
+def retrieve(pdb, dirs: Dict[str, Path], question: str, top_k: int, retrieval: str = 'dense',
+             provider: str | None = None, qvec=None, filters: Optional[dict] = None,
+             qvec_model: Optional[str] = None):
+    """Return (hits, qvec, model_key) for a question against one provider.
+
+    `pdb` is the provider's open SqliteDict. `qvec` is None when the question
+    was not embedded (lexical mode). Hits carry key, text, offsets and score;
+    scores are L2 distances (dense), BM25 (lexical) or RRF (hybrid).
+    `provider` labels the stage metrics (defaults to the provider directory name).
+    Pass `qvec` when the question was already embedded with the provider's model
+    (`qvec_model`); it is recomputed if the index switched models meanwhile.
+    `filters` (keyword arguments of ChunkMeta.mask) restrict the search to
+    matching chunks inside FAISS / BM25.
+    """
+    if retrieval not in RETRIEVAL_MODES:
+        raise RetrievalError(f'unknown retrieval mode {retrieval!r}; expected one of {RETRIEVAL_MODES}')
+    stages = metrics.StageTimer(metrics.QUERY_STAGE_SECONDS, provider=provider or dirs['root'].name)
+    vector_keys = pdb.get('vector_keys', [])
+    # determine embedding model recorded at index time (or use default)
+    model_key = pdb.get('embedding_model') or get_default_embedding_model()
+    rankings = []
+    if retrieval == 'lexical':
+        qvec = None
+
+    mask = None
+    if filters:
+        meta = load_chunk_meta(dirs['index'] / 'chunk_meta.npz')
+        if meta is None or meta.n_chunks != len(vector_keys):
+            raise RetrievalError('Provider index has no chunk metadata for filtering. Please rebuild the provider index.')
+        mask = meta.mask(**filters)
+        stages.mark('filter')
+        if mask is not None and not mask.any():
+            return [], qvec, model_key
+
+    if retrieval in ('dense', 'hybrid'):
+        idx_path = index_file(dirs['index'])
+        if not idx_path.exists():
+            raise RetrievalError(f'Provider data incomplete; index file missing: {idx_path}. Please rebuild the provider index.')
+        # load faiss index, or all shards of a sharded one (cached in memory until the files change)
+        index = get_provider_index(dirs['index'])
+        # Validate index integrity
+        if index.ntotal == 0:
+            raise RetrievalError('Provider index is empty. Please rebuild the provider index.')
+        if vector_keys and len(vector_keys) != index.ntotal:
+            raise RetrievalError(f'Provider index and DB are out of sync (index count={index.ntotal}, db vectors={len(vector_keys)}). Please rebuild the provider index.')
+        stages.mark('index_load')
+        model_key = index_model(index, pdb)
+        if qvec is not None and qvec_model is not None and qvec_model != model_key:
+            qvec = None  # embedding model migration switched in between
+        if qvec is None:
+            try:
+                # (1, dim) float32 view; FAISS searches it without copying
+                qvec = default_embedding_provider.embed_texts_with_model(model_key, [question])
+            except Exception as e:
+                # If preferred provider is not available, surface error rather than silently using a different model
+                raise RetrievalError(f'Embedding provider error for model {model_key}: {e}', status_code=500)
+            stages.mark('embed')
+        if mask is None:
+            D, I = index.search(qvec, max(1, min(top_k, index.ntotal)))
+        else:
+            sel = FaissFilter(mask)
+            D, I = index.search(qvec, max(1, min(top_k, sel.count)), params=sel.params)
+        rankings.append([(int(i), float(d)) for d, i in zip(D[0], I[0]) if i >= 0])
+        stages.mark('search')
+
+    if retrieval in ('lexical', 'hybrid'):
+        lex = load_lexical_index(dirs['index'] / 'lexical.npz')
+        if lex is None:
+            raise RetrievalError('Provider lexical index missing. Please rebuild the provider index.')
+        stages.mark('lexical_index_load')
+        rankings.append(lex.search(question, top_k, mask=mask))
+        stages.mark('lexical_search')
+
+    ranked = rankings[0] if len(rankings) == 1 else rrf_fuse(rankings, top_k)
+    ranked = [(vector_keys[idx], score) for idx, score in ranked if idx < len(vector_keys)]
+    chunks = fetch_chunks(pdb, [key for key, _ in ranked])
+    hits = []
+    for key, score in ranked:
+        chunk = chunks.get(key)
+        if chunk:
+            hits.append({
+                'key': key,
+                'text': chunk['text'],
+                'start': chunk.get('start'),
+                'end': chunk.get('end'),
+                'score': score,
+                'provenance': provenance(chunk),
+            })
+    stages.mark('chunk_fetch')
+    return hits, qvec, model_key
@@ -0,0 +1,192 @@
+"""Per-provider semantic answer cache.
+
+Paraphrases ("what services do you offer" / "which services are provided")
+miss an exact-match cache but land close together in embedding space. Each
+provider gets a small in-memory FAISS inner-product index over the normalised
+embeddings of questions it has answered, next to the grounded answer and
+sources. A new question whose nearest cached question scores at least
+SEMANTIC_CACHE_THRESHOLD (cosine), with the same retrieval/answer options and
+against the same index build, is answered from the cache without retrieval or
+the LLM.
+
+Entries are tied to the build they were answered from (the index file mtime):
+after a rebuild the provider's cache starts empty. Each provider keeps at most
+SEMANTIC_CACHE_MAX_ENTRIES entries (least recently used evicted) and at most
+SEMANTIC_CACHE_MAX_PROVIDERS providers are cached.
+
+A hit could be a false hit: a similar-looking question that needs different
+evidence. A SEMANTIC_CACHE_VERIFY_RATE fraction of hits is re-checked after
+the response by running retrieval for the new question; if the cached sources
+overlap the fresh ones less than SEMANTIC_CACHE_VERIFY_MIN_OVERLAP the entry
+is dropped and the false hit counted (rag_semantic_cache_checks).
+
+State is per worker process.
+"""
+import logging
+import os
+import random
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from .config import (
+    SEMANTIC_CACHE_ENABLED,
+    SEMANTIC_CACHE_THRESHOLD,
+    SEMANTIC_CACHE_MAX_ENTRIES,
+    SEMANTIC_CACHE_MAX_PROVIDERS,
+    SEMANTIC_CACHE_VERIFY_RATE,
+    SEMANTIC_CACHE_VERIFY_MIN_OVERLAP,
+)
+from . import metrics
+from .provider_store import index_file
+
+logger = logging.getLogger(__name__)
+
+# nearest cached questions inspected per lookup (entries with other options are skipped)
+_SEARCH_K = 4
+
+
+def build_version(dirs: Dict[str, Path]) -> Optional[int]:
+    """Identify the provider's current index build; None when there is no dense index."""
+    try:
+        return os.stat(index_file(dirs['index'])).st_mtime_ns
+    except OSError:
+        return None
+
+
+def _normalise(qvec) -> np.ndarray:
+    v = np.ascontiguousarray(np.asarray(qvec, dtype=np.float32).reshape(1, -1))
+    norm = float(np.linalg.norm(v))
+    return v / norm if norm > 0 else v
+
+
+class _ProviderCache:
+    def __init__(self, version: int, model_key: str, dim: int):
+        import faiss
+
+        self.version = version
+        self.model_key = model_key
+        self.dim = dim
+        self.index = faiss.IndexIDMap2(faiss.IndexFlatIP(dim))
+        self.entries: "OrderedDict[int, dict]" = OrderedDict()
+        self.next_id = 0
+
+
+class SemanticCache:
+    def __init__(self, threshold: float, max_entries: int, max_providers: int):
+        self.threshold = threshold
+        self.max_entries = max(1, max_entries)
+        self.max_providers = max(1, max_providers)
+        self._providers: "OrderedDict[str, _ProviderCache]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get(self, provider: str, version, model_key: str, dim: int, create: bool) -> Optional[_ProviderCache]:
+        # caller holds self._lock
+        pc = self._providers.get(provider)
+        if pc is not None and (pc.version != version or pc.model_key != model_key or pc.dim != dim):
+            # rebuilt or re-embedded since these answers were cached
+            del self._providers[provider]
+            pc = None
+        if pc is None and create:
+            pc = self._providers[provider] = _ProviderCache(version, model_key, dim)
+            while len(self._providers) > self.max_providers:
+                self._providers.popitem(last=False)
+        if pc is not None:
+            self._providers.move_to_end(provider)
+        return pc
+
+    def lookup(self, provider: str, version, model_key: str, qvec, options: tuple) -> Optional[dict]:
+        """Return the cached entry (with its `similarity`) for a near-duplicate question, else None."""
+        q = _normalise(qvec)
+        with self._lock:
+            pc = self._get(provider, version, model_key, q.shape[1], create=False)
+            if pc is None or not pc.entries:
+                metrics.cache_event('semantic_answer', False)
+                return None
+            D, I = pc.index.search(q, min(_SEARCH_K, len(pc.entries)))
+            for score, entry_id in zip(D[0], I[0]):
+                if score < self.threshold:
+                    break
+                entry = pc.entries.get(int(entry_id))
+                if entry is not None and entry['options'] == options:
+                    pc.entries.move_to_end(int(entry_id))
+                    entry['hits'] += 1
+                    metrics.cache_event('semantic_answer', True)
+                    return dict(entry, id=int(entry_id), similarity=float(score))
+        metrics.cache_event('semantic_answer', False)
+        return None
+
+    def store(self, provider: str, version, model_key: str, qvec, options: tuple,
+              question: str, answer: str, sources: List[str], mode: str, provenance: list = ()) -> None:
+        if version is None:
+            return
+        q = _normalise(qvec)
+        with self._lock:
+            pc = self._get(provider, version, model_key, q.shape[1], create=True)
+            entry_id = pc.next_id
+            pc.next_id += 1
+            pc.index.add_with_ids(q, np.array([entry_id], dtype=np.int64))
+            pc.entries[entry_id] = {'question': question, 'answer': answer, 'sources': list(sources),
+                                    'provenance': list(provenance), 'mode': mode, 'options': options, 'hits': 0}
+            while len(pc.entries) > self.max_entries:
+                old_id, _ = pc.entries.popitem(last=False)
+                pc.index.remove_ids(np.array([old_id], dtype=np.int64))
+
+    def discard(self, provider: str, version, entry_id: int) -> None:
+        with self._lock:
+            pc = self._providers.get(provider)
+            if pc is not None and pc.version == version and pc.entries.pop(entry_id, None) is not None:
+                pc.index.remove_ids(np.array([entry_id], dtype=np.int64))
+
+    def clear(self, provider: str | None = None) -> None:
+        with self._lock:
+            if provider is None:
+                self._providers.clear()
+            else:
+                self._providers.pop(provider, None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {p: len(pc.entries) for p, pc in self._providers.items()}
+
+
+cache = SemanticCache(SEMANTIC_CACHE_THRESHOLD, SEMANTIC_CACHE_MAX_ENTRIES, SEMANTIC_CACHE_MAX_PROVIDERS)
+
+
+def enabled_for(retrieval: str) -> bool:
+    # lexical queries never embed the question, so there is nothing to compare
+    return SEMANTIC_CACHE_ENABLED and retrieval in ('dense', 'hybrid')
+
+
+def should_verify() -> bool:
+    return SEMANTIC_CACHE_VERIFY_RATE > 0 and random.random() < SEMANTIC_CACHE_VERIFY_RATE
+
+
+def verify_hit(provider: str, dirs: Dict[str, Path], version, entry: dict, question: str,
+               top_k: int, retrieval: str, filters: Optional[dict] = None) -> None:
+    """Re-run retrieval for a question answered from the cache and drop the entry on a false hit.
+
+    Runs after the response has been sent; failures are logged, never raised.
+    """
+    from sqlitedict import SqliteDict
+    from .retrieval import retrieve
+
+    try:
+        with SqliteDict(str(dirs['db'] / 'metadata.sqlite'), flag='r') as pdb:
+            hits, _, _ = retrieve(pdb, dirs, question, top_k, retrieval, provider=provider, filters=filters)
+    except Exception as e:
+        logger.warning('semantic cache check failed for provider=%s: %s', provider, e)
+        return
+    cached = set(entry['sources'])
+    fresh = {h['key'] for h in hits}
+    overlap = len(cached & fresh) / len(cached | fresh) if cached | fresh else 1.0
+    if overlap < SEMANTIC_CACHE_VERIFY_MIN_OVERLAP:
+        metrics.SEMANTIC_CACHE_CHECKS.labels(result='false_hit').inc()
+        cache.discard(provider, version, entry['id'])
+        logger.info('semantic cache false hit provider=%s similarity=%.3f overlap=%.2f: %r ~ %r',
+                    provider, entry['similarity'], overlap, question, entry['question'])
+    else:
+        metrics.SEMANTIC_CACHE_CHECKS.labels(result='ok').inc()
@@ -0,0 +1,231 @@
+"""Sharded provider indexes.
+
+A very large provider can split its vectors over N FAISS shards instead of
+one `faiss.bin`. Each shard is an IndexIDMap2 over an IndexFlatL2 holding a
+subset of the chunk ids (global ids, so vector_keys, chunk metadata filters
+and the lexical index keep working unchanged), stored as
+`index/shards/shard_<j>.faiss`. `index/shards.json` lists the shards and is
+written last, so its presence and mtime identify the current build.
+
+Partitioning:
+  - 'document': whole documents are assigned to the least loaded shard
+    (largest first), so a document filter usually touches one shard
+  - 'hash':     chunks are spread by a hash of their key, for even shards
+
+A query searches every shard on a thread pool (FAISS releases the GIL) and
+merges the per-shard top-k by distance. `rebuild_shard` re-embeds and
+rewrites a single shard without touching the others; readers reload only the
+shard files that changed.
+
+An embedding-model migration (app/migration.py) switches a provider by
+writing a new generation of shard files next to the live ones and then a
+manifest recording the new `embedding_model`: readers pick up the model and
+the vectors from the same file, so they switch together.
+"""
+import hashlib
+import json
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import List, Optional
+
+import numpy as np
+
+from .config import SHARD_SEARCH_THREADS
+
+logger = logging.getLogger(__name__)
+
+MANIFEST = 'shards.json'
+SHARD_DIR = 'shards'
+PARTITIONS = ('document', 'hash')
+FORMAT_VERSION = 1
+
+_pool = None
+
+
+def _search_pool() -> ThreadPoolExecutor:
+    global _pool
+    if _pool is None:
+        _pool = ThreadPoolExecutor(max_workers=max(1, SHARD_SEARCH_THREADS), thread_name_prefix='shard')
+    return _pool
+
+
+def partition(n_vectors: int, n_shards: int, by: str = 'document',
+              documents: Optional[List[dict]] = None, vector_keys: Optional[List[str]] = None) -> List[np.ndarray]:
+    """Split chunk ids 0..n_vectors-1 into `n_shards` id arrays.
+
+    'document' needs `documents` ({first_chunk, end_chunk} ranges, see the
+    pipeline); 'hash' hashes `vector_keys` (or the ids themselves).
+    """
+    if by not in PARTITIONS:
+        raise ValueError(f'unknown shard partitioning {by!r}; expected one of {PARTITIONS}')
+    n_shards = max(1, min(n_shards, n_vectors))
+    if by == 'document' and documents:
+        loads = [0] * n_shards
+        assigned = [[] for _ in range(n_shards)]
+        ranges = sorted(((d['first_chunk'], min(d['end_chunk'], n_vectors)) for d in documents),
+                        key=lambda r: r[0] - r[1])
+        for lo, hi in ranges:
+            if hi <= lo:
+                continue
+            j = loads.index(min(loads))
+            assigned[j].append(np.arange(lo, hi, dtype='int64'))
+            loads[j] += hi - lo
+        return [np.sort(np.concatenate(a)) if a else np.empty(0, dtype='int64') for a in assigned]
+    keys = vector_keys if vector_keys is not None else [str(i) for i in range(n_vectors)]
+    bucket = np.fromiter((int.from_bytes(hashlib.blake2b(k.encode('utf-8'), digest_size=4).digest(), 'little')
+                          % n_shards for k in keys[:n_vectors]), dtype='int64', count=n_vectors)
+    return [np.flatnonzero(bucket == j).astype('int64') for j in range(n_shards)]
+
+
+def _shard_file(j: int, generation: int = 0) -> str:
+    suffix = f'.g{generation}' if generation else ''
+    return f'{SHARD_DIR}/shard_{j:03d}{suffix}.faiss'
+
+
+def _write_shard(index_dir: Path, j: int, dim: int, vectors: np.ndarray, ids: np.ndarray,
+                 generation: int = 0) -> dict:
+    """Write shard `j` holding `vectors` (row i is chunk id ids[i])."""
+    import faiss
+
+    index = faiss.IndexIDMap2(faiss.IndexFlatL2(dim))
+    if len(ids):
+        index.add_with_ids(np.ascontiguousarray(vectors, dtype='float32'), ids)
+    path = index_dir / _shard_file(j, generation)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.name + '.tmp')
+    faiss.write_index(index, str(tmp))
+    tmp.replace(path)
+    return {'file': _shard_file(j, generation), 'count': int(len(ids))}
+
+
+def read_manifest(index_dir: Path) -> Optional[dict]:
+    try:
+        return json.loads((index_dir / MANIFEST).read_text(encoding='utf-8'))
+    except (OSError, ValueError):
+        return None
+
+
+def _write_manifest(index_dir: Path, manifest: dict):
+    tmp = index_dir / (MANIFEST + '.tmp')
+    tmp.write_text(json.dumps(manifest, indent=2), encoding='utf-8')
+    tmp.replace(index_dir / MANIFEST)
+
+
+def write_shards(index_dir: Path, vectors: np.ndarray, parts: List[np.ndarray], by: str,
+                 embedding_model: Optional[str] = None, generation: int = 0) -> dict:
+    """Write one shard per id array, then the manifest; drops shard files of earlier builds.
+
+    `embedding_model` is recorded in the manifest (it then takes precedence
+    over the provider db); `generation` > 0 names the files apart from the
+    live ones so they can be written while the current shards serve.
+    """
+    dim = vectors.shape[1]
+    shards = [_write_shard(index_dir, j, dim, vectors[ids], ids, generation) for j, ids in enumerate(parts)]
+    manifest = {'version': FORMAT_VERSION, 'by': by, 'dim': int(vectors.shape[1]),
+                'ntotal': int(len(vectors)), 'shards': shards}
+    if embedding_model:
+        manifest.update(embedding_model=embedding_model, generation=generation)
+    _write_manifest(index_dir, manifest)
+    keep = {s['file'] for s in shards}
+    for old in (index_dir / SHARD_DIR).glob('shard_*.faiss'):
+        if f'{SHARD_DIR}/{old.name}' not in keep:
+            old.unlink()
+    return manifest
+
+
+def remove_shards(index_dir: Path):
+    """Drop a previous sharded build (after an unsharded rebuild has written faiss.bin)."""
+    (index_dir / MANIFEST).unlink(missing_ok=True)
+    for old in (index_dir / SHARD_DIR).glob('shard_*.faiss') if (index_dir / SHARD_DIR).exists() else []:
+        old.unlink()
+
+
+def rebuild_shard(index_dir: Path, pdb, shard: int, embed) -> dict:
+    """Re-embed the chunks of one shard and rewrite only that shard file.
+
+    `embed(model_key, texts) -> (n, dim) float32` embeds with the model
+    recorded for the provider; vectors.npy is updated in place when present.
+    """
+    import faiss
+
+    manifest = read_manifest(index_dir)
+    if manifest is None:
+        raise ValueError('provider index is not sharded')
+    if not 0 <= shard < len(manifest['shards']):
+        raise ValueError(f'shard {shard} out of range (0..{len(manifest["shards"]) - 1})')
+    old = faiss.read_index(str(index_dir / manifest['shards'][shard]['file']))
+    ids = faiss.vector_to_array(old.id_map).astype('int64')
+    vector_keys = pdb.get('vector_keys', [])
+    texts = [pdb[vector_keys[i]]['text'] for i in ids]
+    model_key = manifest.get('embedding_model') or pdb.get('embedding_model')
+    vectors = embed(model_key, texts) if texts else np.empty((0, manifest['dim']), 'float32')
+    if len(texts) and vectors.shape[1] != manifest['dim']:
+        raise ValueError(f'embedding dimension {vectors.shape[1]} does not match the other shards ({manifest["dim"]})')
+    manifest['shards'][shard] = _write_shard(index_dir, shard, manifest['dim'], vectors, ids,
+                                             manifest.get('generation', 0))
+    vectors_path = index_dir / 'vectors.npy'
+    if vectors_path.exists() and len(ids):
+        stored = np.load(vectors_path, mmap_mode='r+')
+        stored[ids] = vectors
+        stored.flush()
+        del stored
+    _write_manifest(index_dir, manifest)
+    logger.info('rebuilt shard %d (%d vectors) in %s', shard, len(ids), index_dir)
+    return manifest['shards'][shard]
+
+
+class ShardedIndex:
+    """Looks like a FAISS index to retrieval: `ntotal`, `d` and `search(q, k, params=None)`."""
+
+    def __init__(self, index_dir: Path, manifest: dict, previous: Optional['ShardedIndex'] = None):
+        from .provider_store import read_index
+
+        self.manifest = manifest
+        self.d = int(manifest['dim'])
+        # set by a model migration; else the provider db records the model
+        self.embedding_model = manifest.get('embedding_model')
+        self.shards = []
+        self.versions = []
+        reuse = dict(zip(previous.files, zip(previous.versions, previous.shards))) if previous else {}
+        self.files = [s['file'] for s in manifest['shards']]
+        for name in self.files:
+            path = index_dir / name
+            mtime = os.stat(path).st_mtime_ns
+            hit = reuse.get(name)
+            # shards untouched by a single-shard rebuild are reused, not reread
+            index = hit[1] if hit is not None and hit[0] == mtime else read_index(path)
+            self.shards.append(index)
+            self.versions.append(mtime)
+        self.ntotal = sum(s.ntotal for s in self.shards)
+
+    def _search_shard(self, shard, q, k, params):
+        if shard.ntotal == 0:
+            return None
+        if params is None:
+            return shard.search(q, min(k, shard.ntotal))
+        return shard.search(q, min(k, shard.ntotal), params=params)
+
+    def search(self, q: np.ndarray, k: int, params=None):
+        if len(self.shards) == 1:
+            # e.g. a migrated flat index; results already come back merged
+            shard = self.shards[0]
+            if shard.ntotal:
+                return shard.search(q, k) if params is None else shard.search(q, k, params=params)
+        futures = [_search_pool().submit(self._search_shard, s, q, k, params) for s in self.shards]
+        parts = [f.result() for f in futures]
+        parts = [p for p in parts if p is not None]
+        D_out = np.full((q.shape[0], k), np.float32(np.inf), dtype='float32')
+        I_out = np.full((q.shape[0], k), -1, dtype='int64')
+        if not parts:
+            return D_out, I_out
+        D = np.concatenate([p[0] for p in parts], axis=1)
+        I = np.concatenate([p[1] for p in parts], axis=1)
+        D = np.where(I < 0, np.inf, D)
+        for row in range(q.shape[0]):
+            order = np.argsort(D[row], kind='stable')[:k]
+            order = order[I[row, order] >= 0]
+            D_out[row, :len(order)] = D[row, order]
+            I_out[row, :len(order)] = I[row, order]
+        return D_out, I_out
@@ -0,0 +1,63 @@
+"""Token counting for prompt budgeting.
+
+Uses `tiktoken` with the encoding of the configured LLM model when it is
+installed (and its encoding files are available). Otherwise falls back to a
+regex approximation (words and punctuation) so budgets still apply offline.
+"""
+import re
+import logging
+import threading
+
+from .config import LLM_MODEL
+
+logger = logging.getLogger(__name__)
+
+_TOKEN_RE = re.compile(r"\w+|[^\w\s]")
+
+_encoding = None
+_encoding_loaded = False
+_lock = threading.Lock()
+
+
+def _get_encoding():
+    global _encoding, _encoding_loaded
+    if _encoding_loaded:
+        return _encoding
+    with _lock:
+        if not _encoding_loaded:
+            try:
+                import tiktoken
+
+                try:
+                    _encoding = tiktoken.encoding_for_model(LLM_MODEL)
+                except KeyError:
+                    _encoding = tiktoken.get_encoding('cl100k_base')
+            except Exception as e:
+                logger.warning('tiktoken unavailable (%s); using approximate token counts', e)
+                _encoding = None
+            _encoding_loaded = True
+    return _encoding
+
+
+def count_tokens(text: str) -> int:
+    enc = _get_encoding()
+    if enc is not None:
+        return len(enc.encode(text, disallowed_special=()))
+    return len(_TOKEN_RE.findall(text))
+
+
+def truncate_tokens(text: str, max_tokens: int) -> str:
+    """Return the longest prefix of `text` that fits in `max_tokens`."""
+    if max_tokens <= 0:
+        return ''
+    enc = _get_encoding()
+    if enc is not None:
+        ids = enc.encode(text, disallowed_special=())
+        if len(ids) <= max_tokens:
+            return text
+        return enc.decode(ids[:max_tokens])
+    matches = list(_TOKEN_RE.finditer(text))
+    if len(matches) <= max_tokens:
+        return text
+    return text[:matches[max_tokens - 1].end()]
+
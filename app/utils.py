@@ -2,9 +2,9 @@ import json
 from pathlib import Path
 from typing import Dict, Any
 
-def ensure_provider_dirs(base: Path, provider: str) -> Dict[str, Path]:
+def provider_dirs(base: Path, provider: str) -> Dict[str, Path]:
     p = base / provider
-    dirs = {
+    return {
         'root': p,
         'excel': p / 'excel',
         'docs': p / 'docs',
@@ -13,6 +13,9 @@ def ensure_provider_dirs(base: Path, provider: str) -> Dict[str, Path]:
         'db': p / 'db',
         'index': p / 'index',
     }
+
+def ensure_provider_dirs(base: Path, provider: str) -> Dict[str, Path]:
+    dirs = provider_dirs(base, provider)
     for d in dirs.values():
         d.mkdir(parents=True, exist_ok=True)
     return dirs
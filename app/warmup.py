@@ -0,0 +1,120 @@
+"""Startup warmup: load models and hot provider indexes before serving.
+
+The first query against a cold process otherwise pays for loading the
+embedding model and reading the provider's FAISS index. `warmup()` does that
+work up front; the API runs it in a background thread at startup and
+`/v1/ready` reports ready only once it has finished, so a readiness probe
+keeps traffic away until then.
+"""
+import logging
+import threading
+import time
+from typing import List, Optional
+
+from .config import PROVIDERS_DIR, WARMUP_MODELS, WARMUP_PROVIDERS, WARMUP_TOP_N
+from .provider_store import has_index
+
+logger = logging.getLogger(__name__)
+
+_state = {'ready': False, 'started_at': None, 'finished_at': None, 'seconds': None,
+          'models': [], 'providers': [], 'errors': []}
+_lock = threading.Lock()
+
+
+def pick_providers(top_n: int = WARMUP_TOP_N) -> List[str]:
+    """Providers to warm: WARMUP_PROVIDERS if set, else the top-N by assigned clients."""
+    if WARMUP_PROVIDERS:
+        return list(WARMUP_PROVIDERS)
+    built = [p.name for p in sorted(PROVIDERS_DIR.iterdir())
+             if p.is_dir() and not p.name.startswith('.') and has_index(p / 'index')] if PROVIDERS_DIR.exists() else []
+    try:
+        from .app_db import count_clients_by_provider
+
+        counts = count_clients_by_provider()
+    except Exception:
+        logger.exception('could not count clients per provider; warming by name order')
+        counts = {}
+    built.sort(key=lambda p: -counts.get(p, 0))
+    return built[:max(0, top_n)]
+
+
+def warm_provider(provider: str) -> Optional[str]:
+    """Load a provider's indexes and metadata into the in-process caches; return its model key."""
+    from sqlitedict import SqliteDict
+    from .metadata_answer import get_provider_metadata
+    from .provider_store import get_provider_index, index_model
+    from .retrieval import load_lexical_index
+
+    root = PROVIDERS_DIR / provider
+    db_path = root / 'db' / 'metadata.sqlite'
+    if not db_path.exists():
+        return None
+    get_provider_metadata(db_path)
+    load_lexical_index(root / 'index' / 'lexical.npz')
+    index = get_provider_index(root / 'index') if has_index(root / 'index') else None
+    with SqliteDict(str(db_path), flag='r') as pdb:
+        return index_model(index, pdb) if index is not None else pdb.get('embedding_model')
+
+
+def warmup(models: Optional[List[str]] = None, providers: Optional[List[str]] = None) -> dict:
+    """Load the given (or configured) models and provider indexes; mark the process ready."""
+    from .embeddings import default_embedding_provider
+
+    start = time.perf_counter()
+    with _lock:
+        _state.update(ready=False, started_at=time.time())
+    errors = []
+    providers = pick_providers() if providers is None else providers
+    model_keys = list(WARMUP_MODELS if models is None else models)
+
+    warmed = []
+    for provider in providers:
+        try:
+            model_key = warm_provider(provider)
+            warmed.append(provider)
+            if model_key and model_key not in model_keys:
+                model_keys.append(model_key)
+        except Exception as e:
+            logger.exception('warmup failed for provider %s', provider)
+            errors.append(f'provider {provider}: {e}')
+
+    loaded = []
+    for key in model_keys:
+        try:
+            # one tiny encode loads the weights and runs the first forward pass
+            default_embedding_provider.embed_texts_with_model(key, ['warmup'])
+            loaded.append(key)
+        except Exception as e:
+            logger.exception('warmup failed for model %s', key)
+            errors.append(f'model {key}: {e}')
+
+    try:
+        # the prompt tokenizer loads its encoding lazily on first use
+        from .tokenizer import count_tokens
+
+        count_tokens('warmup')
+    except Exception as e:
+        errors.append(f'tokenizer: {e}')
+
+    elapsed = time.perf_counter() - start
+    with _lock:
+        _state.update(ready=True, finished_at=time.time(), seconds=round(elapsed, 3),
+                      models=loaded, providers=warmed, errors=errors)
+    logger.info('warmup finished in %.2fs: models=%s providers=%s', elapsed, loaded, warmed)
+    return dict(_state)
+
+
+def start_background_warmup() -> threading.Thread:
+    t = threading.Thread(target=warmup, name='warmup', daemon=True)
+    t.start()
+    return t
+
+
+def mark_ready():
+    with _lock:
+        _state.update(ready=True, finished_at=time.time())
+
+
+def status() -> dict:
+    with _lock:
+        return dict(_state)
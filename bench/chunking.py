@@ -0,0 +1,140 @@
+r"""
+Chunkers compared: chunk counts, build time, embedded tokens and retrieval recall.
+
+Generates one synthetic provider (bench/synth.py) and builds it once per
+`--configs` entry (`chunker:size:overlap`, sizes in the chunker's units, see
+app/chunking.py), in-process with the offline `hash:` embedding backend
+unless `--embedding-model` says otherwise. Near-duplicate removal is off
+(`--dedup`) so only the chunking differs.
+
+Recall: `--questions` sentences are drawn from the documents and asked with
+`--drop` of their words removed; a question is answered when one of the
+top-k retrieved chunks contains the whole sentence. Reported per config:
+recall@k, the tokens of the top-k context handed to the LLM, and query
+latency.
+
+Usage:
+    python bench/chunking.py --docs 40 --doc-kb 16 --formats txt,pdf,docx --json chunking.json
+    python bench/chunking.py --configs chars:800:200,tokens:200:0,tokens:200:40 --retrieval dense
+"""
+import argparse
+import json
+import os
+import random
+import re
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+DEFAULT_CONFIGS = 'chars:800:200,tokens:128:16,tokens:256:32,tokens:512:64'
+
+
+def parse_config(spec: str) -> dict:
+    name, _, rest = spec.partition(':')
+    size, _, overlap = rest.partition(':')
+    conf = {'chunker': name}
+    if size:
+        conf['size'] = int(size)
+    if overlap:
+        conf['overlap'] = int(overlap)
+    return conf
+
+
+def make_questions(text: str, n: int, drop: float, seed: int) -> list:
+    """(question, sentence) pairs: sentences of `text` with a `drop` fraction of their words removed."""
+    rng = random.Random(f'chunking:{seed}')
+    sentences = [s for s in re.split(r'(?<=[.!?])\s+', text) if len(s.split()) >= 6]
+    out = []
+    for sentence in rng.sample(sentences, min(n, len(sentences))):
+        words = sentence.split()
+        keep = sorted(rng.sample(range(len(words)), max(3, int(round(len(words) * (1 - drop))))))
+        out.append((' '.join(words[i] for i in keep), sentence))
+    return out
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--configs', default=DEFAULT_CONFIGS, help='Comma-separated chunker:size:overlap')
+    ap.add_argument('--docs', type=int, default=20)
+    ap.add_argument('--doc-kb', type=float, default=16.0)
+    ap.add_argument('--formats', default='txt,pdf,docx')
+    ap.add_argument('--questions', type=int, default=300)
+    ap.add_argument('--drop', type=float, default=0.3, help='Fraction of words removed from each question')
+    ap.add_argument('--top-k', type=int, default=5)
+    ap.add_argument('--retrieval', default='hybrid', choices=('dense', 'lexical', 'hybrid'))
+    ap.add_argument('--embedding-model', default='hash:384')
+    ap.add_argument('--dedup', type=float, default=0.0)
+    ap.add_argument('--repeat', type=int, default=1, help='Builds per config; the fastest is reported')
+    ap.add_argument('--seed', type=int, default=0)
+    ap.add_argument('--json', default=None)
+    args = ap.parse_args()
+
+    workdir = Path(tempfile.mkdtemp(prefix='rag-chunking-'))
+    os.environ.update({'RAG_DATA_DIR': str(workdir), 'EMBEDDING_MODEL': args.embedding_model,
+                       'WARMUP_ENABLED': '0'})
+    sys.path.insert(0, str(ROOT / 'bench'))
+    from synth import make_provider
+    from sqlitedict import SqliteDict
+    from app.pipeline import build_index_for_provider
+    from app.retrieval import retrieve
+    from app.tokenizer import count_tokens
+    from app.utils import ensure_provider_dirs
+
+    providers_dir = workdir / 'providers'
+    formats = [f.strip() for f in args.formats.split(',') if f.strip()]
+    results = {}
+    try:
+        source = make_provider(providers_dir, 'src', args.docs, args.doc_kb, formats, args.seed)
+        questions = None
+        for spec in [s.strip() for s in args.configs.split(',') if s.strip()]:
+            conf = parse_config(spec)
+            name = re.sub(r'\W', '_', spec)
+            shutil.copytree(source, providers_dir / name)
+            build_s = []
+            for _ in range(max(1, args.repeat)):
+                start = time.perf_counter()
+                report = build_index_for_provider(name, providers_dir, dedup=args.dedup, chunking=conf)
+                build_s.append(time.perf_counter() - start)
+            dirs = ensure_provider_dirs(providers_dir, name)
+            with SqliteDict(str(dirs['db'] / 'metadata.sqlite'), flag='r') as pdb:
+                if questions is None:
+                    # the parsed text is the same for every config
+                    questions = make_questions(pdb['raw_text'], args.questions, args.drop, args.seed)
+                texts = [pdb[k]['text'] for k in pdb['vector_keys']]
+                tokens = [count_tokens(t) for t in texts]
+                found, context, latency = 0, [], []
+                for question, sentence in questions:
+                    start = time.perf_counter()
+                    hits, _, _ = retrieve(pdb, dirs, question, args.top_k, retrieval=args.retrieval, provider=name)
+                    latency.append((time.perf_counter() - start) * 1000)
+                    found += any(sentence in h['text'] for h in hits)
+                    context.append(sum(count_tokens(h['text']) for h in hits))
+            results[spec] = {
+                'chunking': report['chunking'],
+                'chunks': len(texts),
+                'build_s': round(min(build_s), 3),
+                'embedded_tokens': sum(tokens),
+                'chunk_tokens': {'mean': round(statistics.fmean(tokens), 1), 'max': max(tokens)},
+                f'recall@{args.top_k}': round(found / len(questions), 4),
+                'context_tokens': round(statistics.fmean(context), 1),
+                'query_ms': round(statistics.median(latency), 3),
+            }
+            print(f'{spec:20s} {results[spec]}', file=sys.stderr)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    out = {'meta': {'args': vars(args), 'questions': len(questions or [])}, 'configs': results}
+    print(json.dumps(out, indent=2))
+    if args.json:
+        Path(args.json).write_text(json.dumps(out, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+r"""
+Compare two bench/suite.py results and flag regressions.
+
+Timings (anything under `latency_ms`, `stages_ms`, `stages_s` or a `total_s`)
+are lower-is-better; `qps` is higher-is-better. Other numbers (counts,
+arguments) are ignored. Exits 1 when any compared metric got worse by more
+than `--max-regression` percent, so it can gate a change in CI.
+
+Usage:
+    python bench/compare.py before.json after.json --max-regression 10
+"""
+import argparse
+import json
+import sys
+from pathlib import Path
+
+LOWER_IS_BETTER = ('latency_ms', 'stages_ms', 'stages_s', 'total_s')
+HIGHER_IS_BETTER = ('qps',)
+
+
+def flatten(obj, prefix=''):
+    if isinstance(obj, dict):
+        for k, v in obj.items():
+            yield from flatten(v, f'{prefix}.{k}' if prefix else str(k))
+    elif isinstance(obj, (int, float)) and not isinstance(obj, bool):
+        yield prefix, float(obj)
+
+
+def direction(path: str) -> int:
+    """+1 if higher is better, -1 if lower is better, 0 to skip."""
+    if path.startswith(('meta.', 'corpus.')) or '.per_provider' in path:
+        return 0
+    parts = path.split('.')
+    if any(p in HIGHER_IS_BETTER for p in parts):
+        return 1
+    if any(p in LOWER_IS_BETTER for p in parts):
+        return -1
+    return 0
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('before')
+    ap.add_argument('after')
+    ap.add_argument('--max-regression', type=float, default=10.0, help='Percent')
+    ap.add_argument('--min-abs', type=float, default=0.5,
+                    help='Ignore timing changes smaller than this (ms, or s for build stages)')
+    args = ap.parse_args()
+
+    before = dict(flatten(json.loads(Path(args.before).read_text())))
+    after = dict(flatten(json.loads(Path(args.after).read_text())))
+    regressions = []
+    print(f'{"metric":60s} {"before":>12s} {"after":>12s} {"change":>9s}')
+    for path in sorted(set(before) & set(after)):
+        sign = direction(path)
+        if not sign:
+            continue
+        b, a = before[path], after[path]
+        change = (a - b) / b * 100 if b else 0.0
+        worse = -change * sign
+        flag = ''
+        if worse > args.max_regression and (sign > 0 or abs(a - b) >= args.min_abs):
+            flag = '  REGRESSION'
+            regressions.append(path)
+        print(f'{path:60s} {b:12.3f} {a:12.3f} {change:+8.1f}%{flag}')
+    missing = sorted(p for p in set(before) - set(after) if direction(p))
+    if missing:
+        print(f'not in {args.after}: {", ".join(missing)}')
+    if regressions:
+        print(f'{len(regressions)} regression(s) above {args.max_regression}%')
+        sys.exit(1)
+    print('No regressions')
+
+
+if __name__ == '__main__':
+    main()
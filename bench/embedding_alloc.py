@@ -0,0 +1,116 @@
+r"""
+Allocation benchmark for the embedding -> FAISS hand-off.
+
+Compares the old list-of-floats path (model ndarray -> nested Python lists ->
+np.array(...).astype('float32') -> index.add) with the ndarray path (model
+ndarray -> preallocated float32 matrix -> index.add). The model output is
+simulated with a random float32 matrix so the numbers isolate the conversion
+cost from the model itself.
+
+Reports wall time, tracemalloc peak and allocated block count for a rebuild of
+`--chunks` vectors and for `--queries` single-question searches.
+
+Usage:
+    python bench/embedding_alloc.py --chunks 50000 --dim 384 --json out.json
+"""
+import argparse
+import json
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+import faiss
+import numpy as np
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from app.embeddings import _to_matrix
+
+
+def fake_model(n: int, dim: int, rng) -> np.ndarray:
+    return rng.standard_normal((n, dim), dtype=np.float32)
+
+
+def build_lists(batches, dim):
+    vectors = []
+    for embs in batches:
+        vectors.extend(list(map(float, e)) for e in embs.tolist())
+    arr = np.array(vectors).astype('float32')
+    index = faiss.IndexFlatL2(dim)
+    index.add(arr)
+    return index
+
+
+def build_ndarray(batches, dim, total):
+    arr = np.empty((total, dim), dtype=np.float32)
+    pos = 0
+    for embs in batches:
+        _to_matrix(embs, out=arr[pos:pos + len(embs)])
+        pos += len(embs)
+    index = faiss.IndexFlatL2(dim)
+    index.add(arr)
+    return index
+
+
+def query_lists(index, qembs, k):
+    for q in qembs:
+        qemb = [float(x) for x in q.tolist()]
+        index.search(np.array(qemb, dtype='float32').reshape(1, -1), k)
+
+
+def query_ndarray(index, qembs, k):
+    for q in qembs:
+        index.search(_to_matrix(q.reshape(1, -1)), k)
+
+
+def measure(fn, *args):
+    # timed run first: tracemalloc slows allocation-heavy code by an order of magnitude
+    start = time.perf_counter()
+    fn(*args)
+    elapsed = time.perf_counter() - start
+    tracemalloc.start()
+    result = fn(*args)
+    snapshot = tracemalloc.take_snapshot()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    blocks = sum(stat.count for stat in snapshot.statistics('filename'))
+    return result, {'seconds': round(elapsed, 4), 'peak_mb': round(peak / 2**20, 2), 'live_blocks': blocks}
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--chunks', type=int, default=20000)
+    ap.add_argument('--dim', type=int, default=384)
+    ap.add_argument('--batch', type=int, default=1024)
+    ap.add_argument('--queries', type=int, default=2000)
+    ap.add_argument('--k', type=int, default=5)
+    ap.add_argument('--json', default=None)
+    args = ap.parse_args()
+
+    rng = np.random.default_rng(0)
+    batches = [fake_model(min(args.batch, args.chunks - s), args.dim, rng) for s in range(0, args.chunks, args.batch)]
+    qembs = fake_model(args.queries, args.dim, rng)
+
+    index, build_before = measure(build_lists, batches, args.dim)
+    del index
+    index, build_after = measure(build_ndarray, batches, args.dim, args.chunks)
+    _, query_before = measure(query_lists, index, qembs, args.k)
+    _, query_after = measure(query_ndarray, index, qembs, args.k)
+
+    result = {
+        'chunks': args.chunks,
+        'dim': args.dim,
+        'queries': args.queries,
+        'build': {'lists': build_before, 'ndarray': build_after},
+        'query': {'lists': query_before, 'ndarray': query_after},
+    }
+    print(json.dumps(result, indent=2))
+    if args.json:
+        Path(args.json).write_text(json.dumps(result, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,362 @@
+r"""
+HTTP load generator for /v1/query: replay a request log or synthesize a mix.
+
+Workload (one of):
+  --replay log.jsonl   one request per line: {"client_id", "question"} plus
+                       optional "retrieval", "mode", "top_k" and "ts" (seconds;
+                       with --replay-timing the recorded gaps are reproduced,
+                       scaled by --speed). Lines without client_id/question
+                       are skipped.
+  (default)            synthetic: --clients (or every client assigned in the
+                       local app DB) x questions from bench/synth.py, with the
+                       --mix of "<retrieval>/<mode>:<weight>" classes
+
+Load model (one of):
+  --users N            closed loop: N users each send the next request when the
+                       previous one returns (plus --think-ms)
+  --rate R             open loop: R requests/s with Poisson (or --uniform)
+                       arrivals regardless of how fast the server answers;
+                       latency counts from the scheduled send time, so queueing
+                       behind a slow server is not hidden
+
+Reports p50/p95/p99 latency, throughput and error rates, overall and per
+class; --json writes the same. --local starts a throwaway uvicorn on this
+machine with the stub LLM (no network or API key), pointed at the local
+data (RAG_DATA_DIR if set).
+
+Usage:
+    python bench/loadgen.py --local --users 16 --duration 30
+    python bench/loadgen.py --url http://10.0.0.5:8000 --api-key KEY --rate 50 --duration 60 --json load.json
+    python bench/loadgen.py --url http://127.0.0.1:8000 --replay traffic.jsonl --replay-timing --speed 2
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+
+def load_replay(path: Path) -> list:
+    out = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                rec = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if not isinstance(rec, dict) or 'client_id' not in rec or 'question' not in rec:
+                continue
+            payload = {'client_id': int(rec['client_id']), 'question': str(rec['question'])}
+            for key in ('retrieval', 'mode', 'top_k', 'deadline_ms'):
+                if rec.get(key) is not None:
+                    payload[key] = rec[key]
+            out.append((rec.get('ts'), payload))
+    return out
+
+
+def parse_mix(spec: str) -> list:
+    mix = []
+    for part in spec.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        cls, _, weight = part.partition(':')
+        retrieval, _, mode = cls.partition('/')
+        mix.append((retrieval or 'dense', mode or 'llm', float(weight or 1)))
+    return mix
+
+
+def local_clients() -> list:
+    from sqlitedict import SqliteDict
+    from app.app_db import APP_DB_PATH
+
+    if not APP_DB_PATH.exists():
+        return []
+    with SqliteDict(str(APP_DB_PATH), flag='r') as d:
+        return sorted(int(k) for k in d.keys() if str(k).isdigit())
+
+
+def synthetic_requests(clients: list, mix: list, seed: int):
+    sys.path.insert(0, str(Path(__file__).resolve().parent))
+    import synth
+
+    rng = random.Random(seed)
+    questions = synth.questions(1000, seed)
+    weights = [w for _, _, w in mix]
+    for i in itertools.count():
+        retrieval, mode, _ = rng.choices(mix, weights)[0]
+        yield None, {'client_id': rng.choice(clients), 'question': questions[i % len(questions)],
+                     'retrieval': retrieval, 'mode': mode}
+
+
+def class_of(payload: dict) -> str:
+    return f"{payload.get('retrieval', 'dense')}/{payload.get('mode', 'llm')}"
+
+
+class Recorder:
+    def __init__(self, warmup_until: float):
+        self.warmup_until = warmup_until
+        self.samples = []  # (class, latency_ms, outcome)
+        self.answer_modes = {}
+        self.first = None
+        self.last = None
+
+    def record(self, cls: str, start: float, outcome: str, answer_mode: str | None = None):
+        now = time.perf_counter()
+        if start < self.warmup_until:
+            return
+        self.first = start if self.first is None else min(self.first, start)
+        self.last = now if self.last is None else max(self.last, now)
+        self.samples.append((cls, (now - start) * 1000, outcome))
+        if answer_mode:
+            self.answer_modes[answer_mode] = self.answer_modes.get(answer_mode, 0) + 1
+
+
+def summarize(samples, elapsed: float) -> dict:
+    if not samples:
+        return {'requests': 0}
+    outcomes = {}
+    for _, _, outcome in samples:
+        outcomes[outcome] = outcomes.get(outcome, 0) + 1
+    ok = outcomes.get('200', 0)
+    return {
+        'requests': len(samples),
+        'ok': ok,
+        'error_rate': round(1 - ok / len(samples), 4),
+        'outcomes': dict(sorted(outcomes.items())),
+        'throughput_rps': round(ok / elapsed, 2) if elapsed > 0 else None,
+        'latency_ms': latency_stats([s[1] for s in samples]),
+        # shed requests (429/503) return fast; this is what admitted requests saw
+        'ok_latency_ms': latency_stats([s[1] for s in samples if s[2] == '200']),
+    }
+
+
+def latency_stats(values) -> dict:
+    if not values:
+        return {}
+    lat = sorted(values)
+    pick = lambda p: lat[min(len(lat) - 1, int(round(p / 100.0 * (len(lat) - 1))))]
+    return {'p50': round(pick(50), 2), 'p95': round(pick(95), 2), 'p99': round(pick(99), 2),
+            'mean': round(statistics.fmean(lat), 2), 'max': round(lat[-1], 2)}
+
+
+async def send(client, payload: dict, start: float, rec: Recorder, headers: dict):
+    import httpx
+
+    try:
+        r = await client.post('/v1/query', json=payload, headers=headers)
+        mode = None
+        if r.status_code == 200:
+            try:
+                mode = r.json().get('mode')
+            except ValueError:
+                pass
+        rec.record(class_of(payload), start, str(r.status_code), mode)
+    except httpx.TimeoutException:
+        rec.record(class_of(payload), start, 'timeout')
+    except httpx.HTTPError as e:
+        rec.record(class_of(payload), start, type(e).__name__)
+
+
+async def closed_loop(client, requests, args, rec, headers, stop_at):
+    sent = itertools.count()
+
+    async def user():
+        while time.perf_counter() < stop_at:
+            if args.requests and next(sent) >= args.requests:
+                return
+            try:
+                _, payload = next(requests)
+            except StopIteration:
+                return
+            await send(client, payload, time.perf_counter(), rec, headers)
+            if args.think_ms:
+                await asyncio.sleep(args.think_ms / 1000.0)
+
+    await asyncio.gather(*(user() for _ in range(args.users)))
+
+
+async def open_loop(client, requests, args, rec, headers, stop_at):
+    rng = random.Random(args.seed)
+    tasks = set()
+    dropped = 0
+    next_at = time.perf_counter()
+    first_ts = None
+    origin = next_at
+    for n, (ts, payload) in enumerate(requests):
+        if args.requests and n >= args.requests:
+            break
+        if args.replay_timing and ts is not None:
+            first_ts = ts if first_ts is None else first_ts
+            next_at = origin + (float(ts) - float(first_ts)) / args.speed
+        if next_at >= stop_at:
+            break
+        delay = next_at - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if len(tasks) >= args.max_inflight:
+            # the client itself is saturated; count it rather than silently slowing the arrival rate
+            dropped += 1
+            rec.record(class_of(payload), next_at, 'client_overload')
+        else:
+            task = asyncio.create_task(send(client, payload, next_at, rec, headers))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        if not (args.replay_timing and ts is not None):
+            gap = 1.0 / args.rate
+            next_at += gap if args.uniform else rng.expovariate(1.0 / gap)
+    if tasks:
+        await asyncio.gather(*tasks)
+    return dropped
+
+
+async def run(args, base_url: str) -> dict:
+    import httpx
+
+    if args.replay:
+        records = load_replay(Path(args.replay))
+        if not records:
+            raise SystemExit(f'no usable requests in {args.replay}')
+        requests = iter(records) if args.replay_timing else itertools.cycle(records)
+        workload = {'replay': args.replay, 'records': len(records)}
+    else:
+        clients = [int(c) for c in args.clients.split(',')] if args.clients else local_clients()
+        if not clients:
+            raise SystemExit('no clients: pass --clients or assign providers to clients first')
+        mix = parse_mix(args.mix)
+        requests = synthetic_requests(clients, mix, args.seed)
+        workload = {'clients': clients, 'mix': args.mix}
+
+    headers = {'x-api-key': args.api_key} if args.api_key else {}
+    limits = httpx.Limits(max_connections=max(args.users or 0, args.max_inflight), max_keepalive_connections=None)
+    start = time.perf_counter()
+    rec = Recorder(warmup_until=start + args.warmup)
+    stop_at = start + args.warmup + args.duration
+    dropped = 0
+    async with httpx.AsyncClient(base_url=base_url, timeout=args.timeout, limits=limits) as client:
+        if args.rate:
+            dropped = await open_loop(client, requests, args, rec, headers, stop_at)
+        else:
+            await closed_loop(client, requests, args, rec, headers, stop_at)
+
+    elapsed = (rec.last - rec.first) if rec.samples else 0.0
+    classes = sorted({s[0] for s in rec.samples})
+    if args.replay_timing:
+        model = f'open loop, recorded arrivals x{args.speed}'
+    elif args.rate:
+        model = f'open loop {args.rate} rps'
+    else:
+        model = f'closed loop {args.users} users'
+    return {
+        'target': base_url,
+        'model': model,
+        'workload': workload,
+        'measured_s': round(elapsed, 2),
+        'client_dropped': dropped,
+        'overall': summarize(rec.samples, elapsed),
+        'per_class': {c: summarize([s for s in rec.samples if s[0] == c], elapsed) for c in classes},
+        'answer_modes': rec.answer_modes,
+    }
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_local_server(args):
+    port = free_port()
+    env = dict(os.environ, LLM_BACKEND='stub', LLM_STUB_LATENCY_MS=str(args.stub_latency_ms))
+    if args.embedding_model:
+        env['EMBEDDING_MODEL'] = args.embedding_model
+    cmd = [sys.executable, '-m', 'uvicorn', 'app.main:app', '--port', str(port),
+           '--workers', str(args.local_workers), '--log-level', 'warning']
+    proc = subprocess.Popen(cmd, cwd=str(ROOT), env=env)
+    base = f'http://127.0.0.1:{port}'
+    import httpx
+
+    deadline = time.time() + 120
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise SystemExit(f'local server exited with {proc.returncode}')
+        try:
+            if httpx.get(base + '/v1/ready', timeout=2).status_code == 200:
+                return proc, base
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    proc.kill()
+    raise SystemExit('local server did not become ready')
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--url', default=os.environ.get('API_BASE', 'http://127.0.0.1:8000'))
+    ap.add_argument('--api-key', default=os.environ.get('API_KEY'))
+    ap.add_argument('--local', action='store_true', help='Start a local uvicorn with the stub LLM and target it')
+    ap.add_argument('--local-workers', type=int, default=1)
+    ap.add_argument('--stub-latency-ms', type=float, default=200.0)
+    ap.add_argument('--embedding-model', default=None, help='EMBEDDING_MODEL for --local (e.g. hash:384)')
+    ap.add_argument('--replay', default=None, help='JSONL request log to replay')
+    ap.add_argument('--replay-timing', action='store_true', help='Reproduce the recorded "ts" gaps (open loop)')
+    ap.add_argument('--speed', type=float, default=1.0, help='Replay speed-up factor with --replay-timing')
+    ap.add_argument('--clients', default=None, help='Comma-separated client ids (default: all local ones)')
+    ap.add_argument('--mix', default='dense/llm:1', help='e.g. dense/llm:0.6,hybrid/extractive:0.4')
+    ap.add_argument('--users', type=int, default=None, help='Closed loop: concurrent users')
+    ap.add_argument('--think-ms', type=float, default=0.0)
+    ap.add_argument('--rate', type=float, default=None, help='Open loop: arrivals per second')
+    ap.add_argument('--uniform', action='store_true', help='Evenly spaced instead of Poisson arrivals')
+    ap.add_argument('--max-inflight', type=int, default=1000, help='Open loop: client-side cap on outstanding requests')
+    ap.add_argument('--duration', type=float, default=30.0, help='Measured seconds (after --warmup)')
+    ap.add_argument('--warmup', type=float, default=3.0, help='Seconds of load excluded from the stats')
+    ap.add_argument('--requests', type=int, default=None, help='Stop after this many requests')
+    ap.add_argument('--timeout', type=float, default=60.0)
+    ap.add_argument('--seed', type=int, default=0)
+    ap.add_argument('--json', default=None)
+    args = ap.parse_args()
+    if args.replay_timing and not args.replay:
+        ap.error('--replay-timing needs --replay')
+    if args.replay_timing and not args.rate:
+        args.rate = 1.0  # arrivals come from the log; only selects the open-loop driver
+    if not args.rate and not args.users:
+        args.users = 8
+    if args.rate and args.users:
+        ap.error('choose either --rate (open loop) or --users (closed loop)')
+
+    server = None
+    base_url = args.url
+    if args.local:
+        server, base_url = start_local_server(args)
+    try:
+        result = asyncio.run(run(args, base_url))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait(timeout=30)
+
+    o = result['overall']
+    print(f"{result['model']}: {o.get('requests', 0)} requests, {o.get('throughput_rps')} ok/s, "
+          f"error rate {o.get('error_rate')}, latency {o.get('latency_ms')}, ok latency {o.get('ok_latency_ms')}",
+          file=sys.stderr)
+    print(json.dumps(result, indent=2))
+    if args.json:
+        Path(args.json).write_text(json.dumps(result, indent=2))
+
+
+if __name__ == '__main__':
+    main()
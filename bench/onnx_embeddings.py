@@ -0,0 +1,135 @@
+r"""
+Parity check and throughput benchmark: int8 ONNX vs fp32 SBERT embeddings.
+
+Embeds the same texts with `sbert:<model>` (reference) and `onnx:<model>` and
+reports:
+  - cosine agreement between the two embeddings of each text (mean / p5 / min)
+  - recall@k: overlap of each query's top-k neighbours under both models
+  - throughput (texts/s) for each backend at the configured threads/batch size
+
+Texts come from a provider's chunks (`--provider`) or are synthesized. Exits
+non-zero when mean cosine or recall@k fall below the given thresholds, so it
+can gate a model change.
+
+Usage:
+    python bench/onnx_embeddings.py --provider Fatima
+    python bench/onnx_embeddings.py --synthetic 2000 --threads 4 --batch-size 64 --json out.json
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+
+def load_texts(provider: str | None, synthetic: int):
+    if provider:
+        from app.config import PROVIDERS_DIR
+
+        chunks_dir = PROVIDERS_DIR / provider / 'chunks'
+        texts = []
+        for p in sorted(chunks_dir.glob('*.json')):
+            texts.append(json.loads(p.read_text(encoding='utf-8'))['text'])
+        if texts:
+            return texts
+        print(f'No chunks for provider {provider}; falling back to synthetic texts')
+    rng = random.Random(0)
+    topics = ['chatbot', 'automation', 'analytics', 'pricing', 'support', 'contact', 'machine learning',
+              'dashboard', 'integration', 'consulting', 'training', 'maintenance']
+    verbs = ['builds', 'offers', 'provides', 'designs', 'maintains', 'delivers']
+    out = []
+    for i in range(max(1, synthetic)):
+        words = [f"The provider {rng.choice(verbs)} {rng.choice(topics)} and {rng.choice(topics)} services."
+                 for _ in range(rng.randint(2, 12))]
+        out.append(' '.join(words))
+    return out
+
+
+def throughput(provider, model_key: str, texts, repeats: int):
+    provider.embed_texts_with_model(model_key, texts[:8])  # warm up / load model
+    start = time.perf_counter()
+    for _ in range(repeats):
+        embs = provider.embed_texts_with_model(model_key, texts)
+    elapsed = time.perf_counter() - start
+    return embs, len(texts) * repeats / elapsed
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--model', default='all-MiniLM-L6-v2')
+    ap.add_argument('--provider', default=None, help='Use this provider\'s chunks as the corpus')
+    ap.add_argument('--synthetic', type=int, default=1000, help='Synthetic corpus size when no provider is given')
+    ap.add_argument('--threads', type=int, default=None, help='onnxruntime intra-op threads')
+    ap.add_argument('--batch-size', type=int, default=None)
+    ap.add_argument('--k', type=int, default=5)
+    ap.add_argument('--queries', type=int, default=200)
+    ap.add_argument('--repeats', type=int, default=1)
+    ap.add_argument('--min-cosine', type=float, default=0.98)
+    ap.add_argument('--min-recall', type=float, default=0.9)
+    ap.add_argument('--json', default=None, help='Write the results to this file')
+    args = ap.parse_args()
+
+    # settings are read when app.config is imported
+    if args.threads is not None:
+        os.environ['EMBED_ONNX_THREADS'] = str(args.threads)
+    if args.batch_size is not None:
+        os.environ['EMBED_BATCH_SIZE'] = str(args.batch_size)
+
+    import numpy as np
+    from app.embeddings import EmbeddingProvider
+
+    texts = load_texts(args.provider, args.synthetic)
+    provider = EmbeddingProvider()
+    ref, ref_tps = throughput(provider, f'sbert:{args.model}', texts, args.repeats)
+    q8, q8_tps = throughput(provider, f'onnx:{args.model}', texts, args.repeats)
+    ref = np.asarray(ref, dtype='float32')
+    q8 = np.asarray(q8, dtype='float32')
+
+    def unit(a):
+        return a / np.clip(np.linalg.norm(a, axis=1, keepdims=True), 1e-12, None)
+
+    ref_u, q8_u = unit(ref), unit(q8)
+    cos = (ref_u * q8_u).sum(axis=1)
+
+    # recall@k: neighbours of sampled queries in the corpus under both models
+    rng = np.random.default_rng(0)
+    k = min(args.k, len(texts))
+    qidx = rng.choice(len(texts), size=min(args.queries, len(texts)), replace=False)
+    ref_top = np.argsort(-(ref_u[qidx] @ ref_u.T), axis=1)[:, :k]
+    q8_top = np.argsort(-(q8_u[qidx] @ q8_u.T), axis=1)[:, :k]
+    recall = float(np.mean([len(set(a) & set(b)) / k for a, b in zip(ref_top, q8_top)]))
+
+    result = {
+        'model': args.model,
+        'texts': len(texts),
+        'dim': int(ref.shape[1]),
+        'cosine_mean': float(cos.mean()),
+        'cosine_p5': float(np.percentile(cos, 5)),
+        'cosine_min': float(cos.min()),
+        f'recall_at_{k}': recall,
+        'sbert_fp32_texts_per_s': ref_tps,
+        'onnx_int8_texts_per_s': q8_tps,
+        'speedup': q8_tps / ref_tps if ref_tps else None,
+        'threads': os.environ.get('EMBED_ONNX_THREADS', '0'),
+        'batch_size': os.environ.get('EMBED_BATCH_SIZE', '64'),
+    }
+    print(json.dumps(result, indent=2))
+    if args.json:
+        Path(args.json).write_text(json.dumps(result, indent=2))
+
+    ok = result['cosine_mean'] >= args.min_cosine and recall >= args.min_recall
+    if not ok:
+        print(f'PARITY FAILED: cosine_mean={result["cosine_mean"]:.4f} (min {args.min_cosine}), '
+              f'recall@{k}={recall:.3f} (min {args.min_recall})')
+        sys.exit(1)
+    print('Parity OK')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,178 @@
+r"""
+Per-worker memory of the prefork server vs plain `uvicorn --workers`.
+
+Starts the server in each mode, waits until it answers /v1/ready, optionally
+sends a few queries so every worker has touched the model and index, then
+reads /proc/<pid>/smaps_rollup of the master and every worker:
+  - rss:     resident pages, shared pages counted in every process
+  - pss:     proportional set size; shared pages split between the sharers,
+             so the sum over processes is the real memory use
+  - private: pages only this process maps (what a worker costs on its own)
+
+Linux only. The savings grow with the model/index size and the worker count;
+use a real embedding model (e.g. WARMUP_MODELS=sbert:all-MiniLM-L6-v2) and
+8+ workers to see them. Without one (only `hash:` or lexical retrieval) the
+numbers cover the interpreter, the app's imports and the indexes, not model
+weights; the script warns and records `models: null` in that case.
+
+Usage:
+    python bench/prefork_rss.py --workers 8 --client-id 100 --json rss.json
+    python bench/prefork_rss.py --workers 8 --modes prefork --models sbert:all-MiniLM-L6-v2
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+
+
+def smaps_rollup(pid: int) -> dict:
+    fields = {}
+    with open(f'/proc/{pid}/smaps_rollup') as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) >= 3 and parts[2] == 'kB':
+                fields[parts[0].rstrip(':')] = int(parts[1])
+    mb = lambda kb: round(kb / 1024, 1)
+    return {
+        'rss_mb': mb(fields.get('Rss', 0)),
+        'pss_mb': mb(fields.get('Pss', 0)),
+        'private_mb': mb(fields.get('Private_Clean', 0) + fields.get('Private_Dirty', 0)),
+        'shared_mb': mb(fields.get('Shared_Clean', 0) + fields.get('Shared_Dirty', 0)),
+    }
+
+
+def children(pid: int) -> list:
+    out = []
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as f:
+                # the command name may contain spaces; ppid follows the closing paren
+                ppid = int(f.read().rsplit(')', 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        if ppid == pid:
+            out.append(int(entry))
+    return sorted(out)
+
+
+def http(method: str, url: str, payload=None, timeout: float = 30.0) -> int:
+    data = json.dumps(payload).encode() if payload is not None else None
+    req = urllib.request.Request(url, data=data, method=method, headers={'Content-Type': 'application/json'})
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as resp:
+            resp.read()
+            return resp.status
+    except urllib.error.HTTPError as e:
+        return e.code
+    except OSError:
+        return 0
+
+
+def wait_ready(base: str, proc, timeout: float, streak: int):
+    # with independent workers each one warms on its own, so ask several times in a row
+    deadline = time.time() + timeout
+    ok = 0
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f'server exited with {proc.returncode}')
+        ok = ok + 1 if http('GET', base + '/v1/ready', timeout=2) == 200 else 0
+        if ok >= streak:
+            return
+        time.sleep(0.1)
+    raise TimeoutError('server did not become ready')
+
+
+def measure(mode: str, args) -> dict:
+    env = dict(os.environ)
+    if args.models:
+        env['WARMUP_MODELS'] = args.models
+    if args.providers:
+        env['WARMUP_PROVIDERS'] = args.providers
+    if mode == 'prefork':
+        cmd = [sys.executable, 'scripts/serve_prefork.py', '--workers', str(args.workers),
+               '--port', str(args.port), '--log-level', 'warning']
+    else:
+        cmd = [sys.executable, '-m', 'uvicorn', 'app.main:app', '--workers', str(args.workers),
+               '--port', str(args.port), '--log-level', 'warning']
+    base = f'http://127.0.0.1:{args.port}'
+    proc = subprocess.Popen(cmd, cwd=str(ROOT), env=env)
+    try:
+        start = time.perf_counter()
+        wait_ready(base, proc, args.timeout, streak=4 * args.workers)
+        ready_s = time.perf_counter() - start
+        payload = {'client_id': args.client_id, 'question': args.question,
+                   'retrieval': args.retrieval, 'mode': 'extractive'}
+        statuses = [http('POST', base + '/v1/query', payload) for _ in range(args.queries)] if args.client_id is not None else []
+        time.sleep(args.settle)
+
+        master = smaps_rollup(proc.pid)
+        # uvicorn's supervisor also owns multiprocessing's resource tracker
+        workers = [dict(pid=pid, **smaps_rollup(pid)) for pid in children(proc.pid)
+                   if b'resource_tracker' not in Path(f'/proc/{pid}/cmdline').read_bytes()]
+        total_pss = master['pss_mb'] + sum(w['pss_mb'] for w in workers)
+        total_rss = master['rss_mb'] + sum(w['rss_mb'] for w in workers)
+        n = max(1, len(workers))
+        return {
+            'mode': mode,
+            'workers': len(workers),
+            'ready_s': round(ready_s, 2),
+            'query_statuses': sorted(set(statuses)),
+            'master': master,
+            'per_worker': workers,
+            'worker_avg': {k: round(sum(w[k] for w in workers) / n, 1)
+                           for k in ('rss_mb', 'pss_mb', 'private_mb', 'shared_mb')},
+            'total_pss_mb': round(total_pss, 1),
+            'total_rss_mb': round(total_rss, 1),
+        }
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            proc.wait()
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--workers', type=int, default=8)
+    ap.add_argument('--modes', default='uvicorn,prefork', help='Comma-separated: uvicorn, prefork')
+    ap.add_argument('--port', type=int, default=8765)
+    ap.add_argument('--models', default=None, help='WARMUP_MODELS for both modes')
+    ap.add_argument('--providers', default=None, help='WARMUP_PROVIDERS for both modes')
+    ap.add_argument('--client-id', type=int, default=None, help='Send queries as this client after startup')
+    ap.add_argument('--question', default='What services are offered?')
+    ap.add_argument('--retrieval', default='dense', choices=['dense', 'lexical', 'hybrid'])
+    ap.add_argument('--queries', type=int, default=32, help='Queries sent after startup (spread over workers)')
+    ap.add_argument('--settle', type=float, default=1.0)
+    ap.add_argument('--timeout', type=float, default=300.0)
+    ap.add_argument('--json', default=None)
+    args = ap.parse_args()
+
+    models = args.models or os.environ.get('WARMUP_MODELS')
+    if not models:
+        print('warning: no embedding model preloaded (--models / WARMUP_MODELS); '
+              'this measures imports and indexes, not shared model weights', file=sys.stderr)
+    results = [dict(measure(m.strip(), args), models=models or None)
+               for m in args.modes.split(',') if m.strip()]
+    for r in results:
+        print(f"{r['mode']:8s} workers={r['workers']} total_pss={r['total_pss_mb']}MB total_rss={r['total_rss_mb']}MB "
+              f"worker_avg={r['worker_avg']}")
+    if len(results) == 2 and results[1]['total_pss_mb']:
+        print(f"total PSS ratio {results[0]['mode']}/{results[1]['mode']}: "
+              f"{results[0]['total_pss_mb'] / results[1]['total_pss_mb']:.2f}x")
+    if args.json:
+        Path(args.json).write_text(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
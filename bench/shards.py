@@ -0,0 +1,104 @@
+r"""
+Latency of dense search vs. shard count for one large provider.
+
+Generates `--vectors` random float32 vectors (`--dim` wide), writes them as a
+single flat index and as 2..N shards with app/shards.py, then runs
+`--queries` single-question searches (top `--top-k`) against each layout and
+reports latency percentiles. Shards are searched in parallel on
+SHARD_SEARCH_THREADS threads, so the speedup is bounded by the CPU cores
+available (`--threads` overrides the setting for this run).
+
+Usage:
+    python bench/shards.py --vectors 500000 --shards 1,2,4,8 --json shards.json
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+
+def percentiles(values) -> dict:
+    ordered = sorted(values)
+    pick = lambda p: ordered[min(len(ordered) - 1, int(round(p / 100.0 * (len(ordered) - 1))))]
+    return {'p50': round(pick(50), 3), 'p90': round(pick(90), 3), 'p99': round(pick(99), 3),
+            'mean': round(statistics.fmean(ordered), 3)}
+
+
+def time_search(index, queries, k: int) -> dict:
+    latencies = []
+    for q in queries:
+        start = time.perf_counter()
+        index.search(q[None, :], k)
+        latencies.append((time.perf_counter() - start) * 1000)
+    return percentiles(latencies)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--vectors', type=int, default=200_000)
+    ap.add_argument('--dim', type=int, default=384)
+    ap.add_argument('--shards', default='1,2,4,8')
+    ap.add_argument('--by', default='hash', choices=('hash', 'document'))
+    ap.add_argument('--docs', type=int, default=500, help='Documents to split the vectors into for --by document')
+    ap.add_argument('--queries', type=int, default=200)
+    ap.add_argument('--top-k', type=int, default=5)
+    ap.add_argument('--threads', type=int, default=None, help='Override SHARD_SEARCH_THREADS')
+    ap.add_argument('--seed', type=int, default=0)
+    ap.add_argument('--json', default=None)
+    args = ap.parse_args()
+    if args.threads:
+        os.environ['SHARD_SEARCH_THREADS'] = str(args.threads)
+
+    import faiss
+    import numpy as np
+    from app.config import SHARD_SEARCH_THREADS
+    from app.shards import ShardedIndex, partition, read_manifest, write_shards
+
+    rng = np.random.default_rng(args.seed)
+    vectors = rng.standard_normal((args.vectors, args.dim), dtype=np.float32)
+    queries = rng.standard_normal((args.queries, args.dim), dtype=np.float32)
+    step = max(1, args.vectors // max(1, args.docs))
+    documents = [{'first_chunk': lo, 'end_chunk': min(lo + step, args.vectors)} for lo in range(0, args.vectors, step)]
+
+    flat = faiss.IndexFlatL2(args.dim)
+    flat.add(vectors)
+    flat.search(queries[:1], args.top_k)
+    results = {'flat': {'latency_ms': time_search(flat, queries, args.top_k)}}
+    print(f"{'flat':10s} {results['flat']['latency_ms']}", file=sys.stderr)
+
+    workdir = Path(tempfile.mkdtemp(prefix='rag-shards-'))
+    try:
+        for n in [int(s) for s in args.shards.split(',') if s.strip()]:
+            index_dir = workdir / f'{n}'
+            index_dir.mkdir()
+            start = time.perf_counter()
+            parts = partition(args.vectors, n, args.by, documents=documents)
+            write_shards(index_dir, vectors, parts, args.by)
+            build_s = time.perf_counter() - start
+            index = ShardedIndex(index_dir, read_manifest(index_dir))
+            index.search(queries[:1], args.top_k)
+            name = f'shards_{n}'
+            results[name] = {'build_s': round(build_s, 3), 'sizes': [len(p) for p in parts],
+                             'latency_ms': time_search(index, queries, args.top_k)}
+            print(f"{name:10s} {results[name]['latency_ms']}", file=sys.stderr)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    out = {'meta': {'args': vars(args), 'cpus': os.cpu_count(), 'shard_search_threads': SHARD_SEARCH_THREADS},
+           'query': results}
+    print(json.dumps(out, indent=2))
+    if args.json:
+        Path(args.json).write_text(json.dumps(out, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+r"""
+Cold-start benchmark: import time of `app.main` and first-request latency.
+
+Each measurement runs in a fresh interpreter so nothing is cached:
+  - import: wall time of `import app.main` and which heavy modules it pulled in
+  - first request: with warmup off, the first /v1/query pays for loading the
+    embedding model and the provider index; with warmup on, the process waits
+    for /v1/ready first and the first query should cost about as much as the
+    second one
+
+Requires a built provider assigned to `--client-id` (see
+scripts/create_test_provider.py and scripts/run_build_debug.py).
+
+Usage:
+    python bench/startup.py --client-id 100 --repeats 5 --json startup.json
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+
+HEAVY_MODULES = ['faiss', 'pandas', 'PyPDF2', 'docx', 'openpyxl', 'torch', 'sentence_transformers', 'onnxruntime']
+
+_IMPORT_PROBE = """
+import json, sys, time
+t = time.perf_counter()
+import app.main
+elapsed = time.perf_counter() - t
+print(json.dumps({'seconds': elapsed, 'loaded': [m for m in %r if m in sys.modules]}))
+""" % (HEAVY_MODULES,)
+
+_REQUEST_PROBE = """
+import json, sys, time
+t0 = time.perf_counter()
+from fastapi.testclient import TestClient
+from app.main import app
+payload = {'client_id': %d, 'question': %r, 'retrieval': %r, 'mode': 'extractive'}
+with TestClient(app) as client:
+    t1 = time.perf_counter()
+    while client.get('/v1/ready').status_code != 200:
+        time.sleep(0.01)
+    t2 = time.perf_counter()
+    timings = []
+    for _ in range(2):
+        s = time.perf_counter()
+        r = client.post('/v1/query', json=payload)
+        timings.append(time.perf_counter() - s)
+print(json.dumps({'status': r.status_code, 'import_and_startup_s': t1 - t0, 'until_ready_s': t2 - t1,
+                  'first_request_s': timings[0], 'second_request_s': timings[1]}))
+"""
+
+
+def run_probe(code: str, env_overrides: dict) -> dict:
+    env = dict(os.environ, **env_overrides)
+    out = subprocess.run([sys.executable, '-c', code], cwd=str(ROOT), env=env,
+                         capture_output=True, text=True, check=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def summarize(samples, key):
+    values = [s[key] for s in samples]
+    return {'median': statistics.median(values), 'min': min(values), 'max': max(values)}
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--client-id', type=int, default=100)
+    ap.add_argument('--question', default='What services are offered?')
+    ap.add_argument('--retrieval', default='dense', choices=['dense', 'lexical', 'hybrid'])
+    ap.add_argument('--repeats', type=int, default=3)
+    ap.add_argument('--skip-requests', action='store_true', help='Only measure import time')
+    ap.add_argument('--json', default=None)
+    args = ap.parse_args()
+
+    imports = [run_probe(_IMPORT_PROBE, {}) for _ in range(args.repeats)]
+    result = {
+        'import_app_main_s': summarize(imports, 'seconds'),
+        'heavy_modules_loaded_at_import': imports[-1]['loaded'],
+    }
+
+    if not args.skip_requests:
+        probe = _REQUEST_PROBE % (args.client_id, args.question, args.retrieval)
+        for label, warm in (('cold', '0'), ('warmup', '1')):
+            samples = [run_probe(probe, {'WARMUP_ENABLED': warm}) for _ in range(args.repeats)]
+            result[label] = {k: summarize(samples, k) for k in
+                             ('import_and_startup_s', 'until_ready_s', 'first_request_s', 'second_request_s')}
+            result[label]['status'] = samples[-1]['status']
+
+    print(json.dumps(result, indent=2))
+    if args.json:
+        Path(args.json).write_text(json.dumps(result, indent=2))
+
+
+if __name__ == '__main__':
+    main()
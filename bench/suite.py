@@ -0,0 +1,213 @@
+r"""
+End-to-end offline benchmark: synthetic providers -> rebuild -> /v1/query.
+
+Everything runs in-process against a scratch data dir (RAG_DATA_DIR), with
+the deterministic `hash:` embedding backend and the stub LLM, so no network,
+model download or API key is needed and runs are comparable across commits:
+  - build: generates `--providers` synthetic providers (bench/synth.py) and
+    times every step of build_index_for_provider (excel, parse, chunk,
+    lexical, embed, faiss)
+  - query: for each retrieval x answer-mode scenario, sends `--queries`
+    requests at `--concurrency` through the ASGI app and reports client-side
+    latency percentiles, throughput and the median per-stage breakdown
+    (from the X-Debug timing trace, see app/debug.py)
+
+Results go to stdout and `--json`; compare two runs with bench/compare.py.
+
+Usage:
+    python bench/suite.py --json before.json
+    python bench/suite.py --providers 5 --docs 50 --doc-kb 16 --queries 500 --concurrency 16 --json after.json
+    python bench/compare.py before.json after.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+DEBUG_TOKEN = 'bench'
+
+
+def configure(args, workdir: Path):
+    """Point the app at the scratch dir and the offline backends; must run before importing app.*"""
+    os.environ.update({
+        'RAG_DATA_DIR': str(workdir),
+        'EMBEDDING_MODEL': args.embedding_model,
+        'LLM_BACKEND': 'stub',
+        'LLM_STUB_LATENCY_MS': str(args.llm_latency_ms),
+        'LLM_STUB_SLOW_RATE': '0',
+        'LLM_HEDGE_ENABLED': '0',
+        'WARMUP_ENABLED': '0',
+        'DEBUG_TOKEN': DEBUG_TOKEN,
+        'DEBUG_PROFILE_DIR': str(workdir / 'debug'),
+    })
+    os.environ.pop('PROMETHEUS_MULTIPROC_DIR', None)
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=str(ROOT),
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+def percentiles(values) -> dict:
+    if not values:
+        return {}
+    ordered = sorted(values)
+    pick = lambda p: ordered[min(len(ordered) - 1, int(round(p / 100.0 * (len(ordered) - 1))))]
+    return {'p50': round(pick(50), 3), 'p90': round(pick(90), 3), 'p99': round(pick(99), 3),
+            'mean': round(statistics.fmean(ordered), 3), 'max': round(ordered[-1], 3)}
+
+
+def build_providers(names, providers_dir: Path) -> dict:
+    from app import debug
+    from app.pipeline import build_index_for_provider
+    from sqlitedict import SqliteDict
+
+    per_provider = []
+    for name in names:
+        start = time.perf_counter()
+        # the pipeline's StageTimer marks land in the active trace
+        with debug.trace_request({'timing'}) as trace:
+            build_index_for_provider(name, providers_dir)
+        with SqliteDict(str(providers_dir / name / 'db' / 'metadata.sqlite'), flag='r') as db:
+            chunks = len(db.get('vector_keys', []))
+        per_provider.append({'provider': name, 'chunks': chunks,
+                             'total_s': round(time.perf_counter() - start, 4),
+                             'stages_s': {k: round(v, 4) for k, v in trace.stages.items()}})
+    stages = sorted({s for p in per_provider for s in p['stages_s']})
+    return {
+        'per_provider': per_provider,
+        'chunks_total': sum(p['chunks'] for p in per_provider),
+        'total_s': round(sum(p['total_s'] for p in per_provider), 4),
+        'stages_s': {s: round(sum(p['stages_s'].get(s, 0.0) for p in per_provider), 4) for s in stages},
+    }
+
+
+async def run_scenario(app, client_ids, questions, retrieval: str, mode: str, concurrency: int) -> dict:
+    import httpx
+
+    latencies, stage_samples, statuses, answer_modes = [], {}, {}, {}
+    queue = asyncio.Queue()
+    for i, q in enumerate(questions):
+        queue.put_nowait((client_ids[i % len(client_ids)], q))
+
+    async def worker(client):
+        while True:
+            try:
+                client_id, question = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            payload = {'client_id': client_id, 'question': question, 'retrieval': retrieval, 'mode': mode}
+            start = time.perf_counter()
+            r = await client.post('/v1/query', json=payload,
+                                  headers={'X-Debug': 'timing', 'X-Debug-Token': DEBUG_TOKEN})
+            latencies.append((time.perf_counter() - start) * 1000)
+            statuses[r.status_code] = statuses.get(r.status_code, 0) + 1
+            if r.status_code == 200:
+                body = r.json()
+                answer_modes[body.get('mode')] = answer_modes.get(body.get('mode'), 0) + 1
+                for stage, ms in (body.get('debug') or {}).get('timings_ms', {}).items():
+                    stage_samples.setdefault(stage, []).append(ms)
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url='http://bench', timeout=120) as client:
+        start = time.perf_counter()
+        await asyncio.gather(*(worker(client) for _ in range(max(1, concurrency))))
+        wall = time.perf_counter() - start
+    return {
+        'requests': len(latencies),
+        'concurrency': concurrency,
+        'statuses': {str(k): v for k, v in sorted(statuses.items())},
+        'answer_modes': answer_modes,
+        'qps': round(len(latencies) / wall, 2) if wall else None,
+        'latency_ms': percentiles(latencies),
+        'stages_ms': {s: round(statistics.median(v), 3) for s, v in sorted(stage_samples.items())},
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--providers', type=int, default=2)
+    ap.add_argument('--docs', type=int, default=12)
+    ap.add_argument('--doc-kb', type=float, default=8.0)
+    ap.add_argument('--formats', default='txt,pdf,docx')
+    ap.add_argument('--seed', type=int, default=0)
+    ap.add_argument('--queries', type=int, default=200, help='Requests per scenario')
+    ap.add_argument('--concurrency', type=int, default=8)
+    ap.add_argument('--retrieval', default='dense,lexical,hybrid')
+    ap.add_argument('--modes', default='extractive,llm')
+    ap.add_argument('--embedding-model', default='hash:384')
+    ap.add_argument('--llm-latency-ms', type=float, default=50.0)
+    ap.add_argument('--workdir', default=None, help='Keep the generated data here (default: a temp dir, removed)')
+    ap.add_argument('--json', default=None)
+    args = ap.parse_args()
+
+    workdir = Path(args.workdir) if args.workdir else Path(tempfile.mkdtemp(prefix='rag-bench-'))
+    configure(args, workdir)
+    try:
+        sys.path.insert(0, str(Path(__file__).resolve().parent))
+        import synth
+        from app.config import PROVIDERS_DIR
+        from app.app_db import set_client_provider
+
+        formats = [f.strip() for f in args.formats.split(',') if f.strip()]
+        names = [f'bench{i:03d}' for i in range(args.providers)]
+        for name in names:
+            synth.make_provider(PROVIDERS_DIR, name, args.docs, args.doc_kb, formats, args.seed)
+        build = build_providers(names, PROVIDERS_DIR)
+
+        client_ids = []
+        for i, name in enumerate(names):
+            set_client_provider(1000 + i, name)
+            client_ids.append(1000 + i)
+
+        from app.main import app
+
+        questions = synth.questions(args.queries, args.seed)
+        # one untimed pass loads indexes and caches so scenarios start warm
+        asyncio.run(run_scenario(app, client_ids, questions[:len(client_ids) * 2], 'hybrid', 'extractive', 1))
+        query = {}
+        for retrieval in [r.strip() for r in args.retrieval.split(',') if r.strip()]:
+            for mode in [m.strip() for m in args.modes.split(',') if m.strip()]:
+                name = f'{retrieval}/{mode}'
+                query[name] = asyncio.run(run_scenario(app, client_ids, questions, retrieval, mode, args.concurrency))
+                print(f"{name:20s} qps={query[name]['qps']} latency_ms={query[name]['latency_ms']}", file=sys.stderr)
+
+        result = {
+            'meta': {
+                'commit': git_commit(),
+                'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+                'python': platform.python_version(),
+                'machine': platform.machine(),
+                'cpus': os.cpu_count(),
+                'args': vars(args),
+            },
+            'corpus': {'providers': len(names), 'docs_per_provider': args.docs, 'doc_kb': args.doc_kb,
+                       'formats': formats, 'chunks_total': build['chunks_total']},
+            'build': build,
+            'query': query,
+        }
+        print(json.dumps(result, indent=2))
+        if args.json:
+            Path(args.json).write_text(json.dumps(result, indent=2))
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,174 @@
+r"""
+Synthetic provider generator for benchmarks.
+
+Writes providers in the layout the pipeline expects
+(`<providers_dir>/<name>/{excel,docs}`): an `excel/metadata.xlsx` with the
+usual contact/pricing columns plus `--docs` documents of about `--doc-kb` KiB
+each, cycling through the requested formats (txt, pdf, docx). The text is
+generated from a fixed vocabulary with a seeded RNG, so the same arguments
+always produce the same corpus. `questions()` draws queries from the same
+vocabulary so retrieval has something to find.
+
+PDFs are written by hand (one Helvetica text stream per page) because
+PyPDF2 cannot lay out text; PyPDF2 reads them back like any simple PDF.
+
+Usage:
+    python bench/synth.py --out /tmp/bench/providers --providers 3 --docs 20 --doc-kb 8 --formats txt,pdf,docx
+"""
+import argparse
+import random
+from pathlib import Path
+
+SERVICES = ['chatbot development', 'workflow automation', 'data analytics', 'cloud migration', 'mobile apps',
+            'web design', 'machine learning models', 'dashboard reporting', 'API integration', 'security audits',
+            'staff training', 'system maintenance', 'document processing', 'voice assistants', 'CRM setup']
+INDUSTRIES = ['retail', 'healthcare', 'logistics', 'education', 'finance', 'hospitality', 'real estate',
+              'manufacturing', 'legal', 'agriculture']
+FEATURES = ['a dedicated project manager', 'weekly progress reports', 'a 30 day warranty', 'on-site workshops',
+            'round the clock support', 'source code handover', 'usage analytics', 'multilingual support',
+            'custom integrations', 'a fixed delivery schedule']
+CITIES = ['Lahore', 'Karachi', 'Islamabad', 'Dubai', 'London', 'Toronto', 'Berlin', 'Singapore']
+FORMATS = ('txt', 'pdf', 'docx')
+
+
+def sentence(rng: random.Random, provider: str) -> str:
+    svc, ind, feat = rng.choice(SERVICES), rng.choice(INDUSTRIES), rng.choice(FEATURES)
+    templates = [
+        f'{provider} offers {svc} for {ind} businesses and includes {feat}.',
+        f'Our {svc} projects for {ind} clients usually take {rng.randint(2, 16)} weeks to deliver.',
+        f'Pricing for {svc} starts at {rng.randint(2, 90) * 50} USD and covers {feat}.',
+        f'The team in {rng.choice(CITIES)} has delivered {rng.randint(3, 200)} {svc} projects in {ind}.',
+        f'Every {svc} engagement comes with {feat} and {rng.choice(FEATURES)}.',
+        f'Clients in {ind} choose {provider} for {svc} because of {feat}.',
+    ]
+    return rng.choice(templates)
+
+
+def document_text(rng: random.Random, provider: str, size_bytes: int) -> str:
+    parts, total = [], 0
+    while total < size_bytes:
+        para = ' '.join(sentence(rng, provider) for _ in range(rng.randint(3, 7)))
+        parts.append(para)
+        total += len(para) + 2
+    return '\n\n'.join(parts)
+
+
+def _pdf_escape(s: str) -> str:
+    return s.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+
+
+def write_pdf(path: Path, text: str, width: int = 90, lines_per_page: int = 60):
+    """Minimal multi-page PDF with the text as Helvetica lines."""
+    lines = []
+    for para in text.split('\n'):
+        while len(para) > width:
+            cut = para.rfind(' ', 0, width)
+            cut = cut if cut > 0 else width
+            lines.append(para[:cut])
+            para = para[cut:].lstrip()
+        lines.append(para)
+    pages = [lines[i:i + lines_per_page] for i in range(0, len(lines), lines_per_page)] or [[]]
+
+    objects = ['<< /Type /Catalog /Pages 2 0 R >>', None, '<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>']
+    page_ids = []
+    for page in pages:
+        body = 'BT /F1 10 Tf 12 TL 40 800 Td ' + ' '.join(f'({_pdf_escape(line)}) Tj T*' for line in page) + ' ET'
+        objects.append(f'<< /Length {len(body.encode("latin-1", "replace"))} >>\nstream\n{body}\nendstream')
+        content_id = len(objects)
+        objects.append(f'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 842] '
+                       f'/Resources << /Font << /F1 3 0 R >> >> /Contents {content_id} 0 R >>')
+        page_ids.append(len(objects))
+    objects[1] = f'<< /Type /Pages /Kids [{" ".join(f"{i} 0 R" for i in page_ids)}] /Count {len(page_ids)} >>'
+
+    out = bytearray(b'%PDF-1.4\n')
+    offsets = []
+    for i, obj in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += f'{i} 0 obj\n{obj}\nendobj\n'.encode('latin-1', 'replace')
+    xref = len(out)
+    out += f'xref\n0 {len(objects) + 1}\n0000000000 65535 f \n'.encode()
+    out += ''.join(f'{o:010d} 00000 n \n' for o in offsets).encode()
+    out += f'trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n'.encode()
+    path.write_bytes(bytes(out))
+
+
+def write_docx(path: Path, text: str):
+    import docx
+
+    d = docx.Document()
+    for para in text.split('\n\n'):
+        d.add_paragraph(para)
+    d.save(str(path))
+
+
+def write_metadata(path: Path, provider: str, rng: random.Random):
+    import pandas as pd
+
+    pd.DataFrame([{
+        'name': f'{provider} Solutions',
+        'email': f'contact@{provider.lower()}.example',
+        'phone': f'+1-555-{rng.randint(1000, 9999)}',
+        'services_summary': ', '.join(rng.sample(SERVICES, 4)),
+        'charges': f'From {rng.randint(5, 60) * 100} USD per project',
+    }]).to_excel(path, index=False)
+
+
+def make_provider(providers_dir: Path, name: str, docs: int = 10, doc_kb: float = 4.0,
+                  formats=FORMATS, seed: int = 0) -> Path:
+    """Create (or overwrite) one synthetic provider; returns its directory."""
+    rng = random.Random(f'{seed}:{name}')
+    root = Path(providers_dir) / name
+    (root / 'excel').mkdir(parents=True, exist_ok=True)
+    (root / 'docs').mkdir(parents=True, exist_ok=True)
+    for old in (root / 'docs').iterdir():
+        old.unlink()
+    write_metadata(root / 'excel' / 'metadata.xlsx', name, rng)
+    for i in range(docs):
+        fmt = formats[i % len(formats)]
+        text = document_text(rng, name, int(doc_kb * 1024))
+        path = root / 'docs' / f'{name}_doc{i:04d}.{fmt}'
+        if fmt == 'txt':
+            path.write_text(text, encoding='utf-8')
+        elif fmt == 'pdf':
+            write_pdf(path, text)
+        elif fmt == 'docx':
+            write_docx(path, text)
+        else:
+            raise ValueError(f'unknown format {fmt!r}; expected one of {FORMATS}')
+    return root
+
+
+def questions(n: int, seed: int = 0) -> list:
+    """Deterministic mix of service, pricing, contact and location questions."""
+    rng = random.Random(f'questions:{seed}')
+    templates = [
+        lambda: f'Do you offer {rng.choice(SERVICES)} for {rng.choice(INDUSTRIES)} companies?',
+        lambda: f'How long does a {rng.choice(SERVICES)} project take?',
+        lambda: f'What does {rng.choice(SERVICES)} cost?',
+        lambda: f'Which projects have you delivered in {rng.choice(INDUSTRIES)}?',
+        lambda: f'Does the {rng.choice(SERVICES)} package include {rng.choice(FEATURES)}?',
+        lambda: f'Do you have a team in {rng.choice(CITIES)}?',
+        lambda: 'What is your email address?',
+        lambda: 'What is your phone number?',
+    ]
+    return [rng.choice(templates)() for _ in range(n)]
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--out', required=True, help='Providers directory to write into')
+    ap.add_argument('--providers', type=int, default=1)
+    ap.add_argument('--prefix', default='bench')
+    ap.add_argument('--docs', type=int, default=10)
+    ap.add_argument('--doc-kb', type=float, default=4.0)
+    ap.add_argument('--formats', default='txt,pdf,docx')
+    ap.add_argument('--seed', type=int, default=0)
+    args = ap.parse_args()
+    formats = [f.strip() for f in args.formats.split(',') if f.strip()]
+    for i in range(args.providers):
+        root = make_provider(Path(args.out), f'{args.prefix}{i:03d}', args.docs, args.doc_kb, formats, args.seed)
+        print(root)
+
+
+if __name__ == '__main__':
+    main()
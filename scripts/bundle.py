@@ -0,0 +1,76 @@
+r"""
+Export, import and verify provider bundles (app/bundle.py).
+
+A build worker exports each built provider; serving nodes import the bundle,
+which is verified and then switched in atomically:
+
+    # build machine
+    python scripts/bundle.py export acme --out /shared/bundles/acme.tar
+    # serving node
+    python scripts/bundle.py verify /shared/bundles/acme.tar
+    python scripts/bundle.py import /shared/bundles/acme.tar
+
+`--out` ending in .tar/.tar.gz writes an archive, anything else a directory.
+`import --link` serves an unpacked bundle directory in place (e.g. on shared
+storage) instead of copying it. Prints the manifest summary as JSON; verify
+exits 1 when the bundle is damaged.
+"""
+import argparse
+import json
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+
+def summary(manifest: dict) -> dict:
+    out = {k: manifest.get(k) for k in ('provider', 'build_id', 'embedding_model', 'n_chunks', 'index')}
+    out['files'] = len(manifest.get('files', {}))
+    out['bytes'] = sum(f['size'] for f in manifest.get('files', {}).values())
+    return out
+
+
+def main():
+    from app.config import BUNDLE_KEEP, PROVIDERS_DIR
+
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--providers-dir', default=str(PROVIDERS_DIR))
+    sub = ap.add_subparsers(dest='command', required=True)
+    exp = sub.add_parser('export', help='Bundle a built provider')
+    exp.add_argument('provider')
+    exp.add_argument('--out', required=True)
+    imp = sub.add_parser('import', help='Install a bundle as the serving copy of its provider')
+    imp.add_argument('bundle')
+    imp.add_argument('--provider', default=None, help='Install under this name instead of the bundled one')
+    imp.add_argument('--link', action='store_true', help='Serve a bundle directory in place, without copying')
+    imp.add_argument('--keep', type=int, default=BUNDLE_KEEP, help='Builds to keep per provider for rollback')
+    ver = sub.add_parser('verify', help='Check a bundle against its manifest checksums')
+    ver.add_argument('bundle')
+    ver.add_argument('--deep', action='store_true', help='Also load the index and check its vector count')
+    args = ap.parse_args()
+
+    from app.bundle import BundleError, export_bundle, import_bundle, read_bundle_manifest, verify_bundle
+
+    providers_dir = Path(args.providers_dir)
+    try:
+        if args.command == 'export':
+            manifest = export_bundle(providers_dir / args.provider, Path(args.out))
+            print(json.dumps(summary(manifest), indent=2))
+        elif args.command == 'import':
+            manifest = import_bundle(Path(args.bundle), providers_dir, provider=args.provider, link=args.link,
+                                     keep=args.keep)
+            print(json.dumps(summary(manifest), indent=2))
+        else:
+            problems = verify_bundle(Path(args.bundle), deep=args.deep)
+            out = summary(read_bundle_manifest(Path(args.bundle)))
+            out['problems'] = problems
+            print(json.dumps(out, indent=2))
+            sys.exit(1 if problems else 0)
+    except BundleError as e:
+        raise SystemExit(f'error: {e}')
+
+
+if __name__ == '__main__':
+    main()
@@ -11,6 +11,8 @@ Commands inside chat:
   /rebuild     Rebuild index for the active provider
   /switch NAME Switch to another provider
   /topk N      Set retrieval top_k (1-20)
+  /mode MODE   auto | chat | strict | extractive (no LLM)
+  /retrieval M dense | lexical (BM25, no model) | hybrid
 """
 import argparse
 import sys
@@ -25,11 +27,12 @@ if str(ROOT) not in sys.path:
 from app.app_db import get_client_provider
 from app.config import PROVIDERS_DIR
 from app.pipeline import build_index_for_provider
-from app.embeddings import default_embedding_provider, get_default_embedding_model
+from app.provider_store import has_index
+from app.retrieval import retrieve, RETRIEVAL_MODES
 from app.llm import call_llm_strict, call_llm_chat
+from app.context import build_context
+from app.extractive import extractive_answer
 from sqlitedict import SqliteDict
-import faiss
-import numpy as np
 import re
 
 
@@ -41,43 +44,28 @@ def resolve_provider(client_id: int | None, provider: str | None) -> str | None:
     return None
 
 
-HELP_MSG = """Commands: /exit, /rebuild, /switch NAME, /topk N"""
+HELP_MSG = """Commands: /exit, /rebuild, /switch NAME, /topk N, /mode MODE, /retrieval MODE"""
 
 def ensure_index(provider: str) -> bool:
     dirs = (PROVIDERS_DIR / provider)
-    idx_path = dirs / 'index' / 'faiss.bin'
     db_path = dirs / 'db' / 'metadata.sqlite'
-    if idx_path.exists() and db_path.exists():
+    if has_index(dirs / 'index') and db_path.exists():
         return True
     print(f"Index or DB missing for provider '{provider}'. Rebuilding...")
     build_index_for_provider(provider, PROVIDERS_DIR)
-    ok = idx_path.exists() and db_path.exists()
+    ok = has_index(dirs / 'index') and db_path.exists()
     print("Rebuild:", "OK" if ok else "FAILED")
     return ok
 
 
-def retrieve_and_answer(provider: str, question: str, top_k: int = 5, mode: str = "auto") -> tuple[str, list[str]]:
+def retrieve_and_answer(provider: str, question: str, top_k: int = 5, mode: str = "auto",
+                        retrieval: str = "dense") -> tuple[str, list[str]]:
     dirs = (PROVIDERS_DIR / provider)
-    idx_path = dirs / 'index' / 'faiss.bin'
     db_path = dirs / 'db' / 'metadata.sqlite'
     with SqliteDict(str(db_path)) as pdb:
-        vector_keys = pdb.get('vector_keys', [])
-        model_key = pdb.get('embedding_model') or get_default_embedding_model()
-        index = faiss.read_index(str(idx_path))
-        qemb = default_embedding_provider.embed_text_with_model(model_key, question)
-        qvec = np.array(qemb, dtype='float32').reshape(1, -1)
-        k = max(1, min(top_k, index.ntotal))
-        D, I = index.search(qvec, k)
-        hits = []
-        for dist, idx in zip(D[0], I[0]):
-            if idx < 0:
-                continue
-            key = vector_keys[idx]
-            chunk = pdb.get(key)
-            if chunk:
-                hits.append({'key': key, 'text': chunk['text'], 'score': float(dist)})
+        hits, qvec, model_key = retrieve(pdb, {'root': dirs, 'index': dirs / 'index'}, question, top_k, retrieval)
         # Build context and decide response mode
-        context = "\n\n".join([h['text'] for h in hits]) if hits else None
+        context = build_context(hits)[0] if hits else None
         use_chat = False
         if mode == "chat":
             use_chat = True
@@ -89,6 +77,11 @@ def retrieve_and_answer(provider: str, question: str, top_k: int = 5, mode: str
             greetings = ("hi", "hello", "hey", "yo", "sup")
             use_chat = (len(ql) <= 20 and any(ql.startswith(g) for g in greetings)) or (context is None)
 
+        if mode == "extractive":
+            if not hits or context is None:
+                return 'Not available.', []
+            # grounded by construction: no LLM call and no filtering needed
+            return extractive_answer(question, qvec, context, model_key), [h['key'] for h in hits]
         if use_chat:
             answer = call_llm_chat(question, context)
         else:
@@ -118,14 +111,17 @@ def main():
     ap.add_argument('--provider', type=str, default=None, help='Provider name (e.g., Fatima)')
     ap.add_argument('--client-id', type=int, default=None, help='Client id mapped to a provider')
     ap.add_argument('--top-k', type=int, default=5, help='Retrieval top_k (1-20)')
-    ap.add_argument('--mode', type=str, default='auto', choices=['auto','chat','strict'], help='Response mode')
+    ap.add_argument('--mode', type=str, default='auto', choices=['auto','chat','strict','extractive'], help='Response mode')
+    ap.add_argument('--retrieval', type=str, default='dense', choices=list(RETRIEVAL_MODES),
+                    help='dense (FAISS), lexical (BM25, no model) or hybrid')
     args = ap.parse_args()
 
     provider = resolve_provider(args.client_id, args.provider) or 'Fatima'
     top_k = max(1, min(args.top_k, 20))
     mode = args.mode
+    retrieval = args.retrieval
 
-    print(f"Active provider: {provider}  |  top_k={top_k}  |  mode={mode}")
+    print(f"Active provider: {provider}  |  top_k={top_k}  |  mode={mode}  |  retrieval={retrieval}")
     print(HELP_MSG)
 
     if not ensure_index(provider):
@@ -165,15 +161,23 @@ def main():
             continue
         if q.startswith('/mode'):
             parts = q.split()
-            if len(parts) >= 2 and parts[1] in ('auto','chat','strict'):
+            if len(parts) >= 2 and parts[1] in ('auto','chat','strict','extractive'):
                 mode = parts[1]
                 print(f"Set mode={mode}")
             else:
-                print("Usage: /mode <auto|chat|strict>")
+                print("Usage: /mode <auto|chat|strict|extractive>")
+            continue
+        if q.startswith('/retrieval'):
+            parts = q.split()
+            if len(parts) >= 2 and parts[1] in RETRIEVAL_MODES:
+                retrieval = parts[1]
+                print(f"Set retrieval={retrieval}")
+            else:
+                print("Usage: /retrieval <dense|lexical|hybrid>")
             continue
 
         try:
-            answer, sources = retrieve_and_answer(provider, q, top_k=top_k, mode=mode)
+            answer, sources = retrieve_and_answer(provider, q, top_k=top_k, mode=mode, retrieval=retrieval)
             print("Assistant>", answer)
             if sources:
                 print("Sources:", ", ".join(sources))
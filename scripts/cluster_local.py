@@ -0,0 +1,189 @@
+r"""
+Run a small cluster on this machine and exercise routing and rebalancing.
+
+Starts `--nodes` API processes (each with its own RAG_DATA_DIR) and a gateway
+(app/gateway.py), all offline: `hash:` embeddings and the stub LLM. Synthetic
+providers (bench/synth.py) are built once and placed on their owners for the
+initial membership (all nodes but the last). Then it:
+  1. queries every client through the gateway and checks the answering node
+     (X-Served-By) is an owner of the client's provider
+  2. joins the last node, checks the moved providers were copied, re-queries
+  3. removes the first node, checks again, re-queries
+Exits 1 on any mismatch. `--keep` leaves the processes running for manual
+poking (Ctrl-C to stop).
+
+Usage:
+    python scripts/cluster_local.py --nodes 3 --providers 8 --replicas 1
+"""
+import argparse
+import os
+import secrets
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+
+def wait_ready(url: str, timeout: float = 60.0):
+    import httpx
+
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if httpx.get(f'{url}/v1/ready', timeout=1.0).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise SystemExit(f'{url} did not become ready')
+
+
+def start(module: str, port: int, env: dict, log: Path) -> subprocess.Popen:
+    return subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', f'app.{module}:app', '--host', '127.0.0.1', '--port', str(port),
+         '--log-level', 'warning'],
+        cwd=str(ROOT), env=env, stdout=open(log, 'wb'), stderr=subprocess.STDOUT)
+
+
+def check_queries(gateway: str, clients: dict, ring, replicas: int, label: str) -> int:
+    import httpx
+
+    bad = 0
+    served = {}
+    for client_id, provider in clients.items():
+        r = httpx.post(f'{gateway}/v1/query', timeout=60,
+                       json={'client_id': client_id, 'question': 'What does data analytics cost?',
+                             'mode': 'extractive'})
+        node = r.headers.get('x-served-by')
+        owners = ring.owners(provider, replicas)
+        ok = r.status_code == 200 and node in owners
+        bad += not ok
+        served[node] = served.get(node, 0) + 1
+        if not ok:
+            print(f'  [{label}] client {client_id} ({provider}): status {r.status_code} from {node}, '
+                  f'owners {owners}: {r.text[:200]}')
+    print(f'[{label}] {len(clients) - bad}/{len(clients)} routed to an owner; served per node: {served}')
+    return bad
+
+
+def check_placement(node_dirs: dict, ring, replicas: int, providers, label: str) -> int:
+    bad = 0
+    for p in providers:
+        owners = ring.owners(p, replicas)
+        holders = sorted(n for n, d in node_dirs.items() if (d / 'providers' / p).is_dir())
+        if sorted(owners) != holders:
+            bad += 1
+            print(f'  [{label}] {p}: owners {owners}, present on {holders}')
+    print(f'[{label}] placement matches the ring for {len(providers) - bad}/{len(providers)} providers')
+    return bad
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--nodes', type=int, default=3, help='Total nodes; the last one joins mid-run')
+    ap.add_argument('--providers', type=int, default=8)
+    ap.add_argument('--replicas', type=int, default=1)
+    ap.add_argument('--docs', type=int, default=4)
+    ap.add_argument('--base-port', type=int, default=18100)
+    ap.add_argument('--workdir', default=None)
+    ap.add_argument('--keep', action='store_true')
+    args = ap.parse_args()
+    if args.nodes < 2:
+        raise SystemExit('need at least 2 nodes')
+
+    workdir = Path(args.workdir) if args.workdir else Path(tempfile.mkdtemp(prefix='rag-cluster-'))
+    token = secrets.token_hex(16)
+    names = [f'node{i}' for i in range(args.nodes)]
+    urls = {n: f'http://127.0.0.1:{args.base_port + 1 + i}' for i, n in enumerate(names)}
+    node_dirs = {n: workdir / n for n in names}
+    gateway_dir = workdir / 'gateway'
+    gateway_url = f'http://127.0.0.1:{args.base_port}'
+    common = dict(os.environ, EMBEDDING_MODEL='hash:384', LLM_BACKEND='stub', LLM_STUB_LATENCY_MS='1',
+                  WARMUP_ENABLED='0', CLUSTER_TOKEN=token, CLUSTER_REPLICAS=str(args.replicas),
+                  CLUSTER_HEALTH_INTERVAL_S='1')
+    common.pop('API_KEY', None)
+    common.pop('API_KEYS', None)
+
+    # this process writes the gateway's client mapping and builds the providers
+    os.environ.update(RAG_DATA_DIR=str(gateway_dir), EMBEDDING_MODEL='hash:384')
+    sys.path.insert(0, str(ROOT / 'bench'))
+    import synth
+    from app.app_db import set_client_provider
+    from app.cluster import HashRing
+    from app.pipeline import build_index_for_provider
+
+    initial = names[:-1]
+    ring = HashRing(initial)
+    providers = [f'prov{i:02d}' for i in range(args.providers)]
+    scratch = workdir / 'build'
+    clients = {}
+    for i, p in enumerate(providers):
+        synth.make_provider(scratch, p, args.docs, 4, ['txt'], 0)
+        build_index_for_provider(p, scratch)
+        for node in ring.owners(p, args.replicas):
+            shutil.copytree(scratch / p, node_dirs[node] / 'providers' / p)
+        set_client_provider(500 + i, p)
+        clients[500 + i] = p
+    shutil.rmtree(scratch, ignore_errors=True)
+
+    procs = []
+    failures = 0
+    try:
+        for n in names:
+            procs.append(start('main', int(urls[n].rsplit(':', 1)[1]), dict(common, RAG_DATA_DIR=str(node_dirs[n])),
+                               workdir / f'{n}.log'))
+        procs.append(start('gateway', args.base_port,
+                           dict(common, RAG_DATA_DIR=str(gateway_dir),
+                                CLUSTER_NODES=','.join(f'{n}={urls[n]}' for n in initial)),
+                           workdir / 'gateway.log'))
+        for url in list(urls.values()) + [gateway_url]:
+            wait_ready(url) if url != gateway_url else time.sleep(1.0)
+
+        import httpx
+
+        failures += check_placement({n: node_dirs[n] for n in initial}, ring, args.replicas, providers, 'initial')
+        failures += check_queries(gateway_url, clients, ring, args.replicas, 'initial')
+
+        joining = names[-1]
+        r = httpx.post(f'{gateway_url}/v1/cluster/nodes', json={'name': joining, 'url': urls[joining]}, timeout=600)
+        r.raise_for_status()
+        moves = r.json()['moves']
+        print(f'[join {joining}] {len(moves)} provider moves, failures: {r.json()["failed"]}')
+        ring = HashRing(names)
+        failures += check_placement(node_dirs, ring, args.replicas, providers, f'join {joining}')
+        failures += check_queries(gateway_url, clients, ring, args.replicas, f'join {joining}')
+
+        leaving = names[0]
+        r = httpx.delete(f'{gateway_url}/v1/cluster/nodes/{leaving}', timeout=600)
+        r.raise_for_status()
+        print(f'[leave {leaving}] {len(r.json()["moves"])} provider moves, failures: {r.json()["failed"]}')
+        ring = HashRing(names[1:])
+        failures += check_placement({n: node_dirs[n] for n in names[1:]}, ring, args.replicas, providers,
+                                    f'leave {leaving}')
+        failures += check_queries(gateway_url, clients, ring, args.replicas, f'leave {leaving}')
+
+        print('OK' if not failures else f'{failures} failure(s); logs in {workdir}')
+        if args.keep:
+            print(f'gateway {gateway_url}, nodes {urls}; Ctrl-C to stop')
+            while True:
+                time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for p in procs:
+            p.terminate()
+        for p in procs:
+            p.wait(timeout=10)
+        if not args.workdir and not failures:
+            shutil.rmtree(workdir, ignore_errors=True)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
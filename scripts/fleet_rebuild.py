@@ -0,0 +1,140 @@
+r"""
+Rebuild (re-embed) every provider, or a filtered subset, in parallel.
+
+Builds run on `--workers` processes; their embedding requests go to one
+shared, batching embedder in this process (app/fleet.py), which can be
+throttled for the OpenAI API with `--openai-rpm` / `--openai-tpm`. Progress is
+checkpointed after each provider: rerunning the same command after an
+interruption skips the providers already rebuilt (`--restart` ignores the
+checkpoint). Prints a throughput report as JSON at the end.
+
+Usage:
+    # re-embed everything not yet on the new model, 4 build processes
+    python scripts/fleet_rebuild.py --model openai:text-embedding-3-small --stale \
+        --workers 4 --embed-threads 4 --openai-rpm 3000 --openai-tpm 1000000
+    # a subset, exporting a bundle per provider for the serving nodes
+    python scripts/fleet_rebuild.py --match 'clinic-*' --export /shared/bundles
+"""
+import argparse
+import fnmatch
+import json
+import logging
+import os
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+
+def recorded_model(provider_dir: Path):
+    db_path = provider_dir / 'db' / 'metadata.sqlite'
+    if not db_path.exists():
+        return None
+    from sqlitedict import SqliteDict
+
+    with SqliteDict(str(db_path), flag='r') as db:
+        return db.get('embedding_model')
+
+
+def select_providers(providers_dir: Path, names, patterns, stale_for) -> list:
+    # imported bundles (symlinks) are serving copies without sources; not rebuildable here
+    available = sorted(p.name for p in providers_dir.iterdir()
+                       if p.is_dir() and not p.is_symlink() and not p.name.startswith('.') and (p / 'docs').is_dir())
+    selected = available
+    if names:
+        missing = sorted(set(names) - set(available))
+        if missing:
+            raise SystemExit(f'unknown providers: {", ".join(missing)}')
+        selected = [p for p in available if p in set(names)]
+    if patterns:
+        selected = [p for p in selected if any(fnmatch.fnmatch(p, pat) for pat in patterns)]
+    if stale_for:
+        selected = [p for p in selected if recorded_model(providers_dir / p) != stale_for]
+    return selected
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--providers-dir', default=None)
+    ap.add_argument('--providers', default=None, help='Comma-separated provider names')
+    ap.add_argument('--from-file', default=None, help='File with one provider name per line')
+    ap.add_argument('--match', action='append', default=[], help='Glob on provider names (repeatable)')
+    ap.add_argument('--stale', action='store_true', help='Only providers not already built with the model')
+    ap.add_argument('--limit', type=int, default=None)
+    ap.add_argument('--model', default=None, help='Embedding model key (overrides EMBEDDING_MODEL)')
+    ap.add_argument('--shards', type=int, default=None)
+    ap.add_argument('--shard-by', default=None, choices=('document', 'hash'))
+    ap.add_argument('--dedup', type=float, default=None,
+                    help='Near-duplicate chunk threshold (0 disables; default DEDUP_THRESHOLD)')
+    ap.add_argument('--chunker', default=None, choices=('chars', 'tokens'),
+                    help="Override every provider's chunker (default: its chunking.json, then CHUNKER)")
+    ap.add_argument('--chunk-size', type=int, default=None)
+    ap.add_argument('--chunk-overlap', type=int, default=None)
+    ap.add_argument('--workers', type=int, default=max(1, min(4, os.cpu_count() or 1)))
+    ap.add_argument('--embed-threads', type=int, default=1,
+                    help='Concurrent embedding batches (raise for remote APIs)')
+    ap.add_argument('--batch-texts', type=int, default=1024, help='Texts coalesced per embedding batch')
+    ap.add_argument('--openai-rpm', type=float, default=0, help='Embedding requests per minute (0 = unlimited)')
+    ap.add_argument('--openai-tpm', type=float, default=0, help='Embedding tokens per minute (0 = unlimited)')
+    ap.add_argument('--checkpoint', default=None)
+    ap.add_argument('--restart', action='store_true', help='Ignore the checkpoint and rebuild everything selected')
+    ap.add_argument('--export', default=None, help='Write a bundle per rebuilt provider into this directory')
+    ap.add_argument('--json', default=None, help='Also write the report here')
+    ap.add_argument('--dry-run', action='store_true', help='Only list the selected providers')
+    args = ap.parse_args()
+
+    if args.model:
+        # before app.config is imported, so the build processes inherit it too
+        os.environ['EMBEDDING_MODEL'] = args.model
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+
+    from app.config import PROVIDERS_DIR, RAG_DATA
+    from app.embeddings import get_default_embedding_model
+    from app.fleet import Throttle, rebuild_fleet
+
+    providers_dir = Path(args.providers_dir) if args.providers_dir else PROVIDERS_DIR
+    names = [n.strip() for n in (args.providers or '').split(',') if n.strip()]
+    if args.from_file:
+        names += [line.strip() for line in Path(args.from_file).read_text(encoding='utf-8').splitlines()
+                  if line.strip()]
+    model_key = get_default_embedding_model()
+    providers = select_providers(providers_dir, names, args.match, model_key if args.stale else None)
+    if args.limit:
+        providers = providers[:args.limit]
+    print(f'{len(providers)} providers selected for {model_key}', file=sys.stderr)
+    if args.dry_run:
+        print('\n'.join(providers))
+        return
+
+    checkpoint = Path(args.checkpoint) if args.checkpoint else RAG_DATA / 'fleet-rebuild.json'
+    if args.restart:
+        checkpoint.unlink(missing_ok=True)
+    if args.export:
+        Path(args.export).mkdir(parents=True, exist_ok=True)
+    build_kwargs = {k: v for k, v in (('shards', args.shards), ('shard_by', args.shard_by), ('dedup', args.dedup))
+                    if v is not None}
+    chunking = {k: v for k, v in (('chunker', args.chunker), ('size', args.chunk_size),
+                                  ('overlap', args.chunk_overlap)) if v is not None}
+    if chunking:
+        build_kwargs['chunking'] = chunking
+
+    def progress(kind, provider, info, counts, total):
+        finished = counts['done'] + counts['failed']
+        detail = (f"{info.get('chunks', 0)} chunks, {info.get('duplicates', 0)} duplicates dropped, "
+                  f"in {info.get('seconds')}s" if kind == 'done' else info.get('error'))
+        print(f'[{finished}/{total}] {provider}: {kind} ({detail})', file=sys.stderr)
+
+    report = rebuild_fleet(providers, providers_dir, checkpoint, workers=args.workers, build_kwargs=build_kwargs,
+                           embed_threads=args.embed_threads, batch_texts=args.batch_texts,
+                           throttle=Throttle(args.openai_rpm, args.openai_tpm),
+                           export_dir=Path(args.export) if args.export else None, progress=progress)
+    print(json.dumps(report, indent=2))
+    if args.json:
+        Path(args.json).write_text(json.dumps(report, indent=2))
+    sys.exit(1 if report['providers']['failed'] or report['interrupted'] else 0)
+
+
+if __name__ == '__main__':
+    main()
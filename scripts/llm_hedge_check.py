@@ -0,0 +1,86 @@
+r"""
+Exercise LLM request hedging against the local stub backend (no network).
+
+The stub injects a base latency plus a slow tail on a fraction of calls; the
+script runs the same workload with hedging off and on and prints latency
+percentiles and the hedge counters.
+
+Usage:
+    python scripts/llm_hedge_check.py --requests 300 --slow-rate 0.05 --slow-ms 800
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    pos = min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))
+    return ordered[pos]
+
+
+def run(llm, n: int, concurrency: int, hedge: bool):
+    llm._hedger = llm._Hedger(
+        hedge,
+        llm.LLM_HEDGE_PERCENTILE,
+        llm.LLM_HEDGE_MIN_DELAY_MS / 1000.0,
+        llm.LLM_HEDGE_MIN_SAMPLES,
+        llm.LLM_HEDGE_MAX_FRACTION,
+        workers=llm.LLM_MAX_CONCURRENCY,
+    )
+
+    def one(i):
+        start = time.monotonic()
+        # distinct questions so single-flight coalescing does not mask latency
+        llm.call_llm_strict(f'question {i}?', 'The stub answers from this context. More text.')
+        return time.monotonic() - start
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        latencies = list(pool.map(one, range(n)))
+    return latencies, llm.hedge_stats()
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--requests', type=int, default=300)
+    ap.add_argument('--concurrency', type=int, default=8)
+    ap.add_argument('--latency-ms', type=float, default=40)
+    ap.add_argument('--slow-ms', type=float, default=800)
+    ap.add_argument('--slow-rate', type=float, default=0.05)
+    ap.add_argument('--max-fraction', type=float, default=0.1)
+    args = ap.parse_args()
+
+    # configure the stub before app.config is imported
+    os.environ['LLM_BACKEND'] = 'stub'
+    os.environ['LLM_STUB_LATENCY_MS'] = str(args.latency_ms)
+    os.environ['LLM_STUB_SLOW_MS'] = str(args.slow_ms)
+    os.environ['LLM_STUB_SLOW_RATE'] = str(args.slow_rate)
+    os.environ['LLM_HEDGE_MAX_FRACTION'] = str(args.max_fraction)
+    os.environ.setdefault('LLM_MAX_CONCURRENCY', str(4 * args.concurrency))
+    os.environ.setdefault('LLM_MAX_CONCURRENCY_PER_PROVIDER', str(4 * args.concurrency))
+    from app import llm
+
+    for hedge in (False, True):
+        latencies, stats = run(llm, args.requests, args.concurrency, hedge)
+        print(f"hedging={'on ' if hedge else 'off'}  "
+              f"p50={percentile(latencies, 50) * 1000:.1f}ms  "
+              f"p95={percentile(latencies, 95) * 1000:.1f}ms  "
+              f"p99={percentile(latencies, 99) * 1000:.1f}ms  "
+              f"max={max(latencies) * 1000:.1f}ms")
+        if hedge:
+            # give discarded primaries time to return so latency_saved is credited
+            time.sleep(args.slow_ms / 1000.0)
+            print('hedge stats:', llm.hedge_stats())
+
+
+if __name__ == '__main__':
+    main()
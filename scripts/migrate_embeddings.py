@@ -0,0 +1,95 @@
+r"""
+Move a provider to another embedding model while it keeps serving (app/migration.py).
+
+    # re-embed into a shadow index at <= 50 chunks/s (resumable; rerun to continue)
+    python scripts/migrate_embeddings.py run acme --model onnx:all-MiniLM-L6-v2 --chunks-per-s 50
+    # how far along, and the overlap seen on live queries (MIGRATION_COMPARE_RATE)
+    python scripts/migrate_embeddings.py status acme
+    # offline check: top-k overlap and self-recall of sampled chunks, old vs new
+    python scripts/migrate_embeddings.py compare acme --sample 200
+    # serve from the new model; refuse unless live queries overlapped >= 0.6
+    python scripts/migrate_embeddings.py switch acme --min-overlap 0.6
+    python scripts/migrate_embeddings.py abort acme
+
+Prints JSON; exits 1 on a refused or failed step.
+"""
+import argparse
+import json
+import logging
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+
+def main():
+    from app.config import PROVIDERS_DIR
+
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--providers-dir', default=str(PROVIDERS_DIR))
+    sub = ap.add_subparsers(dest='command', required=True)
+    run = sub.add_parser('run', help='Start or resume re-embedding into the shadow index')
+    run.add_argument('provider')
+    run.add_argument('--model', required=True, help='Target embedding model key')
+    run.add_argument('--restart', action='store_true', help='Discard progress and start over')
+    run.add_argument('--batch', type=int, default=256)
+    run.add_argument('--chunks-per-s', type=float, default=0, help='Embedding rate cap (0 = unlimited)')
+    run.add_argument('--openai-rpm', type=float, default=0)
+    run.add_argument('--openai-tpm', type=float, default=0)
+    run.add_argument('--max-seconds', type=float, default=None, help='Stop after this long; rerun to resume')
+    st = sub.add_parser('status')
+    st.add_argument('provider')
+    cmp_ = sub.add_parser('compare', help='Compare live and shadow retrieval offline')
+    cmp_.add_argument('provider')
+    cmp_.add_argument('--questions', default=None, help='File with one question per line')
+    cmp_.add_argument('--sample', type=int, default=100, help='Chunks sampled as queries without --questions')
+    cmp_.add_argument('--top-k', type=int, default=5)
+    sw = sub.add_parser('switch', help='Serve from the shadow index and the new model')
+    sw.add_argument('provider')
+    sw.add_argument('--min-overlap', type=float, default=None,
+                    help='Refuse unless sampled live queries overlapped at least this much')
+    ab = sub.add_parser('abort')
+    ab.add_argument('provider')
+    args = ap.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+
+    from app import migration
+    from app.fleet import Throttle
+
+    provider_dir = Path(args.providers_dir) / args.provider
+    if not provider_dir.is_dir():
+        raise SystemExit(f'unknown provider {args.provider}')
+    index_dir = provider_dir / 'index'
+    try:
+        if args.command == 'run':
+            migration.start(provider_dir, args.model, restart=args.restart)
+
+            def progress(state):
+                print(f"{state['done']}/{state['n_chunks']} chunks", file=sys.stderr)
+
+            out = migration.run(provider_dir, batch=args.batch, chunks_per_s=args.chunks_per_s,
+                                throttle=Throttle(args.openai_rpm, args.openai_tpm), progress=progress,
+                                max_seconds=args.max_seconds)
+        elif args.command == 'status':
+            out = migration.status(index_dir)
+            if out is not None:
+                out['online'] = migration.online_overlap(index_dir)
+        elif args.command == 'compare':
+            questions = None
+            if args.questions:
+                questions = [q.strip() for q in Path(args.questions).read_text(encoding='utf-8').splitlines()
+                             if q.strip()]
+            out = migration.compare(provider_dir, questions=questions, sample=args.sample, top_k=args.top_k)
+        elif args.command == 'switch':
+            out = migration.switch(provider_dir, min_overlap=args.min_overlap)
+        else:
+            out = {'aborted': migration.abort(provider_dir)}
+    except migration.MigrationError as e:
+        raise SystemExit(f'error: {e}')
+    print(json.dumps(out, indent=2))
+
+
+if __name__ == '__main__':
+    main()
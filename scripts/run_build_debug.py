@@ -17,8 +17,8 @@ def main():
     args = ap.parse_args()
     try:
         print(f'Running build_index_for_provider for {args.provider}...')
-        build_index_for_provider(args.provider, PROVIDERS_DIR)
-        print('Build completed successfully')
+        report = build_index_for_provider(args.provider, PROVIDERS_DIR)
+        print(f'Build completed successfully: {report}')
     except Exception:
         print('Exception during build:')
         traceback.print_exc()
@@ -16,7 +16,6 @@ from app.embeddings import default_embedding_provider, get_default_embedding_mod
 from app.llm import call_llm_strict
 from sqlitedict import SqliteDict
 import faiss
-import numpy as np
 
 def main():
     client_id = 100
@@ -38,8 +37,7 @@ def main():
             index = faiss.read_index(str(idx_path))
             # Compute query embedding using the recorded model or default
             model_key = pdb.get('embedding_model') or get_default_embedding_model()
-            qvec_raw = default_embedding_provider.embed_text_with_model(model_key, question)
-            qvec = np.array(qvec_raw, dtype='float32').reshape(1, -1)
+            qvec = default_embedding_provider.embed_texts_with_model(model_key, [question])
             D, I = index.search(qvec, min(5, index.ntotal))
             print('faiss results indices:', I, 'distances:', D)
             hits = []
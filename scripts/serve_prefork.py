@@ -0,0 +1,164 @@
+r"""
+Prefork server: load models and hot indexes once, then fork uvicorn workers.
+
+`uvicorn --workers N` starts N fresh interpreters and each one loads its own
+copy of the embedding model and provider indexes. This script instead binds
+the listening socket, runs the startup warmup (app/warmup.py) in the master,
+freezes the GC and only then forks the workers, so the model weights and
+FAISS/lexical indexes are shared copy-on-write between all of them. Workers
+are restarted if they die; SIGTERM/SIGINT are forwarded to the workers.
+Set PROMETHEUS_MULTIPROC_DIR so /metrics aggregates all workers (app/metrics.py);
+the directory is cleared at startup.
+
+Measure the effect with bench/prefork_rss.py.
+
+Usage:
+    python scripts/serve_prefork.py --workers 8 --port 8000
+    python scripts/serve_prefork.py --workers 8 --models sbert:all-MiniLM-L6-v2 --providers Fatima
+"""
+import argparse
+import gc
+import logging
+import os
+import signal
+import socket
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+logger = logging.getLogger('serve_prefork')
+
+
+def bind_socket(host: str, port: int, backlog: int) -> socket.socket:
+    family = socket.AF_INET6 if ':' in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+def limit_native_threads(threads: int):
+    """Pin torch/faiss thread pools in a forked worker.
+
+    OpenMP pools started in the master are not usable after fork(), and N
+    workers each spawning one thread per core would oversubscribe the CPU.
+    """
+    if 'torch' in sys.modules:
+        sys.modules['torch'].set_num_threads(threads)
+    if 'faiss' in sys.modules:
+        sys.modules['faiss'].omp_set_num_threads(threads)
+
+
+def run_worker(sock: socket.socket, args):
+    import uvicorn
+    from app.embeddings import default_embedding_provider
+
+    # the master's handlers forward signals; uvicorn installs its own
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    limit_native_threads(args.threads_per_worker)
+    default_embedding_provider.after_fork()
+
+    from app.main import app
+
+    config = uvicorn.Config(app, log_level=args.log_level, timeout_keep_alive=args.keep_alive)
+    uvicorn.Server(config).run(sockets=[sock])
+
+
+def spawn(sock, args) -> int:
+    pid = os.fork()
+    if pid == 0:
+        code = 0
+        try:
+            run_worker(sock, args)
+        except BaseException:
+            logger.exception('worker %d crashed', os.getpid())
+            code = 1
+        finally:
+            os._exit(code)
+    return pid
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--host', default='127.0.0.1')
+    ap.add_argument('--port', type=int, default=8000)
+    ap.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    ap.add_argument('--backlog', type=int, default=2048)
+    ap.add_argument('--threads-per-worker', type=int, default=1, help='torch/faiss threads in each worker')
+    ap.add_argument('--models', default=None, help='Comma-separated model keys to preload (default: WARMUP_MODELS)')
+    ap.add_argument('--providers', default=None, help='Comma-separated providers to preload (default: WARMUP_PROVIDERS / top-N)')
+    ap.add_argument('--keep-alive', type=int, default=5)
+    ap.add_argument('--log-level', default='info')
+    args = ap.parse_args()
+
+    logging.basicConfig(level=getattr(logging, args.log_level.upper(), logging.INFO),
+                        format='%(asctime)s %(process)d %(name)s %(levelname)s %(message)s')
+    # HF tokenizers disables (and warns about) its thread pool after fork anyway
+    os.environ.setdefault('TOKENIZERS_PARALLELISM', 'false')
+
+    sock = bind_socket(args.host, args.port, args.backlog)
+
+    multiproc_dir = os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+    if multiproc_dir:
+        # samples from a previous run would be merged into this one's /metrics
+        Path(multiproc_dir).mkdir(parents=True, exist_ok=True)
+        for stale in Path(multiproc_dir).glob('*.db'):
+            stale.unlink()
+
+    from app import metrics, warmup
+    import app.main  # noqa: F401  import the app (and its dependencies) before forking
+
+    def split(value):
+        return [x.strip() for x in value.split(',') if x.strip()] if value is not None else None
+
+    state = warmup.warmup(models=split(args.models), providers=split(args.providers))
+    if state['errors']:
+        logger.warning('warmup errors: %s', state['errors'])
+    logger.info('master %d warmed in %ss (models=%s providers=%s); forking %d workers',
+                os.getpid(), state['seconds'], state['models'], state['providers'], args.workers)
+
+    # move everything allocated so far out of the collector's reach, so GC
+    # passes in the workers do not write to (and un-share) the master's pages
+    gc.collect()
+    gc.freeze()
+
+    workers = {spawn(sock, args) for _ in range(args.workers)}
+    stopping = False
+
+    def stop(signum, _frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(workers):
+            try:
+                os.kill(pid, signum)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    while workers:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        workers.discard(pid)
+        metrics.mark_process_dead(pid)
+        if not stopping:
+            logger.warning('worker %d exited with status %d; restarting', pid, status)
+            time.sleep(0.5)
+            workers.add(spawn(sock, args))
+    sock.close()
+
+
+if __name__ == '__main__':
+    main()